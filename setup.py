@@ -35,6 +35,7 @@ setup(
         'usbq': ['usbq_base = usbq.plugin'],
     },
     install_requires=requirements,
+    extras_require={'zstd': ['zstandard']},
     license="MIT license",
     long_description='USBQ -- Python programming framework for monitoring and modifying USB communications.',
     include_package_data=True,
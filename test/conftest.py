@@ -1,6 +1,37 @@
+import sys
+
+import pytest
 from scapy.config import conf
 
+from usbq.capture import Capture
+from usbq.capture import usbq_messages
+from usbq.pm import HOOK_MOD
+from usbq.pm import pm
 from usbq.usbpcap import USBPcap
 
+SAMPLE = 'samples/ant_plus_dongle.pcap'
+
 # Configure scapy to parse USB
 conf.l2types.register(220, USBPcap)
+
+
+@pytest.fixture(autouse=True)
+def isolate_plugins():
+    'Unregister plugins that a test left registered with the global plugin manager.'
+
+    before = set(name for name, plugin in pm.list_name_plugin())
+    yield
+    for name, plugin in pm.list_name_plugin():
+        if name not in before:
+            pm.unregister(name=name)
+
+    # Forget usbq_hooks.py modules imported from a test's hook file
+    sys.modules.pop(HOOK_MOD, None)
+
+
+@pytest.fixture(scope='session')
+def sample_messages():
+    'usbq_core messages, as dissected from the wire, of the sample capture.'
+
+    with Capture(SAMPLE, index=False) as cap:
+        return [cls(data) for rec, cls, data in usbq_messages(cap)]
@@ -1,5 +1,11 @@
+from scapy.all import raw
+
+from usbq.dissect.usb import GetDescriptor
 from usbq.plugins.decode import USBDecode
 from usbq.plugins.encode import USBEncode
+from usbq.usbmitm_proto import ManagementMessage
+from usbq.usbmitm_proto import USBEpHeader
+from usbq.usbmitm_proto import USBMessageHost
 
 
 def test_decode_encode():
@@ -8,3 +14,54 @@ def test_decode_encode():
     encoder = USBEncode()
     pkt = decoder.usbq_host_decode(data=data)
     assert data == encoder.usbq_host_encode(pkt=pkt)
+
+
+def test_encode_dirty():
+    data = b'\x1a\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x80\x06\x00\x01\x00\x00@\x00'
+    decoder = USBDecode()
+    encoder = USBEncode()
+
+    pkt = decoder.usbq_host_decode(data=data)
+    assert encoder.usbq_host_encode(pkt=pkt) is data
+    assert encoder.stats == {'rebuild': 0, 'passthrough': 1}
+
+    # Nested assignment must be rebuilt
+    pkt.content.request.wLength = 0x12
+    assert encoder.usbq_host_encode(pkt=pkt) == data[:-2] + b'\x12\x00'
+    assert encoder.stats == {'rebuild': 1, 'passthrough': 1}
+
+
+def test_decode_lazy():
+    data = b'\x1a\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x80\x06\x00\x01\x00\x00@\x00'
+    pkt = USBDecode().usbq_host_decode(data=data)
+
+    assert pkt.type == USBMessageHost.MitmType.USB
+    assert pkt.len == len(data)
+    assert pkt.ep.is_ctrl_0()
+    assert ManagementMessage not in pkt
+    assert not pkt.is_dissected()
+
+    assert pkt.content.request.wLength == 0x40
+    assert pkt.is_dissected()
+    assert GetDescriptor in pkt
+    assert raw(pkt) == data
+
+
+def test_decode_lazy_ep():
+    data = b'\x1a\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x80\x06\x00\x01\x00\x00@\x00'
+    pkt = USBDecode().usbq_host_decode(data=data)
+    ep = pkt.ep
+    assert type(ep) is USBEpHeader
+
+    # Same type after dissection, reflecting changes to the packet
+    pkt.content.ep.epnum = 2
+    assert pkt.is_dissected()
+    assert type(pkt.ep) is USBEpHeader
+    assert pkt.ep.epnum == 2
+    assert pkt.ep == USBEpHeader(2, ep.eptype, ep.epdir)
+
+
+def test_decode_eager():
+    data = b'\x1a\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x80\x06\x00\x01\x00\x00@\x00'
+    pkt = USBDecode(lazy=False).usbq_host_decode(data=data)
+    assert type(pkt) is USBMessageHost
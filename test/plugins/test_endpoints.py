@@ -0,0 +1,102 @@
+import pytest
+from scapy.compat import raw
+
+from usbq.capture import Capture
+from usbq.capture import usbq_messages
+from usbq.defs import USBDefs
+from usbq.dissect.usb import bEndpointAddress
+from usbq.dissect.usb import ConfigurationDescriptor
+from usbq.dissect.usb import EndpointDescriptor
+from usbq.dissect.usb import InterfaceDescriptor
+from usbq.dissect.usb import SetInterface
+from usbq.plugins.endpoints import EndpointTable
+from usbq.usbmitm_proto import LazyUSBMessage
+from usbq.usbmitm_proto import ManagementMessage
+from usbq.usbmitm_proto import ManagementNewDevice
+from usbq.usbmitm_proto import USBEp
+from usbq.usbmitm_proto import USBMessageDevice
+from usbq.usbmitm_proto import USBMessageHost
+from usbq.usbmitm_proto import USBMessageRequest
+
+SAMPLE = 'samples/ant_plus_dongle.pcap'
+
+URB_IN = USBMessageHost.URBEPDirection.URB_IN
+URB_OUT = USBMessageHost.URBEPDirection.URB_OUT
+
+
+@pytest.mark.parametrize('lazy', [True, False])
+def test_learn_from_capture(lazy):
+    table = EndpointTable()
+    with Capture(SAMPLE, index=False) as cap:
+        for rec, cls, data in usbq_messages(cap):
+            pkt = LazyUSBMessage(cls, data) if lazy else cls(data)
+            table.usbq_log_pkt(pkt)
+
+    assert table.active == 1
+    assert sorted(table.table) == [0x01, 0x81]
+    info = table.lookup(USBEp(epnum=1, epdir=URB_IN))
+    assert info.address == 0x81
+    assert info.interface == 0
+    assert info.maxpacket == 64
+    assert table.lookup(USBEp(epnum=1, epdir=URB_OUT)).address == 0x01
+
+
+def test_lookup_capture():
+    table = EndpointTable()
+    with Capture(SAMPLE, index=False) as cap:
+        msgs = list(usbq_messages(cap))
+        for rec, cls, data in msgs:
+            table.usbq_log_pkt(LazyUSBMessage(cls, data))
+
+        for rec, cls, data in msgs:
+            if rec.epnum == 0:
+                continue
+            pkt = LazyUSBMessage(cls, data)
+            address = rec.epnum
+            if rec.direction == USBDefs.EP.Direction.IN:
+                address |= 0x80
+            assert table.lookup(pkt.ep).address == address
+
+
+def configuration():
+    return ConfigurationDescriptor(
+        descriptors=[
+            InterfaceDescriptor(bInterfaceNumber=0, bInterfaceClass=3),
+            EndpointDescriptor(bEndpointAddress=bEndpointAddress(endpoint_number=1)),
+            InterfaceDescriptor(bInterfaceNumber=1, bInterfaceClass=8),
+            InterfaceDescriptor(
+                bInterfaceNumber=1, bAlternateSetting=1, bInterfaceClass=8
+            ),
+            EndpointDescriptor(
+                bEndpointAddress=bEndpointAddress(endpoint_number=2),
+                wMaxPacketSize=512,
+            ),
+        ]
+    )
+
+
+def test_new_device_and_set_interface():
+    table = EndpointTable()
+    newdev = USBMessageDevice(
+        type=2,
+        content=ManagementMessage(
+            management_type=1,
+            management_content=ManagementNewDevice(configuration=configuration()),
+        ),
+    )
+    table.usbq_log_pkt(LazyUSBMessage(USBMessageDevice, raw(newdev)))
+    assert sorted(table.table) == [0x81]
+    assert table[0x81].cls == 3
+
+    setintf = USBMessageHost(
+        type=0,
+        content=USBMessageRequest(
+            ep=USBEp(epnum=0, eptype=0, epdir=0),
+            request=SetInterface(bAlternateSetting=1, wInterface=1),
+        ),
+    )
+    table.usbq_log_pkt(LazyUSBMessage(USBMessageHost, raw(setintf)))
+    assert sorted(table.table) == [0x81, 0x82]
+    assert table[0x82].alternate == 1
+    assert table[0x82].cls == 8
+    assert table[0x82].maxpacket == 512
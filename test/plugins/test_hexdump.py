@@ -12,3 +12,8 @@ def test_hexdump(capsys, cls):
     Hexdump().usbq_log_pkt(pkt)
     captured = capsys.readouterr()
     assert len(captured.out) > 0
+
+
+def test_hexdump_filter(capsys):
+    Hexdump(filter='src == host').usbq_log_pkt(USBMessageDevice())
+    assert capsys.readouterr().out == ''
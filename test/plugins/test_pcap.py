@@ -0,0 +1,84 @@
+import pytest
+from scapy.all import raw
+from scapy.all import rdpcap
+
+from usbq.defs import USBDefs
+from usbq.plugins.decode import USBDecode
+from usbq.plugins.pcap import PcapFileWriter
+from usbq.usbmitm_proto import USBEp
+from usbq.usbmitm_proto import USBMessageHost
+from usbq.usbmitm_proto import USBMessageRequest
+
+DATA = b'\x1a\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x80\x06\x00\x01\x00\x00@\x00'
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_pcap(tmp_path, background):
+    fn = tmp_path / 'usb.pcap'
+    writer = PcapFileWriter(pcap=fn, background=background, high_water=4)
+    decoder = USBDecode()
+
+    for i in range(10):
+        writer.usbq_log_pkt(decoder.usbq_host_decode(data=DATA))
+    writer.usbq_teardown()
+
+    assert writer.stats.written == 10
+    assert writer.stats.dropped == 0
+    assert writer.depth == 0
+    assert len(rdpcap(str(fn))) == 10
+
+    # Packets logged after teardown are ignored
+    writer.usbq_log_pkt(decoder.usbq_host_decode(data=DATA))
+    assert writer.stats.written == 10
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_pcap_rotate(tmp_path, background):
+    writer = PcapFileWriter(
+        pcap=tmp_path / 'usb.pcap',
+        background=background,
+        high_water=1,
+        rotate_size=200,
+        retention=3,
+        compress='gzip',
+    )
+    decoder = USBDecode()
+
+    # Bulk OUT writes log a request and a synthesized ack
+    out = USBMessageHost(
+        type=0,
+        content=USBMessageRequest(
+            ep=USBEp(
+                epnum=1,
+                eptype=USBDefs.EP.TransferType.BULK,
+                epdir=USBMessageHost.URBEPDirection.URB_OUT,
+            ),
+            data=b'x' * 64,
+        ),
+    )
+    for i in range(10):
+        writer.usbq_log_pkt(decoder.usbq_host_decode(data=raw(out)))
+    writer.usbq_teardown()
+
+    assert writer.stats.written == 20
+    assert writer.stats.segments > 3
+
+    files = sorted(tmp_path.iterdir())
+    assert [str(fn) for fn in files] == writer.segments
+    assert len(files) == 3
+    for fn in files:
+        assert fn.name.startswith('usb-') and fn.name.endswith('.pcap.gz')
+        records = [raw(rec) for rec in rdpcap(str(fn))]
+        assert len(records) % 2 == 0
+        assert [rec[8:9] for rec in records] == [b'S', b'C'] * (len(records) // 2)
+
+
+@pytest.mark.parametrize('expr,written', [('ep == 0x81', 0), ('epnum == 0', 1)])
+def test_pcap_filter(tmp_path, expr, written):
+    writer = PcapFileWriter(pcap=tmp_path / 'usb.pcap', filter=expr)
+    decoder = USBDecode()
+
+    writer.usbq_log_pkt(decoder.usbq_host_decode(data=DATA))
+    writer.usbq_teardown()
+
+    assert writer.stats.written == written
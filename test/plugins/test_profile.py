@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from usbq.hookspec import hookimpl
+from usbq.plugins.profile import HookProfiler
+from usbq.pm import pm
+
+
+class Slow:
+    @hookimpl
+    def usbq_log_pkt(self, pkt):
+        time.sleep(0.001)
+
+
+class Fast:
+    @hookimpl
+    def usbq_log_pkt(self, pkt):
+        pass
+
+
+@pytest.fixture
+def profiler():
+    pm.register(Slow(), name='slow')
+    profiler = HookProfiler(sample=2)
+    pm.register(profiler, name='profile')
+    yield profiler
+    profiler.unwrap()
+
+
+def test_profile_hooks(profiler):
+    # Registered after the profiler: wrapped on the next tick
+    pm.register(Fast(), name='fast')
+    pm.hook.usbq_tick()
+
+    for i in range(10):
+        pm.hook.usbq_log_pkt(pkt=None)
+
+    slow = profiler.stats[('usbq_log_pkt', 'slow')]
+    fast = profiler.stats[('usbq_log_pkt', 'fast')]
+    assert slow.calls == fast.calls == 10
+    assert slow.sampled == 5
+    assert slow.mean_wall_ns >= 1e6
+    assert slow.mean_cpu_ns < slow.mean_wall_ns
+    assert profiler.rows()[0][0] == ('usbq_log_pkt', 'slow')
+    assert 'sampled 1 in 2' in profiler.report()
+    assert ('usbq_tick', 'profile') not in profiler.stats
+
+
+def test_unwrap(profiler):
+    profiler.unwrap()
+    pm.hook.usbq_log_pkt(pkt=None)
+    assert profiler.stats[('usbq_log_pkt', 'slow')].calls == 0
+
+
+def test_wrap_generation(profiler, monkeypatch):
+    calls = []
+    monkeypatch.setattr(profiler, '_profiled', lambda *args: calls.append(args))
+
+    # Nothing registered since the last wrap
+    pm.hook.usbq_tick()
+    assert calls == []
+
+    pm.register(Fast(), name='fast')
+    pm.hook.usbq_tick()
+    assert [hook_name for hook_name, impl in calls] == ['usbq_log_pkt']
+
+
+def test_profiled_kwargs(profiler):
+    impl = pm.hook.usbq_log_pkt.get_hookimpls()[0]
+    impl.function(pkt=None)
+    assert profiler.stats[('usbq_log_pkt', 'slow')].calls == 1
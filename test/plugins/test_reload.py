@@ -1,9 +1,14 @@
+import os
+import select
 from pathlib import Path
 
 import pytest
 
+from usbq.plugins.proxy import ProxyPlugin
+from usbq.plugins.reload import GUARD_NAME
 from usbq.plugins.reload import ReloadUSBQHooks
 from usbq.pm import enable_plugins
+from usbq.pm import HOOK_MOD
 from usbq.pm import pm
 
 VER_ONE = '''
@@ -24,6 +29,15 @@ class USBQHooks():
         return True
 '''
 
+RAISES = '''
+from usbq.hookspec import hookimpl
+
+class USBQHooks():
+    @hookimpl
+    def usbq_log_pkt(self, pkt):
+        raise RuntimeError('Broken hook')
+'''
+
 
 @pytest.fixture
 def hookfile():
@@ -43,3 +57,125 @@ def test_reload(hookfile):
     hookfile.write_text(VER_TWO)
     reloader.usbq_tick()
     assert all(pm.hook.usbq_host_has_packet())
+
+
+def test_inotify(tmp_path):
+    hookfile = tmp_path / 'usbq_hooks.py'
+    hookfile.write_text(VER_ONE)
+    reloader = ReloadUSBQHooks(hookfile=str(hookfile))
+    if reloader._watcher is None:
+        pytest.skip('inotify is not available')
+
+    assert not reloader.changed
+    (tmp_path / 'other.py').write_text(VER_ONE)
+    assert not reloader.changed
+    hookfile.write_text(VER_TWO)
+    assert reloader.changed
+    assert not reloader.changed
+
+    # Event-driven engines select on the watcher
+    pm.register(reloader, name='reload_test')
+    sources = {}
+    for srcs in pm.hook.usbq_event_sources():
+        sources.update(srcs)
+    watcher, callback = sources['reload']
+    assert watcher.fileno() >= 0
+
+    hookfile.write_text(VER_ONE)
+    callback()
+    assert reloader.changed
+
+    pm.hook.usbq_teardown()
+    assert reloader._watcher is None
+
+
+def test_inotify_other_files(tmp_path):
+    hookfile = tmp_path / 'usbq_hooks.py'
+    hookfile.write_text(VER_ONE)
+    reloader = ReloadUSBQHooks(hookfile=str(hookfile))
+    if reloader._watcher is None:
+        pytest.skip('inotify is not available')
+    pm.register(reloader, name='reload_test')
+    sources = {}
+    for srcs in pm.hook.usbq_event_sources():
+        sources.update(srcs)
+    watcher, callback = sources['reload']
+
+    # Appending to a capture or log in the directory does not wake the watcher
+    with open(tmp_path / 'usb.pcap', 'wb') as f:
+        assert watcher.read() == set()
+        for i in range(100):
+            f.write(b'packet')
+            f.flush()
+            assert select.select([watcher], [], [], 0)[0] == []
+
+    # Closing it does, but the event is dropped
+    assert select.select([watcher], [], [], 0)[0] == [watcher]
+    callback()
+    assert not reloader.changed
+
+    pm.hook.usbq_teardown()
+
+
+@pytest.mark.timeout(2)
+def test_inotify_proxy_wait(tmp_path, monkeypatch):
+    hookfile = tmp_path / 'usbq_hooks.py'
+    hookfile.write_text(VER_ONE)
+    reloader = ReloadUSBQHooks(hookfile=str(hookfile))
+    if reloader._watcher is None:
+        pytest.skip('inotify is not available')
+    proxy = ProxyPlugin(device_addr='127.0.0.1', device_port=55562, timeout=0)
+    pm.register(reloader, name='reload_test')
+    pm.register(proxy, name='proxy_test')
+
+    # The synchronous engine waits on the watcher with the proxy sockets
+    assert proxy.usbq_wait_for_packet() is None
+    read = reloader._watcher.read
+    monkeypatch.setattr(reloader._watcher, 'read', lambda: pytest.fail('read'))
+    assert not reloader.changed
+
+    monkeypatch.setattr(reloader._watcher, 'read', read)
+    hookfile.write_text(VER_TWO)
+    proxy.usbq_wait_for_packet()
+    assert reloader.changed
+
+    pm.hook.usbq_teardown()
+    proxy.usbq_wait_for_packet()
+
+
+def test_poll(tmp_path):
+    hookfile = tmp_path / 'usbq_hooks.py'
+    hookfile.write_text(VER_ONE)
+    os.utime(hookfile, (1, 1))
+    reloader = ReloadUSBQHooks(hookfile=str(hookfile), inotify=False, poll_interval=0)
+    assert reloader._watcher is None
+
+    assert not reloader.changed
+    os.utime(hookfile, (2, 2))
+    assert reloader.changed
+    assert not reloader.changed
+
+    # Not checked again before the poll interval
+    reloader.poll_interval = 60
+    os.utime(hookfile, (3, 3))
+    assert not reloader.changed
+
+
+def test_guard(hookfile):
+    enable_plugins(pm)
+    pm.hook.usbq_tick()
+    assert pm.get_plugin(GUARD_NAME) is None
+
+    hookfile.write_text(RAISES)
+    enable_plugins(pm, disabled=['reload'])
+    pm.hook.usbq_tick()
+
+    # Only the hooks of usbq_hooks.py are wrapped
+    guard = pm.get_plugin(GUARD_NAME)
+    assert [caller.name for caller in pm.get_hookcallers(guard)] == ['usbq_log_pkt']
+
+    # Errors disable usbq_hooks.py instead of propagating
+    pm.hook.usbq_log_pkt(pkt=None)
+    assert pm.get_plugin(HOOK_MOD) is None
+    pm.hook.usbq_tick()
+    assert pm.get_plugin(GUARD_NAME) is None
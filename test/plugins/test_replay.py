@@ -0,0 +1,109 @@
+import shutil
+
+import pytest
+
+from usbq.engine import AsyncUSBQEngine
+from usbq.engine import USBQEngine
+from usbq.hookspec import hookimpl
+from usbq.plugins.decode import USBDecode
+from usbq.plugins.encode import USBEncode
+from usbq.plugins.replay import ReplayPlugin
+from usbq.pm import pm
+from usbq.usbmitm_proto import USBMessageDevice
+from usbq.usbmitm_proto import USBMessageHost
+
+SAMPLE = 'samples/ant_plus_dongle.pcap'
+
+# usbq_core messages in the sample capture
+MESSAGES = 187
+
+
+class Log:
+    def __init__(self):
+        self.seen = []
+
+    @hookimpl
+    def usbq_log_pkt(self, pkt):
+        self.seen.append(pkt.cls)
+
+
+@pytest.fixture
+def capture(tmp_path):
+    fn = tmp_path / 'usb.pcap'
+    shutil.copy(SAMPLE, fn)
+    return fn
+
+
+def replay(batch=False, engine=USBQEngine, **kwargs):
+    plugin = ReplayPlugin(**kwargs)
+    logger = Log()
+    for name, p in [
+        ('replay', plugin),
+        ('decode', USBDecode()),
+        ('encode', USBEncode()),
+        ('log', logger),
+    ]:
+        pm.register(p, name=name)
+    engine(batch=batch).run()
+    return plugin, logger
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.parametrize('batch', [False, True])
+def test_replay(capture, batch):
+    plugin, logger = replay(batch=batch, pcap=capture)
+
+    assert plugin.stats.packets == MESSAGES
+    assert plugin.stats.sent == MESSAGES
+    assert plugin.stats.rate > 0
+    assert len(logger.seen) == MESSAGES
+    assert set(logger.seen) == {USBMessageHost, USBMessageDevice}
+
+    # The first control request comes from the host
+    assert logger.seen[0] is USBMessageHost
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.parametrize('batch', [False, True])
+def test_replay_async(capture, batch):
+    plugin, logger = replay(batch=batch, engine=AsyncUSBQEngine, pcap=capture)
+
+    assert plugin.stats.packets == MESSAGES
+    assert plugin.stats.sent == MESSAGES
+    assert logger.seen[0] is USBMessageHost
+
+    # Driven by the readiness pipes rather than polled on each tick
+    assert plugin.stats.elapsed < 0.5
+
+
+def test_replay_event_sources(capture):
+    plugin = ReplayPlugin(pcap=capture)
+    sources = plugin.usbq_event_sources()
+    assert set(sources) == {'device', 'host'}
+
+    # The first packet comes from the host
+    assert plugin._signaled == {False: False, True: True}
+    plugin.usbq_get_host_packet()
+    assert plugin._signaled == {False: True, True: False}
+    plugin.usbq_teardown()
+    assert plugin._pipes is None
+
+    # Paced packets are polled
+    plugin = ReplayPlugin(pcap=capture, pacing='rate')
+    assert plugin.usbq_event_sources() == {}
+    plugin.usbq_teardown()
+
+
+@pytest.mark.timeout(5)
+def test_replay_rate(capture):
+    plugin, logger = replay(pcap=capture, pacing='rate', rate=2000, loops=2)
+
+    assert plugin.stats.packets == 2 * MESSAGES
+    assert plugin.stats.elapsed >= (2 * MESSAGES - 1) / 2000
+
+
+def test_replay_invalid(capture):
+    with pytest.raises(ValueError):
+        ReplayPlugin(pcap=capture, pacing='slow')
+    with pytest.raises(ValueError):
+        ReplayPlugin(pcap=capture, pacing='rate', rate=0)
@@ -0,0 +1,56 @@
+import pytest
+
+from usbq.bench import compare
+from usbq.bench import report
+from usbq.bench import run_scenario
+from usbq.bench import SCENARIOS
+from usbq.engine import AsyncUSBQEngine
+from usbq.engine import USBQEngine
+from usbq.opts import BENCH_SCENARIOS
+from usbq.usbmitm_proto import USBMessageDevice
+from usbq.usbmitm_proto import USBMessageHost
+
+PLUGINS = [('decode', {}), ('encode', {})]
+
+
+@pytest.mark.parametrize('name', list(SCENARIOS))
+def test_scenario_messages(name):
+    for is_host, data in SCENARIOS[name]():
+        cls = USBMessageHost if is_host else USBMessageDevice
+        pkt = cls(data)
+        assert pkt.len == len(data)
+        assert pkt.is_usb_data()
+
+
+def test_cli_scenarios():
+    assert BENCH_SCENARIOS == list(SCENARIOS)
+
+
+@pytest.mark.timeout(10)
+@pytest.mark.parametrize('engine', [USBQEngine, AsyncUSBQEngine])
+def test_run_scenario(engine):
+    res = run_scenario('mixed', 200, engine, PLUGINS, window=8)
+
+    assert res.packets == 200
+    assert res.lost == 0
+    assert res.throughput > 0
+    assert 0 < res.latency_us['p50'] <= res.latency_us['p99']
+    assert res.cpu_time > 0
+
+
+def test_compare():
+    res = run_scenario('hid', 50, USBQEngine, PLUGINS)
+    baseline = report([res])
+    assert baseline['peak_rss_kb'] > 0
+    assert 'peak_rss_kb' not in baseline['scenarios']['hid']
+
+    assert not any(r[-1] for r in compare(baseline, baseline))
+
+    slower = report([res])
+    slower['scenarios']['hid'] = dict(
+        slower['scenarios']['hid'], throughput=res.throughput / 2
+    )
+    regressions = [r for r in compare(slower, baseline) if r[-1]]
+    assert [(name, metric) for name, metric, *_ in regressions] == [
+        ('hid', 'throughput')
+    ]
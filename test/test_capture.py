@@ -0,0 +1,94 @@
+import os
+import shutil
+
+import pytest
+from scapy.all import raw
+from scapy.all import rdpcap
+
+from usbq.capture import Capture
+from usbq.capture import usbq_messages
+from usbq.defs import USBDefs
+from usbq.exceptions import USBQCaptureError
+from usbq.usbmitm_proto import USBMessageDevice
+from usbq.usbmitm_proto import USBMessageHost
+from usbq.usbpcap import USBPcap
+
+SAMPLE = 'samples/ant_plus_dongle.pcap'
+
+
+@pytest.fixture
+def capture(tmp_path):
+    fn = tmp_path / 'usb.pcap'
+    shutil.copy(SAMPLE, fn)
+    cap = Capture(fn)
+    yield cap
+    cap.close()
+
+
+def test_capture(capture):
+    ref = [raw(pkt) for pkt in rdpcap(SAMPLE)]
+    assert len(capture) == len(ref)
+    for rec, data in zip(capture, ref):
+        assert bytes(rec.raw) == data
+        assert bytes(rec.data) == data[64:]
+        assert rec.epnum == data[10] & 0x7F
+
+    rec = capture[0]
+    assert isinstance(rec.packet, USBPcap)
+    assert rec.is_ctrl_request()
+    assert bytes(rec.setup) == ref[0][40:48]
+
+
+def test_capture_index(capture):
+    assert capture.sorted
+    assert os.path.exists(capture.index_filename)
+
+    cap = Capture(capture.filename)
+    try:
+        assert cap._offsets == capture._offsets
+        assert cap._ts == capture._ts
+        assert cap._endpoint == capture._endpoint
+    finally:
+        cap.close()
+
+
+def test_capture_select(capture):
+    assert [rec.index for rec in capture[10:20:2]] == list(range(10, 20, 2))
+    assert capture[-1].index == len(capture) - 1
+
+    start, end = capture[10].ts, capture[20].ts
+    window = capture.between(start, end)
+    assert all(start <= rec.ts < end for rec in window)
+    assert len(window) == len([rec for rec in capture if start <= rec.ts < end])
+
+    ctrl = capture.filter(epnum=0, eptype=USBDefs.EP.TransferType.CTRL)
+    assert len(ctrl) > 0
+    assert all(rec.epnum == 0 for rec in ctrl)
+
+    submit_in = ctrl.filter(direction=USBDefs.EP.Direction.IN, urb_type='S')
+    assert all(rec.is_submit() for rec in submit_in)
+    assert len(submit_in) < len(ctrl)
+
+    # Filters compose with time ranges on narrowed views
+    assert len(ctrl.between(start, end)) <= len(window)
+
+
+def test_capture_invalid(tmp_path):
+    fn = tmp_path / 'bad.pcap'
+    fn.write_bytes(b'\x00' * 64)
+    with pytest.raises(USBQCaptureError):
+        Capture(fn)
+
+
+def test_usbq_messages(capture):
+    for rec, cls, data in usbq_messages(capture):
+        pkt = cls(data)
+        assert pkt.len == len(data)
+        assert pkt.is_usb_data()
+        assert pkt.content.ep.epnum == rec.epnum
+        assert bytes(rec.data) in data
+        if rec.is_submit():
+            assert cls is USBMessageHost
+        else:
+            assert cls is USBMessageDevice
+            assert rec.direction == USBDefs.EP.Direction.IN
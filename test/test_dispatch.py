@@ -0,0 +1,212 @@
+import pytest
+from scapy.compat import raw
+
+from usbq.defs import USBDefs
+from usbq.dispatch import compile_hook
+from usbq.dispatch import DispatchPlan
+from usbq.dispatch import SubscribedHook
+from usbq.hookspec import EP_DIRECTIONS
+from usbq.hookspec import hookimpl
+from usbq.hookspec import subscribe
+from usbq.hookspec import Subscription
+from usbq.plugins.profile import HookProfiler
+from usbq.pm import pm
+from usbq.usbmitm_proto import LazyUSBMessage
+from usbq.usbmitm_proto import USBEp
+from usbq.usbmitm_proto import USBMessageDevice
+from usbq.usbmitm_proto import USBMessageResponse
+from usbq.usbmitm_proto import USBMitm
+
+URB_IN = USBMitm.URBEPDirection.URB_IN
+URB_OUT = USBMitm.URBEPDirection.URB_OUT
+
+
+class Decode:
+    @hookimpl
+    def usbq_device_decode(self, data):
+        return data[::-1]
+
+    @hookimpl
+    def usbq_log_pkt(self, pkt):
+        return pkt
+
+
+class LogNone:
+    @hookimpl
+    def usbq_log_pkt(self):
+        pass
+
+
+class Wrapper:
+    @hookimpl(hookwrapper=True)
+    def usbq_device_decode(self, data):
+        yield
+
+
+CALLS = [
+    ('usbq_device_decode', {'data': b'abc'}),
+    ('usbq_log_pkt', {'pkt': 'pkt'}),
+    ('usbq_device_encode', {'pkt': 'pkt'}),
+    ('usbq_connected', {}),
+]
+
+
+def check():
+    'Compiled hooks return what pluggy returns.'
+
+    for name, kwargs in CALLS:
+        assert compile_hook(pm, name)(**kwargs) == getattr(pm.hook, name)(**kwargs)
+
+
+@pytest.mark.parametrize(
+    'plugins', [[], [Decode], [LogNone], [Decode, LogNone], [Decode, Wrapper]]
+)
+def test_compile_hook(plugins):
+    for cls in plugins:
+        pm.register(cls(), name=cls.__name__)
+
+    check()
+
+    decode = compile_hook(pm, 'usbq_device_decode')
+    if plugins == [Decode] or plugins == [Decode, LogNone]:
+        # Single implementation with the hookspec arguments: called directly
+        assert decode == pm.get_plugin('Decode').usbq_device_decode
+    elif Wrapper in plugins:
+        assert decode is pm.hook.usbq_device_decode
+
+
+def test_monitoring():
+    pm.register(Decode(), name='decode_test')
+    undo = pm.add_hookcall_monitoring(lambda *args: None, lambda *args: None)
+    try:
+        assert compile_hook(pm, 'usbq_device_decode') is pm.hook.usbq_device_decode
+    finally:
+        undo()
+    assert compile_hook(pm, 'usbq_device_decode') is not pm.hook.usbq_device_decode
+
+
+def test_generation():
+    plan = DispatchPlan(pm, ['usbq_device_decode'])
+    assert plan.usbq_device_decode(data=b'ab') is None
+
+    gen = pm.generation
+    pm.register(Decode(), name='decode_test')
+    assert pm.generation > gen
+
+    plan = DispatchPlan(pm, ['usbq_device_decode'])
+    assert plan.generation == pm.generation
+    assert plan.usbq_device_decode(data=b'ab') == b'ba'
+
+    pm.unregister(name='decode_test')
+    assert pm.generation > plan.generation
+
+
+class Seen:
+    def __init__(self):
+        self.seen = []
+
+
+class LogAll(Seen):
+    @hookimpl
+    def usbq_log_pkt(self, pkt):
+        self.seen.append(pkt)
+
+
+class LogInt(Seen):
+    @hookimpl
+    @subscribe(epnum=1, epdir='in', eptype='int')
+    def usbq_log_pkt(self, pkt):
+        self.seen.append(pkt)
+
+
+class LogManagement(Seen):
+    @hookimpl
+    @subscribe(msgtype='management')
+    def usbq_log_pkt(self, pkt):
+        self.seen.append(pkt)
+
+
+def messages():
+    int_in = USBEp(epnum=1, eptype=USBDefs.EP.TransferType.INT, epdir=URB_IN)
+    int_out = USBEp(epnum=1, eptype=USBDefs.EP.TransferType.INT, epdir=URB_OUT)
+    return [
+        LazyUSBMessage(
+            USBMessageDevice,
+            raw(USBMessageDevice(content=USBMessageResponse(ep=int_in))),
+        ),
+        USBMessageDevice(raw(USBMessageDevice(content=USBMessageResponse()))),
+        LazyUSBMessage(USBMessageDevice, raw(USBMessageDevice(type=2))),
+        LazyUSBMessage(
+            USBMessageDevice,
+            raw(USBMessageDevice(content=USBMessageResponse(ep=int_out))),
+        ),
+    ]
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+@pytest.mark.parametrize('monitor', [False, True])
+def test_subscriptions(compiled, monitor):
+    plugins = [LogAll(), LogInt(), LogManagement()]
+    for plugin in plugins:
+        pm.register(plugin)
+    plan = DispatchPlan(pm, ['usbq_log_pkt'], compiled=compiled)
+    assert isinstance(plan.usbq_log_pkt, SubscribedHook)
+
+    undo = pm.add_hookcall_monitoring(lambda *args: None, lambda *args: None)
+    if not monitor:
+        undo()
+    try:
+        msgs = messages()
+        for msg in msgs + msgs:
+            plan.usbq_log_pkt(pkt=msg)
+    finally:
+        if monitor:
+            undo()
+
+    all_, hid, management = [plugin.seen for plugin in plugins]
+    assert all_ == msgs + msgs
+    assert hid == [msgs[0], msgs[0]]
+    assert management == [msgs[2], msgs[2]]
+    assert len(plan.usbq_log_pkt.calls) == 4
+
+
+@pytest.mark.parametrize('compiled', [True, False])
+def test_subscriptions_profiled(compiled):
+    plugins = [LogInt(), LogManagement()]
+    for plugin in plugins:
+        pm.register(plugin)
+    profiler = HookProfiler()
+    pm.register(profiler, name='profile')
+    try:
+        plan = DispatchPlan(pm, ['usbq_log_pkt'], compiled=compiled)
+        assert isinstance(plan.usbq_log_pkt, SubscribedHook)
+        msgs = messages()
+        for msg in msgs:
+            plan.usbq_log_pkt(pkt=msg)
+    finally:
+        profiler.unwrap()
+
+    hid, management = [plugin.seen for plugin in plugins]
+    assert hid == [msgs[0]]
+    assert management == [msgs[2]]
+    calls = [
+        stats.calls
+        for (hook, name), stats in profiler.stats.items()
+        if hook == 'usbq_log_pkt'
+    ]
+    assert sorted(calls) == [1, 1]
+
+
+def test_subscription():
+    sub = Subscription(epnum=[1, 2], epdir='out', msgtype=['usb', 'ack'])
+    assert sub.match(0, 2, URB_OUT, USBDefs.EP.TransferType.BULK)
+    assert not sub.match(0, 2, URB_IN, USBDefs.EP.TransferType.BULK)
+    assert not sub.match(2, None, None, None)
+    assert Subscription(msgtype=2).match(2, None, None, None)
+
+
+def test_subscription_directions():
+    assert EP_DIRECTIONS == {
+        'in': USBMitm.URBEPDirection.URB_IN,
+        'out': USBMitm.URBEPDirection.URB_OUT,
+    }
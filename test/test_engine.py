@@ -0,0 +1,302 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from usbq.engine import AsyncUSBQEngine
+from usbq.engine import DISPATCH
+from usbq.engine import USBQEngine
+from usbq.hookspec import hookimpl
+from usbq.plugins.decode import USBDecode
+from usbq.plugins.encode import USBEncode
+from usbq.plugins.latency import LatencyMonitor
+from usbq.plugins.profile import HookProfiler
+from usbq.plugins.proxy import ProxyPlugin
+from usbq.pm import pm
+from usbq.usbmitm_proto import USBMessageDevice
+
+DEVICE_PORT = 55560
+HOST_PORT = 55561
+DATA = b'\x1a\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x80\x06\x00\x01\x00\x00@\x00'
+
+
+class AsyncModify:
+    def __init__(self, engine):
+        self.engine = engine
+        self.seen = []
+
+    @hookimpl
+    async def usbq_device_modify(self, pkt):
+        await asyncio.sleep(0)
+        self.seen.append(pkt)
+        self.engine.stop()
+
+
+class AsyncSendBatch:
+    def __init__(self, engine):
+        self.engine = engine
+        self.sent = []
+
+    @hookimpl
+    async def usbq_send_host_batch(self, batch):
+        await asyncio.sleep(0)
+        self.sent += [bytes(data) for data in batch]
+        self.engine.stop()
+        return True
+
+
+class Modify:
+    @hookimpl
+    def usbq_device_modify(self, pkt):
+        pkt.content.data = b'modified'
+
+
+class Log:
+    def __init__(self):
+        self.seen = []
+
+    @hookimpl
+    def usbq_log_pkt(self, pkt):
+        self.seen.append(pkt)
+
+
+@pytest.fixture
+def board():
+    'Socket standing in for the host side of the proxy hardware.'
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', HOST_PORT))
+    sock.settimeout(1)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture
+def plugins():
+    names = {
+        'proxy': ProxyPlugin(
+            device_addr='127.0.0.1',
+            device_port=DEVICE_PORT,
+            host_addr='127.0.0.1',
+            host_port=HOST_PORT,
+            batch_size=2,
+        ),
+        'decode': USBDecode(),
+        'encode': USBEncode(),
+    }
+    for name, plugin in names.items():
+        pm.register(plugin, name=name)
+    yield names
+    for name in names:
+        pm.unregister(name=name)
+
+
+@pytest.mark.timeout(2)
+def test_async_engine_forward(board, plugins):
+    engine = AsyncUSBQEngine()
+    modify = AsyncModify(engine)
+    pm.register(modify, name='async_modify')
+
+    try:
+        board.sendto(DATA, ('127.0.0.1', DEVICE_PORT))
+        asyncio.run(engine.serve())
+    finally:
+        pm.unregister(name='async_modify')
+
+    assert len(modify.seen) == 1
+    assert modify.seen[0].cls is USBMessageDevice
+    assert board.recvfrom(4096)[0] == DATA
+
+
+@pytest.mark.timeout(2)
+def test_async_engine_send_batch(board, plugins):
+    engine = AsyncUSBQEngine(batch=True)
+    sender = AsyncSendBatch(engine)
+    pm.register(sender, name='async_send')
+
+    try:
+        board.sendto(DATA, ('127.0.0.1', DEVICE_PORT))
+        asyncio.run(engine.serve())
+    finally:
+        pm.unregister(name='async_send')
+
+    assert sender.sent == [DATA]
+
+
+@pytest.mark.timeout(2)
+def test_engine_batch(board, plugins):
+    engine = USBQEngine(batch=True)
+    for i in range(3):
+        board.sendto(DATA, ('127.0.0.1', DEVICE_PORT))
+
+    while plugins['proxy'].stats['device'].packets < 3:
+        engine.event()
+
+    for i in range(3):
+        assert board.recvfrom(4096)[0] == DATA
+
+
+def test_passthrough(plugins):
+    engine = USBQEngine()
+    assert engine._raw_device and engine._raw_host
+
+    pm.register(Modify(), name='modify')
+    try:
+        engine.refresh()
+        assert not engine._raw_device and engine._raw_host
+    finally:
+        pm.unregister(name='modify')
+
+    engine = USBQEngine(passthrough=False)
+    assert not engine._raw_device and not engine._raw_host
+
+
+@pytest.mark.timeout(2)
+def test_passthrough_forward(board, plugins):
+    logger = Log()
+    pm.register(logger, name='log')
+    try:
+        engine = USBQEngine()
+        board.sendto(DATA, ('127.0.0.1', DEVICE_PORT))
+        while len(logger.seen) == 0:
+            engine.event()
+    finally:
+        pm.unregister(name='log')
+
+    assert logger.seen[0].cls is USBMessageDevice
+    assert board.recvfrom(4096)[0] == DATA
+
+
+@pytest.mark.timeout(2)
+@pytest.mark.parametrize('batch', [False, True])
+def test_engine_latency(board, plugins, batch):
+    monitor = LatencyMonitor()
+    pm.register(monitor, name='latency')
+    pm.register(Modify(), name='modify')
+    try:
+        engine = USBQEngine(batch=batch)
+        board.sendto(DATA, ('127.0.0.1', DEVICE_PORT))
+        while monitor.stats.count == 0:
+            engine.event()
+    finally:
+        pm.unregister(name='modify')
+        pm.unregister(name='latency')
+
+    assert board.recvfrom(4096)[0] != DATA
+    stages = monitor.stats.stages('device', 'ctrl')
+    for stage in ['get', 'decode', 'log', 'modify', 'encode', 'send', 'total']:
+        assert getattr(stages, stage).count == 1
+    assert stages.total.max >= stages.decode.max
+    assert monitor.usbq_ipython_ns()['latency'] is monitor.stats
+
+
+@pytest.mark.parametrize('dispatch', DISPATCH)
+@pytest.mark.parametrize('modify', [False, True])
+def test_engine_profiled(dispatch, modify):
+    logger = Log()
+    for name, plugin in [
+        ('decode', USBDecode()),
+        ('encode', USBEncode()),
+        ('log', logger),
+    ]:
+        pm.register(plugin, name=name)
+    if modify:
+        pm.register(Modify(), name='modify')
+    profiler = HookProfiler()
+    pm.register(profiler, name='profile')
+    try:
+        engine = USBQEngine(dispatch=dispatch)
+        assert engine._process_host_packet(DATA) == DATA
+        assert engine._process_device_packet(DATA) is not None
+    finally:
+        profiler.unwrap()
+
+    assert len(logger.seen) == 2
+    assert profiler.stats[('usbq_host_decode', 'decode')].calls == 1
+    assert profiler.stats[('usbq_log_pkt', 'log')].calls == 2
+
+
+class PolledSource:
+    '''
+    Packet source without a selectable that alternates between device and
+    host packets, as a replayed capture does.
+    '''
+
+    def __init__(self, engine, count):
+        self.engine = engine
+        self.queue = [i % 2 == 1 for i in range(count)]
+        self.sent = 0
+
+    def _get(self, is_host):
+        if len(self.queue) > 0 and self.queue[0] == is_host:
+            self.queue.pop(0)
+            return DATA
+
+    def _send(self):
+        self.sent += 1
+        if len(self.queue) == 0:
+            self.engine.stop()
+        return True
+
+    @hookimpl
+    def usbq_device_has_packet(self):
+        if len(self.queue) > 0 and not self.queue[0]:
+            return True
+
+    @hookimpl
+    def usbq_host_has_packet(self):
+        if len(self.queue) > 0 and self.queue[0]:
+            return True
+
+    @hookimpl
+    def usbq_get_device_packet(self):
+        return self._get(False)
+
+    @hookimpl
+    def usbq_get_host_packet(self):
+        return self._get(True)
+
+    @hookimpl
+    def usbq_send_host_packet(self, data):
+        return self._send()
+
+    @hookimpl
+    def usbq_send_device_packet(self, data):
+        return self._send()
+
+
+@pytest.mark.timeout(5)
+def test_async_engine_polled_source():
+    # Without draining, each packet would wait for the next tick
+    engine = AsyncUSBQEngine(tick_interval=0.1)
+    source = PolledSource(engine, 200)
+    pm.register(source, name='polled')
+
+    start = time.monotonic()
+    asyncio.run(engine.serve())
+    elapsed = time.monotonic() - start
+
+    assert source.sent == 200
+    assert elapsed < 1.0
+
+
+class AuxSource:
+    def __init__(self, engine, sock):
+        self.engine = engine
+        self.sock = sock
+
+    @hookimpl
+    def usbq_event_sources(self):
+        return {'aux': (self.sock, self.engine.stop)}
+
+
+@pytest.mark.timeout(2)
+def test_async_engine_aux_source(board, plugins):
+    engine = AsyncUSBQEngine()
+    pm.register(AuxSource(engine, board), name='aux')
+    try:
+        board.sendto(b'ping', board.getsockname())
+        asyncio.run(engine.serve())
+    finally:
+        pm.unregister(name='aux')
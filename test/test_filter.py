@@ -0,0 +1,134 @@
+import pytest
+from scapy.compat import raw
+
+from usbq.capture import Capture
+from usbq.capture import usbq_messages
+from usbq.defs import USBDefs
+from usbq.exceptions import USBQFilterError
+from usbq.filter import compile_filter
+from usbq.filter import PacketFilter
+from usbq.usbmitm_proto import LazyUSBMessage
+from usbq.usbmitm_proto import ManagementMessage
+from usbq.usbmitm_proto import USBAck
+from usbq.usbmitm_proto import USBEp
+from usbq.usbmitm_proto import USBMessageDevice
+from usbq.usbmitm_proto import USBMessageHost
+from usbq.usbmitm_proto import USBMessageResponse
+
+SAMPLE = 'samples/ant_plus_dongle.pcap'
+
+URB_IN = USBMessageHost.URBEPDirection.URB_IN
+URB_OUT = USBMessageHost.URBEPDirection.URB_OUT
+
+
+def response(data, epnum=1, epdir=URB_IN, eptype=2):
+    return USBMessageDevice(
+        type=0,
+        content=USBMessageResponse(
+            ep=USBEp(epnum=epnum, epdir=epdir, eptype=eptype), data=data
+        ),
+    )
+
+
+@pytest.mark.parametrize(
+    'pkt,expected',
+    [
+        (response(b'\x55\xaa' + bytes(8)), True),
+        (response(b'\x55\xaa' + bytes(6)), False),
+        (response(b'\x55\xab' + bytes(8)), False),
+        (response(b'\x55\xaa' + bytes(8), epdir=URB_OUT), False),
+        (response(b'\x55\xaa' + bytes(8), epnum=2), False),
+    ],
+)
+def test_example(pkt, expected):
+    f = PacketFilter(
+        'ep == 0x81 and len > 8 and dir == in and data[0:2] == b"\\x55\\xaa"'
+    )
+    assert f.match_wire(USBMessageDevice, raw(pkt)) is expected
+    assert f.match(pkt) is expected
+    assert f.match(LazyUSBMessage(USBMessageDevice, raw(pkt))) is expected
+
+
+def test_names():
+    pkt = response(b'\x01\x02\x03', epnum=2, epdir=URB_OUT, eptype=3)
+    assert PacketFilter('type == usb and src == device').match(pkt)
+    assert PacketFilter('eptype == int and epnum == 2 and dir == out').match(pkt)
+    assert PacketFilter('dir in (in, out) and eptype not in [ctrl, isoc]').match(pkt)
+    assert PacketFilter('not in == dir and dir not in (in,)').match(pkt)
+    assert not PacketFilter('not not in == dir or in in [dir]').match(pkt)
+    assert PacketFilter('data[-1] == 3 and len == 3 and ep & 0x80 == 0').match(pkt)
+    assert not PacketFilter('src == host or ep == 0x82').match(pkt)
+
+
+def test_management():
+    ack = USBMessageHost(type=1, content=USBAck(ep=USBEp(epnum=1)))
+    mgmt = USBMessageDevice(type=2, content=ManagementMessage(management_type=0))
+
+    assert PacketFilter('type == ack and epnum == 1').match(ack)
+    assert PacketFilter('type == management').match(mgmt)
+    assert not PacketFilter('ep == 0').match(mgmt)
+    assert not PacketFilter('ep < 0x80').match(mgmt)
+    assert PacketFilter('ep != 0').match(mgmt)
+
+
+def test_modified():
+    pkt = LazyUSBMessage(USBMessageDevice, raw(response(b'\x00')))
+    f = PacketFilter('data == b"\\xff"')
+    assert not f.match(pkt)
+    pkt.content.data = b'\xff'
+    assert f.match(pkt)
+
+
+@pytest.mark.parametrize(
+    'expr',
+    [
+        'ep ==',
+        'foo == 1',
+        '__import__("os")',
+        'data.hex()',
+        '[x for x in data]',
+        'ep == 1.5',
+    ],
+)
+def test_invalid(expr):
+    with pytest.raises(USBQFilterError):
+        PacketFilter(expr)
+
+
+def test_compile_filter():
+    assert compile_filter(None) is None
+    assert compile_filter(' ') is None
+    f = compile_filter('ep == 0')
+    assert compile_filter(f) is f
+
+
+def test_capture():
+    with Capture(SAMPLE, index=False) as cap:
+        msgs = list(usbq_messages(cap))
+
+    f = PacketFilter('src == device and eptype == bulk and len > 0')
+    count = sum(f.match_wire(cls, data) for rec, cls, data in msgs)
+    assert count == sum(f.match(cls(data)) for rec, cls, data in msgs)
+    assert 0 < count < len(msgs)
+
+
+def test_capture_endpoints():
+    with Capture(SAMPLE, index=False) as cap:
+        msgs = [
+            (rec, cls, data) for rec, cls, data in usbq_messages(cap) if rec.epnum != 0
+        ]
+    assert len(msgs) > 0
+
+    for rec, cls, data in msgs:
+        direction = 'in' if rec.direction == USBDefs.EP.Direction.IN else 'out'
+        address = rec.epnum | (0x80 if direction == 'in' else 0)
+        assert PacketFilter(f'ep == {address} and dir == {direction}').match_wire(
+            cls, data
+        )
+        assert not PacketFilter(f'ep == {address ^ 0x80}').match_wire(cls, data)
+
+    f = PacketFilter('ep == 0x81')
+    assert sum(f.match_wire(cls, data) for rec, cls, data in msgs) == sum(
+        rec.epnum == 1 and rec.direction == USBDefs.EP.Direction.IN
+        for rec, cls, data in msgs
+    )
@@ -0,0 +1,128 @@
+import pytest
+from scapy.compat import raw
+
+from usbq.defs import USBDefs
+from usbq.dissect.usb import bEndpointAddress
+from usbq.dissect.usb import ConfigurationDescriptor
+from usbq.dissect.usb import DeviceDescriptor
+from usbq.dissect.usb import EndpointDescriptor
+from usbq.dissect.usb import GetDescriptor
+from usbq.dissect.usb import InterfaceDescriptor
+from usbq.model import DeviceIdentity
+
+DEVICE = USBDefs.DescriptorType.DEVICE_DESCRIPTOR
+CONFIGURATION = USBDefs.DescriptorType.CONFIGURATION_DESCRIPTOR
+STRING = USBDefs.DescriptorType.STRING_DESCRIPTOR
+
+
+def identity():
+    return DeviceIdentity(
+        [
+            DeviceDescriptor(),
+            ConfigurationDescriptor(
+                descriptors=[InterfaceDescriptor(), EndpointDescriptor()]
+            ),
+        ]
+    )
+
+
+def test_from_request():
+    ident = identity()
+
+    req = GetDescriptor(bDescriptorType=CONFIGURATION, wLength=9)
+    assert ident.from_request(req, as_bytes=True) == raw(ident.configuration)[:9]
+    assert raw(ident.from_request(req)) == raw(ident.configuration)[:9]
+
+    req = GetDescriptor(bDescriptorType=CONFIGURATION, wLength=0xFFFF)
+    data = ident.from_request(req, as_bytes=True)
+    assert data == raw(ident.configuration)
+    assert ident.from_request(req, as_bytes=True) is data
+
+    req = GetDescriptor(bDescriptorType=DEVICE, wLength=64)
+    assert ident.from_request(req, as_bytes=True) == raw(ident.device)
+
+
+def test_from_request_strings():
+    ident = DeviceIdentity()
+    req = GetDescriptor(bDescriptorType=STRING, descriptor_index=1, wLength=255)
+    assert ident.from_request(req) is ident.strings[1]
+    assert ident.from_request(req, as_bytes=True) == raw(ident.strings[1])
+
+    req = GetDescriptor(bDescriptorType=STRING, descriptor_index=1, wLength=4)
+    assert ident.from_request(req, as_bytes=True) == raw(ident.strings[1])[:4]
+
+
+def test_from_request_mutation():
+    ident = identity()
+    req = GetDescriptor(bDescriptorType=CONFIGURATION, wLength=0xFFFF)
+    ident.from_request(req, as_bytes=True)
+
+    ident.configuration.bMaxPower = 100
+    ident.endpoints[0].bEndpointAddress.endpoint_number = 3
+    assert ident.from_request(req, as_bytes=True) == raw(ident.configuration)
+
+    ident.configuration = ConfigurationDescriptor(descriptors=[InterfaceDescriptor()])
+    assert ident.from_request(req, as_bytes=True) == raw(ident.configuration)
+
+    # In place list changes need invalidate()
+    ident.configuration.descriptors.append(EndpointDescriptor())
+    ident.invalidate()
+    assert ident.from_request(req, as_bytes=True) == raw(ident.configuration)
+
+
+def test_from_request_dissected():
+    conf = ConfigurationDescriptor(raw(identity().configuration))
+    ident = DeviceIdentity([DeviceDescriptor(), conf])
+    req = GetDescriptor(bDescriptorType=CONFIGURATION, wLength=0xFFFF)
+    ident.from_request(req, as_bytes=True)
+
+    ident.interfaces[0].bInterfaceClass = 8
+    assert ident.from_request(req, as_bytes=True) == raw(ident.configuration)
+
+
+def test_descriptor_lists():
+    ident = identity()
+    req = GetDescriptor(bDescriptorType=CONFIGURATION, wLength=0xFFFF)
+    ident.from_request(req, as_bytes=True)
+
+    assert ident.endpoints is ident.endpoints
+    assert len(ident.interfaces) == 1
+    assert list(ident.endpoints) == [ident.configuration.descriptors[1]]
+
+    ep = EndpointDescriptor(bInterval=10)
+    ident.endpoints[0] = ep
+    assert ident.configuration.descriptors[1] is ep
+    assert ident.from_request(req, as_bytes=True) == raw(ident.configuration)
+
+    with pytest.raises(ValueError):
+        ident.endpoints[0] = InterfaceDescriptor()
+
+    ident.configuration.descriptors.insert(0, EndpointDescriptor())
+    assert len(ident.endpoints) == 2
+    assert ident.endpoints[1] is ep
+
+
+def test_tree():
+    ident = identity()
+    conf = ident.configuration
+    conf.descriptors += [
+        InterfaceDescriptor(bInterfaceNumber=1),
+        EndpointDescriptor(bEndpointAddress=bEndpointAddress(direction=0)),
+        InterfaceDescriptor(bInterfaceNumber=1, bAlternateSetting=1),
+        EndpointDescriptor(bEndpointAddress=bEndpointAddress(endpoint_number=2)),
+    ]
+
+    assert ident.interface(0).descriptor is conf.descriptors[0]
+    assert ident.interface(1).endpoints == [conf.descriptors[3]]
+    assert ident.interface(1, 1).alternate == 1
+    assert ident.interface(2) is None
+    assert ident.endpoint(0x81) is conf.descriptors[1]
+    assert ident.endpoint(0x01) is conf.descriptors[3]
+    assert ident.endpoint(0x82) is conf.descriptors[5]
+    assert ident.endpoint(0x83) is None
+
+    tree = ident.tree
+    assert ident.tree is tree
+    conf.descriptors[5].bEndpointAddress.endpoint_number = 3
+    assert ident.tree is not tree
+    assert ident.endpoint(0x83) is conf.descriptors[5]
@@ -0,0 +1,71 @@
+import os
+import re
+import subprocess
+import sys
+
+from usbq.pm import load_entrypoints
+from usbq.pm import USBQPluginManager
+
+#: Budget for importing the CLI, in ms
+BUDGET_MS = float(os.environ.get('USBQ_IMPORT_BUDGET_MS', 600))
+
+#: Modules that must only be imported when a command or plugin needs them
+LAZY_MODULES = [
+    'scapy.all',
+    'scapy.layers.all',
+    'IPython',
+    'usb.core',
+    'usbq.bench',
+    'usbq.simulator',
+    'usbq.trace',
+]
+
+IMPORTTIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def importtime(module):
+    'Return {module: cumulative us} of a fresh interpreter importing module.'
+
+    res = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    return {
+        m.group(4): int(m.group(2))
+        for m in map(IMPORTTIME.match, res.stderr.splitlines())
+        if m is not None
+    }
+
+
+def test_cli_import_time():
+    # Best of a few runs to smooth out a busy machine
+    runs = [importtime('usbq.cli') for i in range(3)]
+
+    for mod in LAZY_MODULES:
+        assert mod not in runs[0], f'{mod} is imported by usbq.cli'
+    plugins = [mod for mod in runs[0] if mod.startswith('usbq.plugins.')]
+    assert plugins == []
+
+    elapsed = min(run['usbq.cli'] for run in runs) / 1000
+    assert elapsed < BUDGET_MS, f'import usbq.cli took {elapsed:.0f} ms'
+
+
+def test_entrypoint_cache(tmp_path):
+    pm = USBQPluginManager('usbq')
+    load_entrypoints(pm, 'usbq', cache_dir=str(tmp_path))
+    assert (tmp_path / 'entrypoints.json').exists()
+    scanned = sorted(name for name, plugin in pm.list_name_plugin())
+
+    # Loaded from the cache
+    pm = USBQPluginManager('usbq')
+    load_entrypoints(pm, 'usbq', cache_dir=str(tmp_path))
+    assert sorted(name for name, plugin in pm.list_name_plugin()) == scanned
+    assert 'usbq_base' in scanned
+
+    # A corrupt cache is rebuilt
+    (tmp_path / 'entrypoints.json').write_text('{')
+    pm = USBQPluginManager('usbq')
+    load_entrypoints(pm, 'usbq', cache_dir=str(tmp_path))
+    assert sorted(name for name, plugin in pm.list_name_plugin()) == scanned
@@ -0,0 +1,58 @@
+import random
+
+from scapy.all import raw
+
+from usbq.latency import Histogram
+from usbq.latency import PipelineLatency
+from usbq.latency import STAGES
+
+
+def test_histogram_percentiles():
+    values = [random.randint(0, 10_000_000) for i in range(10000)]
+    hist = Histogram()
+    for value in values:
+        hist.record(value)
+
+    values.sort()
+    assert hist.count == len(values)
+    assert hist.min == values[0]
+    assert hist.max == values[-1]
+    for q in [0.5, 0.9, 0.99, 0.999]:
+        exact = values[round(q * len(values)) - 1]
+        assert exact <= hist.percentile(q) <= exact * 1.04 + 1
+
+
+def test_histogram_exact_and_clamped():
+    hist = Histogram()
+    for value in range(64):
+        hist.record(value)
+    assert hist.percentile(0.5) == 31
+    hist.record(1 << 50)
+    assert hist.percentile(1.0) == 1 << 50
+
+    other = Histogram()
+    other.record(7)
+    hist.merge(other)
+    assert hist.count == 66
+
+    hist.reset()
+    assert hist.count == 0
+    assert hist.percentile(0.5) == 0
+
+
+def test_pipeline_latency(sample_messages):
+    latency = PipelineLatency()
+    for pkt in sample_messages:
+        stages = latency.select('device', raw(pkt))
+        for stage in STAGES:
+            getattr(stages, stage).record(1000)
+
+    summary = latency.summary()
+    assert set(summary) == {'device', 'host'}
+    assert latency.count == len(sample_messages)
+    for eptype, stages in summary['device'].items():
+        assert eptype in ['ctrl', 'isoc', 'bulk', 'int', 'management']
+        assert list(stages) == STAGES
+        assert stages['total']['p99_us'] == 1.0
+    assert latency.merged('decode').count == len(sample_messages)
+    assert 'packets' in str(latency)
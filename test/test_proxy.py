@@ -45,3 +45,57 @@ def test_send_recv(proxy):
 def test_no_wait(proxy):
     assert not proxy.usbq_device_has_packet()
     assert not proxy.usbq_host_has_packet()
+
+
+@pytest.mark.timeout(1)
+def test_batch():
+    proxy = ProxyPlugin(
+        device_addr='127.0.0.1',
+        device_port=55556,
+        host_addr='127.0.0.1',
+        host_port=55556,
+        batch_size=4,
+    )
+    assert proxy.usbq_get_device_batch() == []
+
+    proxy.usbq_send_host_batch([DATA + bytes([i]) for i in range(6)])
+    while not proxy.usbq_device_has_packet():
+        pass
+
+    batch = [bytes(data) for data in proxy.usbq_get_device_batch()]
+    batch += [bytes(data) for data in proxy.usbq_get_device_batch()]
+    assert batch == [DATA + bytes([i]) for i in range(6)]
+    assert proxy.stats['device'].packets == 6
+    assert proxy.stats['device'].largest == 4
+    assert proxy.stats['device'].full == 1
+
+
+@pytest.mark.timeout(1)
+def test_batch_outlives():
+    proxy = ProxyPlugin(
+        device_addr='127.0.0.1',
+        device_port=55557,
+        host_addr='127.0.0.1',
+        host_port=55557,
+        batch_size=2,
+    )
+
+    def recv(count):
+        res = []
+        while len(res) < count:
+            res += proxy.usbq_get_device_batch()
+        return res
+
+    # Packets keep views of the pooled buffers instead of copies
+    proxy.usbq_send_host_batch([DATA + bytes([i]) for i in range(2)])
+    kept, dropped = recv(2)
+    assert isinstance(kept, memoryview)
+    del dropped
+
+    # Only the buffer still referenced is replaced
+    pool = list(proxy._device_pool)
+    proxy.usbq_send_host_batch([DATA + bytes([i]) for i in range(2, 4)])
+    assert [bytes(data) for data in recv(2)] == [DATA + bytes([2]), DATA + bytes([3])]
+    assert kept == DATA + bytes([0])
+    assert proxy._device_pool[0] is not pool[0]
+    assert proxy._device_pool[1] is pool[1]
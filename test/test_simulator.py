@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from usbq.defs import USBDefs
+from usbq.engine import USBQEngine
+from usbq.pm import enable_plugins
+from usbq.pm import pm
+from usbq.simulator import LOOPBACK
+from usbq.simulator import Simulator
+from usbq.simulator import Stream
+
+
+def test_stream_parse():
+    stream = Stream.parse('disk:2:bulk:out:512')
+    assert stream.name == 'disk'
+    assert stream.epnum == 2
+    assert stream.eptype == USBDefs.EP.TransferType.BULK
+    assert stream.is_host
+    assert stream.size == 512
+    assert stream.rate == 0
+    assert stream.count == 1000
+
+    stream = Stream.parse('hid:1:int:in:8:500:10')
+    assert not stream.is_host
+    assert stream.rate == 500
+    assert stream.count == 10
+    assert len(list(stream.messages())) == 10
+
+    for spec in ['hid:1:int', 'hid:1:ctrl:in', 'hid:1:int:up', 'hid:x:int:in']:
+        with pytest.raises(ValueError):
+            Stream.parse(spec)
+
+
+@pytest.mark.timeout(10)
+def test_simulator():
+    sim = Simulator(
+        proxy_addr=(LOOPBACK, 0),
+        enumerations=2,
+        streams=[
+            Stream.parse('hid:1:int:in:8:0:50'),
+            Stream.parse('disk:2:bulk:out:512:0:50'),
+        ],
+        window=8,
+    )
+    try:
+        enable_plugins(
+            pm,
+            [
+                (
+                    'proxy',
+                    {
+                        'device_addr': LOOPBACK,
+                        'device_port': 0,
+                        'host_addr': LOOPBACK,
+                        'host_port': sim.proxy_port,
+                    },
+                ),
+                ('decode', {}),
+                ('encode', {}),
+            ],
+        )
+        sim.usbq_addr = pm.get_plugin('proxy').listen_address
+
+        thread = threading.Thread(target=sim.run, daemon=True)
+        thread.start()
+        engine = USBQEngine()
+        while thread.is_alive():
+            engine.event()
+        pm.hook.usbq_teardown()
+    finally:
+        sim.close()
+
+    stats = sim.stats.summary()
+    assert stats['unmatched'] == 0
+    assert stats['total']['lost'] == 0
+    for name in ['hid', 'disk', 'control', 'response', 'ack']:
+        assert stats['streams'][name]['received'] > 0
+    assert stats['streams']['hid']['sent'] == 50
+    assert stats['streams']['disk']['sent'] == 50
+    # Every control request of both enumerations is answered
+    assert (
+        stats['streams']['response']['sent'] + stats['streams']['ack']['sent']
+        >= stats['streams']['control']['sent']
+    )
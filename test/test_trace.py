@@ -0,0 +1,63 @@
+import pytest
+
+from usbq.hookspec import hookimpl
+from usbq.pm import pm
+from usbq.trace import TraceFile
+from usbq.trace import TraceRecorder
+
+
+class Echo:
+    @hookimpl
+    def usbq_device_decode(self, data):
+        return data
+
+    @hookimpl
+    def usbq_log_pkt(self, pkt):
+        raise RuntimeError('boom')
+
+
+@pytest.fixture
+def echo():
+    pm.register(Echo(), name='echo')
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_trace(tmp_path, echo, mmap):
+    fn = tmp_path / 'usbq.trace'
+    recorder = TraceRecorder(capacity=4, path=str(fn) if mmap else None)
+    recorder.attach(pm)
+    try:
+        pm.hook.usbq_device_decode(data=b'abcd')
+        with pytest.raises(RuntimeError):
+            pm.hook.usbq_log_pkt(pkt=None)
+        pm.hook.usbq_device_decode(data=b'abcdef')
+    finally:
+        recorder.detach()
+
+    if not mmap:
+        recorder.save(str(fn))
+    recorder.close()
+
+    trace = TraceFile.open(str(fn))
+    assert trace.count == 6
+    assert len(trace) == 4
+
+    records = list(trace.records())
+    assert [(r.hook, r.event) for r in records] == [
+        ('usbq_log_pkt', 'call'),
+        ('usbq_log_pkt', 'error'),
+        ('usbq_device_decode', 'call'),
+        ('usbq_device_decode', 'return'),
+    ]
+    assert records[2].seq == records[3].seq
+    assert records[2].plugins == 'echo'
+    assert (records[3].type, records[3].size) == ('bytes', 6)
+    assert records[0].ts <= records[-1].ts
+    assert 'usbq_device_decode [echo] bytes 6' in records[3].format(records[0].ts)
+
+
+def test_not_a_trace(tmp_path):
+    fn = tmp_path / 'bad'
+    fn.write_bytes(b'\0' * 100)
+    with pytest.raises(ValueError):
+        TraceFile.open(str(fn))
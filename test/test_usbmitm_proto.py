@@ -0,0 +1,57 @@
+import pytest
+from scapy.all import raw
+
+from usbq.defs import USBDefs
+from usbq.usbmitm_proto import decode_header
+from usbq.usbmitm_proto import ManagementMessage
+from usbq.usbmitm_proto import ManagementNewDevice
+from usbq.usbmitm_proto import USBAck
+from usbq.usbmitm_proto import USBEp
+from usbq.usbmitm_proto import USBMessageDevice
+from usbq.usbmitm_proto import USBMessageHost
+
+EXTRA = [
+    USBMessageHost(
+        type=1,
+        content=USBAck(
+            ep=USBEp(epnum=1, eptype=USBDefs.EP.TransferType.INT), status=-32
+        ),
+    ),
+    USBMessageDevice(
+        type=2,
+        content=ManagementMessage(
+            management_type=1, management_content=ManagementNewDevice()
+        ),
+    ),
+    USBMessageHost(type=2, content=ManagementMessage(management_type=0)),
+]
+
+
+def check_header(pkt):
+    data = raw(pkt)
+    hdr = decode_header(type(pkt), data)
+    ref = type(pkt)(data)
+
+    assert hdr.len == ref.len
+    assert hdr.type == ref.type
+    if ref.is_management():
+        assert hdr.ep is None
+        assert hdr.management_type == ref.content.management_type
+    else:
+        assert hdr.ep.epnum == ref.content.ep.epnum
+        assert hdr.ep.eptype == ref.content.ep.eptype
+        assert hdr.ep.epdir == ref.content.ep.epdir
+        assert hdr.ep.is_ctrl_0() == ref.content.ep.is_ctrl_0()
+        assert bytes(hdr.ep_payload) == raw(ref.content)[10:]
+
+    assert raw(hdr.packet) == raw(ref)
+
+
+def test_decode_header(sample_messages):
+    for pkt in sample_messages:
+        check_header(pkt)
+
+
+@pytest.mark.parametrize('pkt', EXTRA)
+def test_decode_header_extra(pkt):
+    check_header(pkt)
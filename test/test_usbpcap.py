@@ -0,0 +1,58 @@
+import sys
+import threading
+
+from scapy.all import raw
+
+from usbq.usbmitm_proto import USBMessageHost
+from usbq.usbpcap import ack_from_msg
+from usbq.usbpcap import pack_ack
+from usbq.usbpcap import pack_req
+from usbq.usbpcap import pack_usbdev
+from usbq.usbpcap import pack_usbhost
+from usbq.usbpcap import req_from_msg
+from usbq.usbpcap import usbdev_to_usbpcap
+from usbq.usbpcap import usbhost_to_usbpcap
+
+
+def test_pack(sample_messages):
+    'Fast serializers must match the scapy USBPcap path.'
+
+    for pkt in sample_messages:
+        msg = pkt.content
+        if pkt.cls is USBMessageHost:
+            assert pack_usbhost(msg) == raw(usbhost_to_usbpcap(msg))
+            assert pack_ack(msg) == raw(ack_from_msg(msg))
+        else:
+            assert pack_usbdev(msg) == raw(usbdev_to_usbpcap(msg))
+            assert pack_req(msg) == raw(req_from_msg(msg))
+
+
+def test_pack_threads(sample_messages):
+    'Records packed concurrently, as by the PCAP writer thread, are not mixed.'
+
+    def pack_all():
+        return [
+            (pack_usbhost if pkt.cls is USBMessageHost else pack_usbdev)(pkt.content)
+            for pkt in sample_messages
+        ]
+
+    expected = pack_all()
+    results = []
+
+    def run():
+        for i in range(20):
+            results.append(pack_all())
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=run) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert len(results) == 80
+    assert all(res == expected for res in results)
@@ -0,0 +1,7 @@
+
+from usbq.hookspec import hookimpl
+
+class USBQHooks():
+    @hookimpl
+    def usbq_host_has_packet(self):
+        return False
@@ -0,0 +1,93 @@
+'''
+Benchmark packet filter expressions against the unfiltered logging path.
+
+    python tools/bench_filter.py [count]
+
+Messages from the sample capture are logged to a PCAP file with:
+
+- none: no filter, every USB message is recorded
+- filter: a compiled filter matching IN bulk data, checked on the raw message
+
+The cost of the filter alone is then compared with the same test written
+against the dissected scapy packet.
+'''
+
+import os
+import sys
+import tempfile
+import time
+
+from usbq.capture import Capture
+from usbq.capture import usbq_messages
+from usbq.filter import PacketFilter
+from usbq.plugins.pcap import PcapFileWriter
+from usbq.usbmitm_proto import LazyUSBMessage
+
+SAMPLE = 'samples/ant_plus_dongle.pcap'
+
+EXPR = 'ep == 0x81 and len > 8 and dir == in and data[0:1] == b"\\xa4"'
+
+
+def scapy_filter(pkt):
+    content = pkt.content
+    ep = getattr(content, 'ep', None)
+    data = bytes(getattr(content, 'data', b'') or b'')
+    return (
+        ep is not None
+        and ep.epnum == 1
+        and ep.epdir == pkt.URBEPDirection.URB_IN
+        and len(data) > 8
+        and data[0:1] == b'\xa4'
+    )
+
+
+def report(name, elapsed, count):
+    print(
+        f'{name:>6}: {count} packets in {elapsed:.3f}s, '
+        f'{elapsed / count * 1e6:.2f} us/packet'
+    )
+
+
+def bench(name, stream, filter, tmpdir):
+    writer = PcapFileWriter(pcap=os.path.join(tmpdir, f'{name}.pcap'), filter=filter)
+    start = time.perf_counter()
+    for cls, data in stream:
+        writer.usbq_log_pkt(LazyUSBMessage(cls, data))
+    elapsed = time.perf_counter() - start
+    writer.usbq_teardown()
+    report(name, elapsed, len(stream))
+    print(f'        {writer.stats.written} records written')
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with Capture(SAMPLE, index=False) as cap:
+        sample = [(cls, data) for rec, cls, data in usbq_messages(cap)]
+    stream = (sample * (count // len(sample) + 1))[:count]
+
+    f = PacketFilter(EXPR)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        none = bench('none', stream, None, tmpdir)
+        filtered = bench('filter', stream, f, tmpdir)
+
+    start = time.perf_counter()
+    matches = sum(f.match_wire(cls, data) for cls, data in stream)
+    match = time.perf_counter() - start
+    report('match', match, count)
+
+    start = time.perf_counter()
+    expected = sum(scapy_filter(cls(data)) for cls, data in stream)
+    scapy = time.perf_counter() - start
+    report('scapy', scapy, count)
+
+    assert matches == expected
+    print(f'{matches} matches')
+    print(
+        f'filter vs none: {none / filtered:.1f}x faster, '
+        f'match vs scapy: {scapy / match:.1f}x faster'
+    )
+
+
+if __name__ == '__main__':
+    main()
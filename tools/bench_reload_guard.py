@@ -0,0 +1,101 @@
+'''
+Benchmark the per-packet cost of the usbq_hooks error handlers.
+
+    python tools/bench_reload_guard.py [count]
+
+Device messages from the sample capture go through decode, log, modify,
+encode and send with:
+
+- none: no usbq_hooks.py, so no error handlers
+- hooks: a usbq_hooks.py implementing usbq_log_pkt, so one handler
+- all: handlers on every packet hook, as before they were registered per hook
+'''
+
+import sys
+import time
+
+from usbq.capture import Capture
+from usbq.capture import usbq_messages
+from usbq.engine import USBQEngine
+from usbq.hookspec import hookimpl
+from usbq.plugins.decode import USBDecode
+from usbq.plugins.encode import USBEncode
+from usbq.plugins.reload import _make_guard
+from usbq.plugins.reload import GUARD_NAME
+from usbq.plugins.reload import ReloadUSBQHooks
+from usbq.pm import HOOK_MOD
+from usbq.pm import pm
+from usbq.usbmitm_proto import USBMessageDevice
+
+SAMPLE = 'samples/ant_plus_dongle.pcap'
+
+PACKET_HOOKS = [
+    'usbq_log_pkt',
+    'usbq_device_decode',
+    'usbq_device_modify',
+    'usbq_device_encode',
+    'usbq_send_host_packet',
+]
+
+
+class Sink:
+    @hookimpl
+    def usbq_send_host_packet(self, data):
+        return True
+
+
+class USBQHooks:
+    @hookimpl
+    def usbq_log_pkt(self, pkt):
+        pass
+
+
+def bench(name, engine, stream):
+    start = time.perf_counter()
+    for data in stream:
+        pm.hook.usbq_send_host_packet(data=engine._process_device_packet(data))
+    elapsed = time.perf_counter() - start
+    print(
+        f'{name:>6}: {len(stream)} packets in {elapsed:.3f}s, '
+        f'{elapsed / len(stream) * 1e6:.2f} us/packet'
+    )
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with Capture(SAMPLE, index=False) as cap:
+        sample = [
+            data for rec, cls, data in usbq_messages(cap) if cls is USBMessageDevice
+        ]
+    stream = (sample * (count // len(sample) + 1))[:count]
+
+    reloader = ReloadUSBQHooks(hookfile='/nonexistent/usbq_hooks.py')
+    for name, plugin in [
+        ('reload', reloader),
+        ('decode', USBDecode()),
+        ('encode', USBEncode()),
+        ('sink', Sink()),
+    ]:
+        pm.register(plugin, name=name)
+    engine = USBQEngine(passthrough=False)
+
+    reloader._sync_guard()
+    none = bench('none', engine, stream)
+
+    pm.register(USBQHooks(), name=HOOK_MOD)
+    reloader._sync_guard()
+    hooks = bench('hooks', engine, stream)
+
+    pm.unregister(name=GUARD_NAME)
+    pm.register(_make_guard(reloader._catch, PACKET_HOOKS), name=GUARD_NAME)
+    full = bench('all', engine, stream)
+
+    print(
+        f'overhead vs none: hooks {(hooks - none) / count * 1e6:.2f} us/packet, '
+        f'all {(full - none) / count * 1e6:.2f} us/packet'
+    )
+
+
+if __name__ == '__main__':
+    main()
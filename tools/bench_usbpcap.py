@@ -0,0 +1,68 @@
+'''
+Benchmark usbmon record serialization: scapy USBPcap vs. struct packing.
+
+    python tools/bench_usbpcap.py [count]
+
+Messages are taken from the sample capture and repeated up to ``count``.
+'''
+
+import sys
+import time
+
+from scapy.all import raw
+
+from usbq.capture import Capture
+from usbq.capture import usbq_messages
+from usbq.usbmitm_proto import USBMessageHost
+from usbq.usbpcap import ack_from_msg
+from usbq.usbpcap import pack_ack
+from usbq.usbpcap import pack_req
+from usbq.usbpcap import pack_usbdev
+from usbq.usbpcap import pack_usbhost
+from usbq.usbpcap import req_from_msg
+from usbq.usbpcap import usbdev_to_usbpcap
+from usbq.usbpcap import usbhost_to_usbpcap
+
+SAMPLE = 'samples/ant_plus_dongle.pcap'
+
+
+def scapy_path(is_host, msg):
+    if is_host:
+        return raw(usbhost_to_usbpcap(msg)) + raw(ack_from_msg(msg))
+    return raw(req_from_msg(msg)) + raw(usbdev_to_usbpcap(msg))
+
+
+def struct_path(is_host, msg):
+    if is_host:
+        return pack_usbhost(msg) + pack_ack(msg)
+    return pack_req(msg) + pack_usbdev(msg)
+
+
+def bench(name, fn, stream):
+    start = time.perf_counter()
+    for is_host, msg in stream:
+        fn(is_host, msg)
+    elapsed = time.perf_counter() - start
+    print(
+        f'{name:>8}: {len(stream)} messages in {elapsed:.3f}s, '
+        f'{len(stream) / elapsed:.0f} msg/s'
+    )
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with Capture(SAMPLE, index=False) as cap:
+        sample = [
+            (cls is USBMessageHost, cls(data).content)
+            for rec, cls, data in usbq_messages(cap)
+        ]
+    stream = (sample * (count // len(sample) + 1))[:count]
+
+    slow = bench('scapy', scapy_path, stream)
+    fast = bench('struct', struct_path, stream)
+    print(f'speedup: {slow / fast:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
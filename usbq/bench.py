@@ -0,0 +1,322 @@
+'''
+Reproducible pipeline benchmarks.
+
+Each scenario is a fixed sequence of usbq_core messages played through the
+real engine and plugin stack by the proxy hardware simulator over UDP
+loopback. The simulator measures per-packet latency from sending a message
+to receiving it back from usbq.
+'''
+
+import asyncio
+import json
+import logging
+import platform
+import resource
+import threading
+import time
+from collections import OrderedDict
+
+import attr
+from scapy.compat import raw
+
+from . import __version__
+from .defs import USBDefs
+from .dissect.usb import ConfigurationDescriptor
+from .dissect.usb import DeviceDescriptor
+from .dissect.usb import EndpointDescriptor
+from .dissect.usb import GetDescriptor
+from .dissect.usb import InterfaceDescriptor
+from .dissect.usb import StringDescriptor
+from .engine import AsyncUSBQEngine
+from .pm import enable_plugins
+from .pm import pm
+from .simulator import LOOPBACK
+from .simulator import Simulator
+from .usbmitm_proto import USBEp
+from .usbmitm_proto import USBMessageDevice
+from .usbmitm_proto import USBMessageHost
+from .usbmitm_proto import USBMessageRequest
+from .usbmitm_proto import USBMessageResponse
+
+__all__ = ['SCENARIOS', 'BenchResult', 'run_scenario', 'compare']
+
+log = logging.getLogger(__name__)
+
+URB_IN = USBMessageHost.URBEPDirection.URB_IN
+URB_OUT = USBMessageHost.URBEPDirection.URB_OUT
+CTRL = USBDefs.EP.TransferType.CTRL
+BULK = USBDefs.EP.TransferType.BULK
+INT = USBDefs.EP.TransferType.INT
+
+#
+# Scenario traffic
+#
+
+
+def _host(epnum, eptype, epdir, **kwargs):
+    content = USBMessageRequest(ep=USBEp(epnum=epnum, eptype=eptype, epdir=epdir))
+    for key, value in kwargs.items():
+        setattr(content, key, value)
+    return True, raw(USBMessageHost(type=USBMessageHost.MitmType.USB, content=content))
+
+
+def _device(epnum, eptype, epdir, **kwargs):
+    content = USBMessageResponse(ep=USBEp(epnum=epnum, eptype=eptype, epdir=epdir))
+    for key, value in kwargs.items():
+        setattr(content, key, value)
+    return (
+        False,
+        raw(USBMessageDevice(type=USBMessageDevice.MitmType.USB, content=content)),
+    )
+
+
+def _get_descriptor(desc_type, response, index=0, length=None):
+    raw_response = raw(response)
+    request = GetDescriptor(
+        bDescriptorType=desc_type,
+        descriptor_index=index,
+        wLength=len(raw_response) if length is None else length,
+    )
+    return [
+        _host(0, CTRL, URB_IN, request=request),
+        _device(0, CTRL, URB_IN, request=request, response=response),
+    ]
+
+
+def enumeration():
+    'Control transfers of a device enumeration.'
+
+    types = USBDefs.DescriptorType
+    config = ConfigurationDescriptor(
+        descriptors=[InterfaceDescriptor(), EndpointDescriptor()]
+    )
+    return (
+        _get_descriptor(types.DEVICE_DESCRIPTOR, DeviceDescriptor(), length=64)
+        + _get_descriptor(types.DEVICE_DESCRIPTOR, DeviceDescriptor())
+        + _get_descriptor(
+            types.CONFIGURATION_DESCRIPTOR, ConfigurationDescriptor(), length=9
+        )
+        + _get_descriptor(types.CONFIGURATION_DESCRIPTOR, config)
+        + _get_descriptor(types.STRING_DESCRIPTOR, StringDescriptor())
+        + _get_descriptor(
+            types.STRING_DESCRIPTOR,
+            StringDescriptor(bString='usbq bench'.encode('utf-16-le')),
+            index=2,
+        )
+    )
+
+
+def hid():
+    'Keyboard reports on an interrupt IN endpoint.'
+
+    return [
+        _device(1, INT, URB_IN, data=bytes([0, 0, 4 + i, 0, 0, 0, 0, 0]))
+        for i in range(26)
+    ]
+
+
+def bulk():
+    'Mass storage READ(10): CBW, four 512 byte data packets and CSW.'
+
+    cbw = b'USBC' + bytes(11) + b'\x0a\x28' + bytes(14)
+    csw = b'USBS' + bytes(9)
+    return (
+        [_host(2, BULK, URB_OUT, data=cbw)]
+        + [_device(1, BULK, URB_IN, data=bytes([i]) * 512) for i in range(4)]
+        + [_device(1, BULK, URB_IN, data=csw)]
+    )
+
+
+def mixed():
+    'Enumeration, HID and mass storage traffic interleaved.'
+
+    res = []
+    for group in zip(enumeration(), hid(), bulk() * 2):
+        res.extend(group)
+    return res
+
+
+#: Benchmark scenarios and the message cycle each one repeats
+SCENARIOS = OrderedDict(
+    [
+        ('enumeration', enumeration),
+        ('hid', hid),
+        ('bulk', bulk),
+        ('mixed', mixed),
+    ]
+)
+
+
+#
+# Runner
+#
+
+
+@attr.s
+class BenchResult:
+    'Result of one benchmark scenario.'
+
+    scenario = attr.ib()
+    packets = attr.ib()
+    lost = attr.ib()
+
+    #: Seconds from the first message sent to the last received
+    elapsed = attr.ib()
+
+    #: Forwarded packets per second
+    throughput = attr.ib()
+
+    #: Per-packet round trip through usbq in microseconds
+    latency_us = attr.ib()
+
+    #: CPU seconds used by the engine thread
+    cpu_time = attr.ib()
+
+    @classmethod
+    def from_simulator(cls, scenario, sim, cpu_time):
+        stats = sim.stats['script'].summary()
+        elapsed = sim.stats.elapsed
+        return cls(
+            scenario=scenario,
+            packets=stats['received'],
+            lost=stats['lost'],
+            elapsed=elapsed,
+            throughput=stats['received'] / elapsed if elapsed > 0 else 0.0,
+            latency_us=stats['latency_us'],
+            cpu_time=cpu_time,
+        )
+
+
+def _run_engine(engine, sim):
+    errors = []
+
+    def run():
+        try:
+            sim.run()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, name='usbq-simulator', daemon=True)
+    thread.start()
+
+    if isinstance(engine, AsyncUSBQEngine):
+
+        async def serve():
+            loop = asyncio.get_running_loop()
+            done = loop.run_in_executor(None, thread.join)
+            done.add_done_callback(lambda f: engine.stop())
+            await engine.serve()
+
+        asyncio.run(serve())
+    else:
+        while thread.is_alive():
+            engine.event()
+
+    if len(errors) > 0:
+        raise errors[0]
+
+
+def run_scenario(name, packets, engine_cls, plugins, batch_size=1, window=32, **kwargs):
+    '''
+    Run a scenario through a freshly loaded plugin stack.
+
+    :param name: Key of SCENARIOS
+    :param packets: Number of messages to send
+    :param engine_cls: USBQEngine or AsyncUSBQEngine
+    :param plugins: Plugin list for enable_plugins() excluding the proxy
+    :param kwargs: Passed to enable_plugins()
+    '''
+    cycle = SCENARIOS[name]()
+    messages = (cycle * (packets // len(cycle) + 1))[:packets]
+
+    sim = Simulator(
+        proxy_addr=(LOOPBACK, 0),
+        script=messages,
+        respond=False,
+        ack=False,
+        window=window,
+    )
+    before = set(name for name, plugin in pm.list_name_plugin())
+    try:
+        enable_plugins(
+            pm,
+            [
+                (
+                    'proxy',
+                    {
+                        'device_addr': LOOPBACK,
+                        'device_port': 0,
+                        'host_addr': LOOPBACK,
+                        'host_port': sim.proxy_port,
+                        'batch_size': batch_size,
+                    },
+                )
+            ]
+            + plugins,
+            **kwargs,
+        )
+        sim.usbq_addr = pm.get_plugin('proxy').listen_address
+        engine = engine_cls(batch=batch_size > 1)
+
+        cpu = time.thread_time()
+        _run_engine(engine, sim)
+        cpu = time.thread_time() - cpu
+
+        pm.hook.usbq_teardown()
+    finally:
+        for plugin_name, plugin in pm.list_name_plugin():
+            if plugin_name not in before:
+                pm.unregister(name=plugin_name)
+        sim.close()
+
+    return BenchResult.from_simulator(name, sim, cpu)
+
+
+def report(results, **meta):
+    'JSON serializable benchmark report.'
+
+    return {
+        'usbq': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        # ru_maxrss is process wide so it covers every scenario of the run
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        **meta,
+        'scenarios': {res.scenario: attr.asdict(res) for res in results},
+    }
+
+
+def compare(current, baseline, threshold=0.1):
+    '''
+    Compare two reports.
+
+    Returns a list of (scenario, metric, baseline, current, regressed) for
+    throughput, p99 latency and CPU time per packet.
+    '''
+    res = []
+    for name, cur in current['scenarios'].items():
+        base = baseline['scenarios'].get(name, None)
+        if base is None:
+            continue
+
+        for metric, higher_is_better, get in [
+            ('throughput', True, lambda r: r['throughput']),
+            ('p99_us', False, lambda r: r['latency_us']['p99']),
+            (
+                'cpu_us_per_packet',
+                False,
+                lambda r: r['cpu_time'] / max(1, r['packets']) * 1e6,
+            ),
+        ]:
+            b, c = get(base), get(cur)
+            if higher_is_better:
+                regressed = c < b * (1 - threshold)
+            else:
+                regressed = c > b * (1 + threshold)
+            res.append((name, metric, b, c, regressed))
+    return res
+
+
+def load_report(fn):
+    with open(fn) as f:
+        return json.load(f)
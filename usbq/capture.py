@@ -0,0 +1,409 @@
+'''
+Random access to usbmon PCAP captures.
+
+The capture is memory mapped and an index of record offsets is built on
+first open and persisted in a ``.idx`` sidecar next to the capture, so
+multi-GB captures are scanned once. Records expose zero-copy ``memoryview``
+payloads and only build scapy ``USBPcap`` packets on demand.
+'''
+
+import bisect
+import logging
+import mmap
+import os
+import struct
+from array import array
+
+from .defs import USBDefs
+from .exceptions import USBQCaptureError
+from .usbmitm_proto import EP_HEADER
+from .usbmitm_proto import MESSAGE_HEADER
+from .usbmitm_proto import USBMessageDevice
+from .usbmitm_proto import USBMessageHost
+from .usbpcap import COMPLETE
+from .usbpcap import LINKTYPE_USB_LINUX
+from .usbpcap import PCAP_HEADER
+from .usbpcap import pcaptype_to_eptype
+from .usbpcap import RECORD_HEADER
+from .usbpcap import SUBMIT
+from .usbpcap import USBMON_HEADER
+from .usbpcap import USBMON_HEADER_LEN
+from .usbpcap import USBPcap
+
+__all__ = ['Capture', 'CaptureView', 'CaptureRecord', 'usbq_messages']
+
+log = logging.getLogger(__name__)
+
+#: Capture magic numbers and the divisor of the fractional timestamp
+PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e9),
+}
+
+#: magic, capture size, capture mtime, record count
+INDEX_HEADER = struct.Struct('<8sQQQ')
+INDEX_MAGIC = b'USBQIDX1'
+
+# Offsets of usbmon fields within a record
+_URB_TYPE = 8
+_URB_TRANSFERT = 9
+_ENDPOINT = 10
+_SETUP = USBMON_HEADER.size
+
+
+class CaptureRecord:
+    'A single usbmon record of a capture.'
+
+    __slots__ = ('capture', 'index')
+
+    def __init__(self, capture, index):
+        self.capture = capture
+        self.index = index
+
+    @property
+    def raw(self):
+        'Zero-copy view of the usbmon record.'
+
+        cap = self.capture
+        offset = cap._offsets[self.index]
+        return cap._view[offset : offset + cap._lengths[self.index]]
+
+    @property
+    def data(self):
+        'Zero-copy view of the payload following the usbmon header.'
+
+        return self.raw[USBMON_HEADER_LEN:]
+
+    @property
+    def setup(self):
+        'Zero-copy view of the setup packet of a CTRL submission, else None.'
+
+        if not self.is_ctrl_request():
+            return None
+        return self.raw[_SETUP : _SETUP + 8]
+
+    @property
+    def ts(self):
+        return self.capture._ts[self.index]
+
+    @property
+    def urb_type(self):
+        return chr(self.capture._urb_type[self.index])
+
+    @property
+    def pcap_type(self):
+        'usbmon transfer type'
+
+        return self.capture._transfert[self.index]
+
+    @property
+    def eptype(self):
+        return pcaptype_to_eptype[self.pcap_type]
+
+    @property
+    def epnum(self):
+        return self.capture._endpoint[self.index] & 0x7F
+
+    @property
+    def direction(self):
+        if self.capture._endpoint[self.index] & 0x80:
+            return USBDefs.EP.Direction.IN
+        return USBDefs.EP.Direction.OUT
+
+    @property
+    def packet(self):
+        'Scapy USBPcap dissection of the record.'
+
+        return USBPcap(bytes(self.raw))
+
+    def is_submit(self):
+        return self.urb_type == SUBMIT
+
+    def is_complete(self):
+        return self.urb_type == COMPLETE
+
+    def is_ctrl_request(self):
+        return self.is_submit() and self.eptype == USBDefs.EP.TransferType.CTRL
+
+    def __len__(self):
+        return self.capture._lengths[self.index]
+
+    def __repr__(self):
+        return (
+            f'<CaptureRecord #{self.index} ts={self.ts:.6f} {self.urb_type} '
+            f'ep={self.epnum} eptype={self.eptype} dir={self.direction} len={len(self)}>'
+        )
+
+
+class CaptureView:
+    'Sequence of records of a capture, narrowed by slicing and filters.'
+
+    def __init__(self, capture, indices):
+        self.capture = capture
+        self._indices = indices
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return CaptureView(self.capture, self._indices[item])
+        return CaptureRecord(self.capture, self._indices[item])
+
+    def __iter__(self):
+        cap = self.capture
+        for i in self._indices:
+            yield CaptureRecord(cap, i)
+
+    def between(self, start=None, end=None):
+        'Records with start <= timestamp < end.'
+
+        cap = self.capture
+        ts = cap._ts
+        indices = self._indices
+        if cap.sorted and isinstance(indices, range) and indices.step == 1:
+            lo, hi = indices.start, indices.stop
+            if start is not None:
+                lo = bisect.bisect_left(ts, start, lo, hi)
+            if end is not None:
+                hi = max(lo, bisect.bisect_left(ts, end, lo, hi))
+            return CaptureView(cap, range(lo, hi))
+
+        return CaptureView(
+            cap,
+            [
+                i
+                for i in indices
+                if (start is None or ts[i] >= start) and (end is None or ts[i] < end)
+            ],
+        )
+
+    def filter(self, epnum=None, eptype=None, direction=None, urb_type=None):
+        '''
+        Records matching all of the given criteria.
+
+        :param epnum: Endpoint number
+        :param eptype: USBDefs.EP.TransferType
+        :param direction: USBDefs.EP.Direction
+        :param urb_type: 'S' (submit) or 'C' (complete)
+        '''
+        cap = self.capture
+        tests = []
+        if epnum is not None:
+            tests.append(lambda i: cap._endpoint[i] & 0x7F == epnum)
+        if eptype is not None:
+            pcap_type = {v: k for k, v in pcaptype_to_eptype.items()}[eptype]
+            tests.append(lambda i: cap._transfert[i] == pcap_type)
+        if direction is not None:
+            flag = 0x80 if direction == USBDefs.EP.Direction.IN else 0
+            tests.append(lambda i: cap._endpoint[i] & 0x80 == flag)
+        if urb_type is not None:
+            code = ord(urb_type)
+            tests.append(lambda i: cap._urb_type[i] == code)
+
+        return CaptureView(
+            cap, [i for i in self._indices if all(test(i) for test in tests)]
+        )
+
+    def __repr__(self):
+        return f'<CaptureView {len(self)} records of {self.capture.filename}>'
+
+
+class Capture(CaptureView):
+    '''
+    Memory mapped usbmon PCAP capture.
+
+    Payload views reference the mapping and must be released before
+    ``close()``. Compressed captures must be decompressed first.
+
+    :param filename: PCAP file with linktype 220 (usbmon)
+    :param index: Load and persist the record index in a ``.idx`` sidecar
+    '''
+
+    def __init__(self, filename, index=True):
+        self.filename = str(filename)
+        self.index_filename = self.filename + '.idx'
+
+        self._f = open(self.filename, 'rb')
+        st = os.fstat(self._f.fileno())
+        if st.st_size < PCAP_HEADER.size:
+            self._f.close()
+            raise USBQCaptureError(f'{self.filename} is not a PCAP file')
+
+        self._mmap = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        self._stamp = (st.st_size, st.st_mtime_ns)
+
+        try:
+            self._parse_header()
+            if not (index and self._load_index()):
+                self._build_index()
+                if index:
+                    self._save_index()
+        except Exception:
+            self.close()
+            raise
+
+        self.sorted = all(a <= b for a, b in zip(self._ts, self._ts[1:]))
+        super().__init__(self, range(len(self._offsets)))
+
+    def _parse_header(self):
+        magic = bytes(self._view[:4])
+        if magic not in PCAP_MAGICS:
+            raise USBQCaptureError(f'{self.filename} is not a PCAP file')
+        endian, self._ts_scale = PCAP_MAGICS[magic]
+
+        self._file_header = struct.Struct(endian + PCAP_HEADER.format[1:])
+        self._record_header = struct.Struct(endian + RECORD_HEADER.format[1:])
+        linktype = self._file_header.unpack_from(self._view)[6]
+        if linktype != LINKTYPE_USB_LINUX:
+            raise USBQCaptureError(
+                f'{self.filename} has linktype {linktype}, expected {LINKTYPE_USB_LINUX}'
+            )
+
+    def _build_index(self):
+        log.debug(f'Indexing {self.filename}')
+        offsets = array('Q')
+        lengths = array('I')
+        ts = array('d')
+        urb_type = bytearray()
+        transfert = bytearray()
+        endpoint = bytearray()
+
+        buf = self._mmap
+        size = len(buf)
+        unpack = self._record_header.unpack_from
+        hdr_len = self._record_header.size
+        scale = self._ts_scale
+
+        offset = PCAP_HEADER.size
+        while offset + hdr_len <= size:
+            sec, frac, incl_len, _ = unpack(buf, offset)
+            offset += hdr_len
+            if offset + incl_len > size:
+                log.warning(f'Truncated record at offset {offset} of {self.filename}')
+                break
+            if incl_len < USBMON_HEADER_LEN:
+                raise USBQCaptureError(
+                    f'Record at offset {offset} of {self.filename} is too short'
+                )
+
+            offsets.append(offset)
+            lengths.append(incl_len)
+            ts.append(sec + frac / scale)
+            urb_type.append(buf[offset + _URB_TYPE])
+            transfert.append(buf[offset + _URB_TRANSFERT])
+            endpoint.append(buf[offset + _ENDPOINT])
+            offset += incl_len
+
+        self._offsets = offsets
+        self._lengths = lengths
+        self._ts = ts
+        self._urb_type = bytes(urb_type)
+        self._transfert = bytes(transfert)
+        self._endpoint = bytes(endpoint)
+
+    def _load_index(self):
+        try:
+            with open(self.index_filename, 'rb') as f:
+                magic, size, mtime, count = INDEX_HEADER.unpack(
+                    f.read(INDEX_HEADER.size)
+                )
+                if magic != INDEX_MAGIC or (size, mtime) != self._stamp:
+                    log.debug(f'Ignoring stale index {self.index_filename}')
+                    return False
+
+                self._offsets = array('Q')
+                self._lengths = array('I')
+                self._ts = array('d')
+                for a in [self._offsets, self._lengths, self._ts]:
+                    a.fromfile(f, count)
+                self._urb_type = f.read(count)
+                self._transfert = f.read(count)
+                self._endpoint = f.read(count)
+                if len(self._endpoint) != count:
+                    return False
+        except (OSError, EOFError, struct.error):
+            return False
+
+        log.debug(f'Loaded index {self.index_filename}')
+        return True
+
+    def _save_index(self):
+        try:
+            with open(self.index_filename, 'wb') as f:
+                f.write(
+                    INDEX_HEADER.pack(INDEX_MAGIC, *self._stamp, len(self._offsets))
+                )
+                for a in [self._offsets, self._lengths, self._ts]:
+                    a.tofile(f)
+                f.write(self._urb_type)
+                f.write(self._transfert)
+                f.write(self._endpoint)
+        except OSError as e:
+            log.debug(f'Could not save index {self.index_filename}: {e}')
+
+    def close(self):
+        self._view.release()
+        self._mmap.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return f'<Capture {self.filename} {len(self)} records>'
+
+
+def usbq_messages(records):
+    '''
+    Convert usbmon records to usbq_core messages.
+
+    Yields ``(record, cls, data)`` where ``cls`` is USBMessageHost or
+    USBMessageDevice and ``data`` the raw usbq_core message. usbq_core has no
+    message for submissions of non-CTRL IN transfers or completions of OUT
+    transfers (the pcap plugin synthesizes them) so those are skipped.
+
+    :param records: Iterable of CaptureRecord, such as a Capture or CaptureView
+    '''
+    ctrl = USBDefs.EP.TransferType.CTRL
+    urb_in = USBMessageHost.URBEPDirection.URB_IN
+    urb_out = USBMessageHost.URBEPDirection.URB_OUT
+    setup = None
+
+    for rec in records:
+        eptype = rec.eptype
+        epnum = rec.epnum
+        direction = rec.direction
+        ctrl_0 = eptype == ctrl and epnum == 0
+
+        if rec.is_submit():
+            if eptype != ctrl and direction == USBDefs.EP.Direction.IN:
+                continue
+            cls = USBMessageHost
+            if ctrl_0:
+                setup = bytes(rec.setup)
+        else:
+            if direction == USBDefs.EP.Direction.OUT:
+                continue
+            cls = USBMessageDevice
+
+        epdir = urb_in if direction == USBDefs.EP.Direction.IN else urb_out
+        content = [EP_HEADER.pack(epnum, eptype, epdir)]
+        if ctrl_0:
+            if setup is None:
+                log.debug(f'Skipping {rec}: no preceding setup packet')
+                continue
+            content.append(setup)
+        content.append(rec.data)
+
+        payload = b''.join(content)
+        header = MESSAGE_HEADER.pack(
+            MESSAGE_HEADER.size + len(payload), USBMessageHost.MitmType.USB
+        )
+        yield rec, cls, header + payload
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
+import os
 import sys
 
 import click
@@ -7,14 +9,22 @@ import click_config_file
 from coloredlogs import ColoredFormatter
 
 from . import __version__
-from .engine import USBQEngine
+from .engine import ENGINES
+from .exceptions import USBQInvocationError
 from .opts import add_options
+from .opts import BENCH_SCENARIOS
+from .opts import engine_options
+from .opts import filter_options
 from .opts import network_options
 from .opts import pcap_options
+from .opts import pipeline_plugin_options
+from .opts import replay_options
 from .opts import standard_plugin_options
 from .opts import usb_device_options
 from .pm import AVAILABLE_PLUGINS
+from .pm import enable_binary_tracing
 from .pm import enable_plugins
+from .pm import enable_profiling
 from .pm import enable_tracing
 from .pm import pm
 
@@ -68,6 +78,30 @@ def _setup_logging(logfile, debug):
     help='Logfile for --debug output',
 )
 @click.option('--trace', is_flag=True, default=False, help='Trace plugins.')
+@click.option(
+    '--trace-file',
+    type=click.Path(writable=True, dir_okay=False),
+    default=None,
+    help='Record hook calls to a binary trace file. Decode with trace-dump.',
+)
+@click.option(
+    '--trace-records',
+    default=65536,
+    type=click.IntRange(min=1),
+    help='Number of most recent hook events kept in the --trace-file ring buffer.',
+)
+@click.option(
+    '--profile-hooks',
+    is_flag=True,
+    default=False,
+    help='Measure the time spent in each hook implementation.',
+)
+@click.option(
+    '--profile-sample',
+    default=1,
+    type=click.IntRange(min=1),
+    help='Time 1 in N calls of each hook implementation with --profile-hooks.',
+)
 @click.option(
     '--dump', is_flag=True, default=False, help='Dump USBQ packets to console.'
 )
@@ -79,7 +113,17 @@ def _setup_logging(logfile, debug):
 )
 @click.pass_context
 @click_config_file.configuration_option(cmd_name='usbq', config_file_name='usbq.cfg')
-def main(ctx, debug, trace, logfile, **kwargs):
+def main(
+    ctx,
+    debug,
+    trace,
+    trace_file,
+    trace_records,
+    profile_hooks,
+    profile_sample,
+    logfile,
+    **kwargs,
+):
     '''USBQ: Python programming framework for monitoring and modifying USB communications.'''
 
     ctx.ensure_object(dict)
@@ -102,6 +146,12 @@ def main(ctx, debug, trace, logfile, **kwargs):
         if trace:
             enable_tracing()
 
+        if trace_file is not None:
+            enable_binary_tracing(trace_file, trace_records)
+
+        if profile_hooks:
+            enable_profiling(sample=profile_sample)
+
     return 0
 
 
@@ -114,20 +164,293 @@ def main(ctx, debug, trace, logfile, **kwargs):
 @click.pass_context
 @add_options(network_options)
 @add_options(pcap_options)
+@add_options(filter_options)
 @add_options(usb_device_options)
-def mitm(ctx, proxy_addr, proxy_port, listen_addr, listen_port, pcap, usb_id):
+@add_options(engine_options)
+def mitm(
+    ctx,
+    proxy_addr,
+    proxy_port,
+    listen_addr,
+    listen_port,
+    pcap,
+    usb_id,
+    engine,
+    batch_size,
+    **kwargs,
+):
     'Man-in-the-Middle USB device to host communications.'
 
     enable_plugins(
         pm,
         standard_plugin_options(
-            proxy_addr, proxy_port, listen_addr, listen_port, pcap, dump=ctx.obj['dump']
+            proxy_addr,
+            proxy_port,
+            listen_addr,
+            listen_port,
+            pcap,
+            dump=ctx.obj['dump'],
+            batch_size=batch_size,
+            **kwargs,
         )
         + [('lookfor', {'usb_id': usb_id})],
         disabled=ctx.obj['disable_plugin'],
         enabled=ctx.obj['enable_plugin'],
     )
-    USBQEngine().run()
+    ENGINES[engine](batch=batch_size > 1).run()
+
+
+@main.command()
+@click.pass_context
+@click.argument('capture', type=click.Path(exists=True, dir_okay=False))
+@add_options(replay_options)
+@add_options(pcap_options)
+@add_options(filter_options)
+@add_options(engine_options)
+def replay(ctx, capture, pacing, rate, loops, pcap, engine, batch_size, **kwargs):
+    'Replay a usbmon PCAP capture through the plugins without hardware.'
+
+    if os.path.abspath(capture) == os.path.abspath(pcap):
+        raise USBQInvocationError('--pcap must not overwrite the replayed capture.')
+
+    enable_plugins(
+        pm,
+        [
+            (
+                'replay',
+                {
+                    'pcap': capture,
+                    'pacing': pacing,
+                    'rate': rate,
+                    'loops': loops,
+                    'batch_size': batch_size,
+                },
+            )
+        ]
+        + pipeline_plugin_options(pcap, dump=ctx.obj['dump'], **kwargs),
+        disabled=ctx.obj['disable_plugin'],
+        enabled=ctx.obj['enable_plugin'],
+    )
+    ENGINES[engine](batch=batch_size > 1).run()
+
+
+@main.command()
+@click.pass_context
+@click.option(
+    '--scenario',
+    type=click.Choice(BENCH_SCENARIOS),
+    multiple=True,
+    default=BENCH_SCENARIOS,
+    help='Scenario to run. May be repeated. Default: all.',
+)
+@click.option(
+    '--packets',
+    default=5000,
+    type=click.IntRange(min=1),
+    help='Messages sent per scenario.',
+)
+@click.option(
+    '--window',
+    default=32,
+    type=click.IntRange(min=1),
+    help='Maximum number of messages in flight through usbq.',
+)
+@click.option(
+    '--output',
+    default='-',
+    type=click.Path(dir_okay=False, writable=True, allow_dash=True),
+    help='File to write JSON results to.',
+)
+@click.option(
+    '--baseline',
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help='JSON results of a previous run to compare against.',
+)
+@click.option(
+    '--threshold',
+    default=0.1,
+    type=float,
+    help='Relative change from the baseline that counts as a regression.',
+)
+@add_options(pcap_options)
+@add_options(engine_options)
+def bench(
+    ctx,
+    scenario,
+    packets,
+    window,
+    output,
+    baseline,
+    threshold,
+    pcap,
+    engine,
+    batch_size,
+    **kwargs,
+):
+    'Benchmark the plugin pipeline with a loopback stand-in for the proxy.'
+
+    from .bench import compare
+    from .bench import load_report
+    from .bench import report
+    from .bench import run_scenario
+
+    # Keep stdout for the JSON report
+    if output == '-':
+        logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    for name in scenario:
+        log.info(f'Running {name} benchmark.')
+        results.append(
+            run_scenario(
+                name,
+                packets,
+                ENGINES[engine],
+                pipeline_plugin_options(pcap, dump=ctx.obj['dump'], **kwargs),
+                batch_size=batch_size,
+                window=window,
+                disabled=ctx.obj['disable_plugin'],
+                enabled=ctx.obj['enable_plugin'],
+            )
+        )
+
+    res = report(
+        results, engine=engine, batch_size=batch_size, packets=packets, window=window
+    )
+    with click.open_file(output, 'w') as f:
+        json.dump(res, f, indent=2)
+        f.write('\n')
+
+    if baseline is not None:
+        regressions = 0
+        for name, metric, base, cur, regressed in compare(
+            res, load_report(baseline), threshold
+        ):
+            regressions += regressed
+            click.echo(
+                f'{name:>12} {metric:>18}: {base:12.1f} -> {cur:12.1f} '
+                f'{"REGRESSION" if regressed else "ok"}',
+                err=True,
+            )
+        if regressions > 0:
+            ctx.exit(1)
+
+
+def _parse_streams(ctx, param, value):
+    from .simulator import Stream
+
+    try:
+        return [Stream.parse(spec) for spec in value]
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+@main.command()
+@click.pass_context
+@add_options(network_options)
+@click.option(
+    '--stream',
+    multiple=True,
+    default=['hid:1:int:in:8:1000:1000'],
+    callback=_parse_streams,
+    help='Traffic stream NAME:EPNUM:TYPE:DIR[:SIZE[:RATE[:COUNT]]]. May be repeated.',
+)
+@click.option(
+    '--enumerations',
+    default=1,
+    type=click.IntRange(min=0),
+    help='Number of device enumerations to send.',
+)
+@click.option(
+    '--window',
+    default=32,
+    type=click.IntRange(min=1),
+    help='Maximum number of messages in flight through usbq.',
+)
+@click.option(
+    '--no-ack',
+    is_flag=True,
+    default=False,
+    help='Do not acknowledge forwarded USB messages.',
+)
+@click.option(
+    '--output',
+    default='-',
+    type=click.Path(dir_okay=False, writable=True, allow_dash=True),
+    help='File to write JSON statistics to.',
+)
+def simulate(
+    ctx,
+    proxy_addr,
+    proxy_port,
+    listen_addr,
+    listen_port,
+    stream,
+    enumerations,
+    window,
+    no_ack,
+    output,
+):
+    'Simulate the USB MITM proxy hardware to load a running usbq.'
+
+    from .simulator import Simulator
+
+    if output == '-':
+        logging.getLogger().setLevel(logging.WARNING)
+
+    # The simulator takes the place of the proxy and sends to usbq
+    usbq_addr = '127.0.0.1' if listen_addr == '0.0.0.0' else listen_addr
+    sim = Simulator(
+        usbq_addr=(usbq_addr, listen_port),
+        proxy_addr=(proxy_addr, proxy_port),
+        streams=stream,
+        enumerations=enumerations,
+        window=window,
+        ack=not no_ack,
+    )
+    try:
+        sim.run()
+    except TimeoutError as e:
+        raise click.ClickException(str(e))
+    except KeyboardInterrupt:
+        log.info('User requested exit.')
+    finally:
+        sim.close()
+
+    with click.open_file(output, 'w') as f:
+        json.dump(sim.stats.summary(), f, indent=2)
+        f.write('\n')
+
+
+@main.command('trace-dump')
+@click.argument('trace_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--hook', multiple=True, default=[], help='Only show this hook.')
+@click.option(
+    '--last',
+    default=0,
+    type=click.IntRange(min=0),
+    help='Only show the last N records. Default: all.',
+)
+def trace_dump(trace_file, hook, last):
+    'Decode a binary --trace-file.'
+
+    from .trace import TraceFile
+
+    try:
+        trace = TraceFile.open(trace_file)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    records = [rec for rec in trace.records() if len(hook) == 0 or rec.hook in hook]
+    if last > 0:
+        records = records[-last:]
+    if trace.count > trace.capacity:
+        click.echo(f'{trace.count - trace.capacity} older records were overwritten.')
+
+    t0 = records[0].ts if len(records) > 0 else 0
+    for rec in records:
+        click.echo(rec.format(t0))
 
 
 if __name__ == "__main__":
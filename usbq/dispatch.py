@@ -0,0 +1,198 @@
+'''
+Precompiled hook dispatch for the engine hot path.
+
+A DispatchPlan exposes hooks as plain callables with the calling
+convention of ``pm.hook``. Hooks without implementations become no-ops and
+hooks with a single implementation call it directly. Hooks with several
+implementations or wrappers, and every hook while hook call monitoring is
+active, are dispatched by pluggy.
+
+Packet hooks with subscribed implementations (see hookspec.subscribe) are
+dispatched per message type and endpoint to the implementations
+subscribed to them.
+'''
+
+from .hookspec import SUBSCRIBABLE_HOOKS
+from .hookspec import SUBSCRIPTION
+
+__all__ = ['DispatchPlan', 'SubscribedHook', 'compile_hook', 'packet_key']
+
+
+def _none(**kwargs):
+    return None
+
+
+def _empty(**kwargs):
+    return []
+
+
+def _is_wrapper(impl):
+    return impl.hookwrapper or getattr(impl, 'wrapper', False)
+
+
+def _original(impl):
+    'Return True if impl.function is the function the plugin was registered with.'
+
+    func = impl.function
+    name = getattr(func, '__name__', None)
+    return name is not None and getattr(impl.plugin, name, None) == func
+
+
+def _bind(impl, argnames):
+    'Call impl with the hook keyword arguments, as pluggy does.'
+
+    func = impl.function
+    names = impl.argnames
+    if tuple(names) == tuple(argnames) and _original(impl):
+        # Same parameter names as the hookspec
+        return func
+
+    # Replaced functions, such as profiling wrappers, may only take
+    # positional arguments as pluggy passes them
+    def call(**kwargs):
+        return func(*[kwargs[name] for name in names])
+
+    return call
+
+
+def _compile(pm, caller, impls):
+    'Return a callable calling impls, or caller when pluggy is needed.'
+
+    spec = caller.spec
+    firstresult = spec is not None and spec.opts.get('firstresult', False)
+
+    if pm.monitors > 0 or any(_is_wrapper(impl) for impl in impls):
+        return caller
+
+    if len(impls) == 0:
+        return _none if firstresult else _empty
+
+    if len(impls) > 1:
+        return caller
+
+    func = _bind(impls[0], spec.argnames if spec is not None else ())
+    if firstresult:
+        return func
+
+    def collect(**kwargs):
+        res = func(**kwargs)
+        return [] if res is None else [res]
+
+    return collect
+
+
+def compile_hook(pm, name):
+    'Return a callable equivalent to calling pm.hook.<name>.'
+
+    caller = getattr(pm.hook, name, None)
+    if caller is None:
+        # Neither specified nor implemented
+        return _empty
+    return _compile(pm, caller, caller.get_hookimpls())
+
+
+def subscription(impl, name):
+    'Return the Subscription of a hookimpl, None if it takes every packet.'
+
+    res = getattr(impl.function, SUBSCRIPTION, None)
+    if res is None:
+        # impl.function may have been replaced, such as by the profiler
+        res = getattr(getattr(impl.plugin, name, None), SUBSCRIPTION, None)
+    return res
+
+
+def packet_key(pkt):
+    'Return the (message type, epnum, epdir, eptype) of a decoded message.'
+
+    if hasattr(type(pkt), 'header') and not pkt.is_dissected():
+        # LazyUSBMessage before dissection
+        header = pkt.header
+        msgtype, ep = header.type, header.ep
+    else:
+        msgtype = getattr(pkt, 'type', None)
+        ep = getattr(getattr(pkt, 'content', None), 'ep', None)
+
+    if ep is None:
+        return msgtype, None, None, None
+    return msgtype, ep.epnum, ep.epdir, ep.eptype
+
+
+class SubscribedHook:
+    '''
+    Packet hook that only calls the implementations subscribed to a packet.
+
+    The call for each packet key is derived on first use and kept until the
+    hook is rebuilt.
+
+    :param compiled: Compile calls as compile_hook does, False calls pluggy
+    '''
+
+    def __init__(self, pm, name, compiled=True):
+        self._pm = pm
+        self._name = name
+        self._compiled = compiled
+        self._caller = getattr(pm.hook, name)
+        self._impls = [
+            (impl, subscription(impl, name)) for impl in self._caller.get_hookimpls()
+        ]
+
+        #: packet_key() -> callable
+        self.calls = {}
+
+    def _call_for(self, key):
+        impls = [impl for impl, sub in self._impls if sub is None or sub.match(*key)]
+        if len(impls) == len(self._impls):
+            if self._compiled:
+                return _compile(self._pm, self._caller, impls)
+            return self._caller
+
+        if self._compiled and self._pm.monitors == 0:
+            # No pluggy needed
+            res = _compile(self._pm, self._caller, impls)
+            if res is not self._caller:
+                return res
+
+        # Hook call monitors see the implementations actually called
+        names = {impl.plugin_name for impl in impls}
+        skip = [
+            impl.plugin for impl, sub in self._impls if impl.plugin_name not in names
+        ]
+        return self._pm.subset_hook_caller(self._name, skip)
+
+    def __call__(self, pkt):
+        key = packet_key(pkt)
+        call = self.calls.get(key, None)
+        if call is None:
+            call = self.calls[key] = self._call_for(key)
+        return call(pkt=pkt)
+
+
+def _subscribed(pm, name):
+    if name not in SUBSCRIBABLE_HOOKS:
+        return False
+    caller = getattr(pm.hook, name, None)
+    if caller is None:
+        return False
+    return any(subscription(impl, name) is not None for impl in caller.get_hookimpls())
+
+
+class DispatchPlan:
+    '''
+    Hook callables compiled for the current plugin registrations.
+
+    Rebuild the plan when ``pm.generation`` changes.
+
+    :param compiled: Compile hooks, False calls pm.hook except for
+        subscribed packet hooks
+    '''
+
+    def __init__(self, pm, hooknames, compiled=True):
+        self.generation = pm.generation
+        for name in hooknames:
+            if _subscribed(pm, name):
+                hook = SubscribedHook(pm, name, compiled)
+            elif compiled:
+                hook = compile_hook(pm, name)
+            else:
+                hook = getattr(pm.hook, name, _empty)
+            setattr(self, name, hook)
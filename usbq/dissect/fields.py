@@ -55,7 +55,7 @@ class TypePacketField(StrField):
 
     def m2i(self, pkt, m):
         t = getattr(pkt, self.type_field)
-        return self.type_pkt[t](m)
+        return self.type_pkt[t](m, _parent=pkt)
 
     def getfield(self, pkt, s):
         i = self.m2i(pkt, s)
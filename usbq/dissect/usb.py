@@ -38,6 +38,7 @@ __all__ = [
     'SetIDLE',
     'SetInterface',
     'StringDescriptor',
+    'TrackedPacket',
     'UnknownDescriptor',
     'URB',
     'USBDescriptor',
@@ -45,7 +46,53 @@ __all__ = [
 ]
 
 
-class USBPacket(Packet):
+class TrackedPacket(Packet):
+    """
+    Packet that tracks field assignment.
+
+    Assigning a field discards the raw packet cache of the packet and of
+    every packet that contains it so that a later build only rebuilds the
+    modified branch. Unmodified sub-packets keep their dissected bytes.
+
+    ``mutations`` counts the field assignments to the packet and to the
+    packets it contains, so that values derived from a packet can be
+    checked without rebuilding it.
+    """
+
+    #: Field assignments to the packet and its sub-packets
+    mutations = 0
+
+    def setfieldval(self, attr, val):
+        super().setfieldval(attr, val)
+
+        if attr in self.default_fields:
+            self.mutations += 1
+            parent = self.parent
+            while parent is not None:
+                parent.raw_packet_cache = None
+                parent.mutations += 1
+                parent = parent.parent
+
+    def is_dirty(self):
+        "Return True if the packet must be rebuilt to be serialized."
+        return self.raw_packet_cache is None
+
+    def track(self):
+        """
+        Link the sub-packets of a packet built from fields to their parent.
+
+        Dissected packets are linked by scapy. Returns the packet.
+        """
+        for value in self.fields.values():
+            children = value if isinstance(value, list) else [value]
+            for child in children:
+                if isinstance(child, TrackedPacket):
+                    child.parent = self
+                    child.track()
+        return self
+
+
+class USBPacket(TrackedPacket):
     def extract_padding(self, s):
         return "", s
 
@@ -179,7 +226,7 @@ class SetIDLE(RequestDescriptor):
         return "SetIDLE"
 
 
-def URB(payload):
+def URB(payload, **kwargs):
     breqtype = payload[0]
     breq = payload[1]
     if breq == 6:
@@ -194,7 +241,7 @@ def URB(payload):
         cls = SetInterface
     else:
         cls = RequestDescriptor
-    return cls(payload)
+    return cls(payload, **kwargs)
 
 
 bDeviceClass = {0: "Device"}
@@ -203,11 +250,11 @@ idVendor = {}
 idProduct = {}
 
 
-def Descriptor(payload):
+def Descriptor(payload, **kwargs):
     from .hid import HIDDescriptor, HIDReportDescriptor
 
     if len(payload) < 2:
-        return RawDescriptor(payload)
+        return RawDescriptor(payload, **kwargs)
     desctype = payload[1]
     if desctype == 1:
         desc_len = payload[0]
@@ -231,7 +278,7 @@ def Descriptor(payload):
         cls = HIDDescriptor
     else:
         cls = UnknownDescriptor
-    return cls(payload)
+    return cls(payload, **kwargs)
 
 
 class RawDescriptor(USBDescriptor):
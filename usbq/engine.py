@@ -1,99 +1,579 @@
+import asyncio
+import inspect
 import logging
+import os
+import time
 
 import attr
 
+from .dispatch import DispatchPlan
 from .exceptions import USBQDeviceNotConnected
+from .exceptions import USBQEndOfStream
 from .pm import pm
 
-__all__ = ['USBQEngine']
+__all__ = ['USBQEngine', 'AsyncUSBQEngine', 'ENGINES']
 
 log = logging.getLogger(__name__)
 
+#: Encode plugins that reproduce the decoded wire bytes of unmodified packets
+PASSTHROUGH_ENCODERS = ['encode']
+
+#: Hooks called on the forwarding path
+ENGINE_HOOKS = [
+    'usbq_tick',
+    'usbq_wait_for_packet',
+    'usbq_log_pkt',
+    'usbq_device_has_packet',
+    'usbq_get_device_packet',
+    'usbq_get_device_batch',
+    'usbq_device_decode',
+    'usbq_device_modify',
+    'usbq_device_encode',
+    'usbq_send_device_packet',
+    'usbq_send_device_batch',
+    'usbq_host_has_packet',
+    'usbq_get_host_packet',
+    'usbq_get_host_batch',
+    'usbq_host_decode',
+    'usbq_host_modify',
+    'usbq_host_encode',
+    'usbq_send_host_packet',
+    'usbq_send_host_batch',
+]
+
+#: plan: call hooks through a DispatchPlan, pluggy: call pm.hook except to
+#: select subscribed implementations
+DISPATCH = ['plan', 'pluggy']
+
+#: Default hook dispatch. Set USBQ_DISPATCH=pluggy to bypass dispatch plans.
+DEFAULT_DISPATCH = os.environ.get('USBQ_DISPATCH', 'plan')
+
+
+#: Packet sources, named after the side that sent the packets
+DIRECTIONS = ['device', 'host']
+
+
+@attr.s(frozen=True, slots=True)
+class Pipeline:
+    'Hooks forwarding the packets of one direction, resolved from a DispatchPlan.'
+
+    #: Side that sent the packets, see DIRECTIONS
+    source = attr.ib()
+
+    #: Forward the original bytes, nothing can change the packets
+    raw = attr.ib()
+
+    has_packet = attr.ib()
+    get = attr.ib()
+    get_batch = attr.ib()
+    decode = attr.ib()
+    modify = attr.ib()
+    encode = attr.ib()
+    send = attr.ib()
+    send_batch = attr.ib()
+
+    @classmethod
+    def from_plan(cls, hook, source, raw):
+        dest = 'host' if source == 'device' else 'device'
+        return cls(
+            source=source,
+            raw=raw,
+            has_packet=getattr(hook, f'usbq_{source}_has_packet'),
+            get=getattr(hook, f'usbq_get_{source}_packet'),
+            get_batch=getattr(hook, f'usbq_get_{source}_batch'),
+            decode=getattr(hook, f'usbq_{source}_decode'),
+            modify=getattr(hook, f'usbq_{source}_modify'),
+            encode=getattr(hook, f'usbq_{source}_encode'),
+            send=getattr(hook, f'usbq_send_{dest}_packet'),
+            send_batch=getattr(hook, f'usbq_send_{dest}_batch'),
+        )
+
+
+def _is_wrapper(impl):
+    return impl.hookwrapper or getattr(impl, 'wrapper', False)
+
+
+def _impls(hookname):
+    'Return the non-wrapper hookimpls registered for hookname.'
+
+    hook = getattr(pm.hook, hookname, None)
+    if hook is None:
+        return []
+    return [impl for impl in hook.get_hookimpls() if not _is_wrapper(impl)]
+
 
 @attr.s
 class USBQEngine:
     'Packet forwarding engine for device to host MITM.'
 
-    def _do_device_packet(self):
-        data = pm.hook.usbq_get_device_packet()
-        if data is None:
-            return
+    #: Drain packet sources in batches when supported by the source plugin
+    batch = attr.ib(converter=bool, default=False)
 
-        # Decode and log
-        pkt = pm.hook.usbq_device_decode(data=data)
-        if pkt is None:
-            return
+    #: Forward original bytes when no plugin can modify packets
+    passthrough = attr.ib(converter=bool, default=True)
 
-        pm.hook.usbq_log_pkt(pkt=pkt)
+    #: Hook dispatch, see DISPATCH
+    dispatch = attr.ib(
+        default=DEFAULT_DISPATCH, validator=attr.validators.in_(DISPATCH)
+    )
 
-        # Mangle
-        pm.hook.usbq_device_modify(pkt=pkt)
+    def __attrs_post_init__(self):
+        self._generation = None
+        self.refresh()
 
-        # Encode
-        send_data = pm.hook.usbq_device_encode(pkt=pkt)
-        if send_data is None:
-            return
+    def _can_passthrough(self, direction):
+        if not self.passthrough:
+            return False
 
-        # Forward
-        pm.hook.usbq_send_host_packet(data=send_data)
+        if len(_impls(f'usbq_{direction}_modify')) > 0:
+            return False
 
-    def _do_host_packet(self):
-        data = pm.hook.usbq_get_host_packet()
-        if data is None:
+        encoders = _impls(f'usbq_{direction}_encode')
+        return all(impl.plugin_name in PASSTHROUGH_ENCODERS for impl in encoders)
+
+    def refresh(self):
+        '''
+        Re-derive the forwarding fast path and hook dispatch when plugins
+        have been registered or unregistered.
+        '''
+        if self._generation == pm.generation:
             return
+        self._generation = pm.generation
+
+        self._hook = DispatchPlan(pm, ENGINE_HOOKS, compiled=self.dispatch == 'plan')
+
+        self._raw_device = self._can_passthrough('device')
+        self._raw_host = self._can_passthrough('host')
+        self._log_pkt = len(_impls('usbq_log_pkt')) > 0
+        self._pipelines = {
+            direction: Pipeline.from_plan(
+                self._hook, direction, getattr(self, f'_raw_{direction}')
+            )
+            for direction in DIRECTIONS
+        }
+
+        # Stage latency is recorded while the latency plugin is registered
+        monitor = pm.get_plugin('latency')
+        self._latency = monitor.stats if monitor is not None else None
+
+    def _process(self, pipe, data, stages=None, t=0):
+        '''
+        Run the decode, log, modify and encode stages of a pipeline over data.
+
+        Returns the data to send, or None, and perf_counter_ns() at the end
+        of the last stage if the latency of each stage is recorded to stages.
+        '''
+        if pipe.raw and not self._log_pkt:
+            return data, t
 
         # Decode and log
-        pkt = pm.hook.usbq_host_decode(data=data)
+        pkt = pipe.decode(data=data)
+        if stages is not None:
+            t = stages.decode.record_since(t)
         if pkt is None:
-            return
+            return None, t
 
-        pm.hook.usbq_log_pkt(pkt=pkt)
+        self._hook.usbq_log_pkt(pkt=pkt)
+        if stages is not None:
+            t = stages.log.record_since(t)
+
+        if pipe.raw:
+            # Nothing can change the packet: decoded only to log it
+            return data, t
 
         # Mangle
-        pm.hook.usbq_host_modify(pkt=pkt)
+        pipe.modify(pkt=pkt)
+        if stages is not None:
+            t = stages.modify.record_since(t)
 
         # Encode
-        send_data = pm.hook.usbq_host_encode(pkt=pkt)
-        if send_data is None:
-            return
+        send_data = pipe.encode(pkt=pkt)
+        if stages is not None:
+            t = stages.encode.record_since(t)
+        return send_data, t
 
-        # Forward
+    def _process_device_packet(self, data):
+        return self._process(self._pipelines['device'], data)[0]
+
+    def _process_host_packet(self, data):
+        return self._process(self._pipelines['host'], data)[0]
+
+    def _send(self, pipe, data):
         try:
-            pm.hook.usbq_send_device_packet(data=send_data)
+            pipe.send(data=data)
         except USBQDeviceNotConnected:
             log.info('USB device not connected yet. Dropping packet from host.')
             raise
 
+    def _send_batch(self, pipe, batch):
+        try:
+            if pipe.send_batch(batch=batch) is None:
+                for data in batch:
+                    pipe.send(data=data)
+        except USBQDeviceNotConnected:
+            log.info('USB device not connected yet. Dropping packets from host.')
+            raise
+
+    def _do_packet(self, pipe):
+        '''
+        Forward one packet from the source of a pipeline.
+
+        Returns False if no packet was available.
+        '''
+        latency = self._latency
+        start = time.perf_counter_ns() if latency is not None else 0
+        data = pipe.get()
+        if data is None:
+            return False
+
+        stages = None
+        t = start
+        if latency is not None:
+            stages = latency.select(pipe.source, data)
+            t = stages.get.record_since(start)
+
+        send_data, t = self._process(pipe, data, stages, t)
+        if send_data is not None:
+            # Forward
+            self._send(pipe, send_data)
+            if stages is not None:
+                t = stages.send.record_since(t)
+                stages.total.record(t - start)
+        return True
+
+    def _do_batch(self, pipe):
+        '''
+        Forward all packets queued by the source of a pipeline.
+
+        Returns the number of packets, or None if no plugin supports batched
+        receive or stage latency is recorded, which is done per packet.
+        '''
+        if self._latency is not None:
+            return None
+
+        batch = pipe.get_batch()
+        if batch is None:
+            return None
+
+        # Batched data are views of the pooled receive buffers, decoded
+        # without a copy: see usbq_get_device_batch
+        send_batch = []
+        for data in batch:
+            send_data = self._process(pipe, data)[0]
+            if send_data is not None:
+                send_batch.append(send_data)
+
+        # Forward
+        if len(send_batch) > 0:
+            self._send_batch(pipe, send_batch)
+        return len(batch)
+
     def event(self):
         # Let plugins do work
-        if hasattr(pm.hook, 'usbq_tick'):
-            pm.hook.usbq_tick()
+        if hasattr(self._hook, 'usbq_tick'):
+            self._hook.usbq_tick()
 
-        # Used to prevent busy loop
-        pm.hook.usbq_wait_for_packet()
+        # Plugins may have been (un)registered
+        self.refresh()
 
-        while pm.hook.usbq_device_has_packet():
-            self._do_device_packet()
+        # Used to prevent busy loop
+        self._hook.usbq_wait_for_packet()
 
-        while pm.hook.usbq_host_has_packet():
-            self._do_host_packet()
+        for direction in DIRECTIONS:
+            if self.batch and self._do_batch(self._pipelines[direction]) is not None:
+                continue
+            while self._pipelines[direction].has_packet():
+                self._do_packet(self._pipelines[direction])
+                self.refresh()
 
     def run(self):
         ipy = pm.get_plugin('ipython')
         if ipy is not None:
             log.info('Starting USB processing engine with IPython UI.')
             ipy.run(engine=self)
+            log.critical('User requested exit.')
         else:
             log.info('Starting USB processing engine.')
             while True:
                 try:
                     self.event()
                 except KeyboardInterrupt:
+                    log.critical('User requested exit.')
+                    break
+                except USBQEndOfStream as e:
+                    log.info(f'Packet source finished: {e}')
                     break
 
-        log.critical('User requested exit.')
         pm.hook.usbq_teardown()
 
         # Take one more pass through the loop to send/recv packets
         self.event()
         return
+
+
+async def _resolve(result):
+    'Await the result of a firstresult hook if it came from an async hookimpl.'
+
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+async def _resolve_all(results):
+    'Await, in hookimpl order, all awaitable results of a hook.'
+
+    for res in results:
+        if inspect.isawaitable(res):
+            await res
+
+
+@attr.s
+class AsyncUSBQEngine(USBQEngine):
+    '''
+    Packet forwarding engine driven by an asyncio event loop.
+
+    Selectable event sources returned by ``usbq_event_sources`` are
+    registered once with the loop and their readiness callbacks drive the
+    decode/log/modify/encode/send pipeline. Packet sources without a
+    selectable are polled on each tick and drained while they have packets.
+    Hook implementations may be declared ``async def``; their results are
+    awaited in order.
+    '''
+
+    #: Seconds between usbq_tick calls
+    tick_interval = attr.ib(converter=float, default=0.1)
+
+    DIRECTIONS = DIRECTIONS
+
+    def __attrs_post_init__(self):
+        super().__attrs_post_init__()
+        self._stop = None
+
+    async def _aprocess(self, pipe, data, stages=None, t=0):
+        'Async _process().'
+
+        if pipe.raw and not self._log_pkt:
+            return data, t
+
+        # Decode and log
+        pkt = await _resolve(pipe.decode(data=data))
+        if stages is not None:
+            t = stages.decode.record_since(t)
+        if pkt is None:
+            return None, t
+
+        await _resolve_all(self._hook.usbq_log_pkt(pkt=pkt))
+        if stages is not None:
+            t = stages.log.record_since(t)
+
+        if pipe.raw:
+            # Nothing can change the packet: decoded only to log it
+            return data, t
+
+        # Mangle
+        await _resolve_all(pipe.modify(pkt=pkt))
+        if stages is not None:
+            t = stages.modify.record_since(t)
+
+        # Encode
+        send_data = await _resolve(pipe.encode(pkt=pkt))
+        if stages is not None:
+            t = stages.encode.record_since(t)
+        return send_data, t
+
+    async def _asend(self, pipe, data):
+        try:
+            await _resolve(pipe.send(data=data))
+        except USBQDeviceNotConnected:
+            log.info('USB device not connected yet. Dropping packet from host.')
+            raise
+
+    async def _asend_batch(self, pipe, batch):
+        try:
+            if await _resolve(pipe.send_batch(batch=batch)) is None:
+                for data in batch:
+                    await _resolve(pipe.send(data=data))
+        except USBQDeviceNotConnected:
+            log.info('USB device not connected yet. Dropping packets from host.')
+            raise
+
+    async def _ado_packet(self, pipe):
+        'Async _do_packet().'
+
+        latency = self._latency
+        start = time.perf_counter_ns() if latency is not None else 0
+        data = pipe.get()
+        if data is None:
+            return False
+
+        stages = None
+        t = start
+        if latency is not None:
+            stages = latency.select(pipe.source, data)
+            t = stages.get.record_since(start)
+
+        send_data, t = await self._aprocess(pipe, data, stages, t)
+        if send_data is not None:
+            # Forward
+            await self._asend(pipe, send_data)
+            if stages is not None:
+                t = stages.send.record_since(t)
+                stages.total.record(t - start)
+        return True
+
+    async def _ado_batch(self, pipe):
+        '''
+        Async _do_batch(), falling back to _ado_packet().
+
+        Returns False if no packet was available.
+        '''
+        # Stage latency is recorded per packet
+        batch = None if self._latency is not None else pipe.get_batch()
+        if batch is None:
+            return await self._ado_packet(pipe)
+
+        send_batch = []
+        for data in batch:
+            send_data = (await self._aprocess(pipe, data))[0]
+            if send_data is not None:
+                send_batch.append(send_data)
+
+        # Forward
+        if len(send_batch) > 0:
+            await self._asend_batch(pipe, send_batch)
+        return len(batch) > 0
+
+    async def _pump(self, direction, ready):
+        do_packet = self._ado_batch if self.batch else self._ado_packet
+
+        while True:
+            await ready.wait()
+            ready.clear()
+
+            # Drain everything that is queued
+            while await do_packet(self._pipelines[direction]):
+                self.refresh()
+
+    async def _poll(self, directions, ready):
+        '''
+        Forward packets from sources without a selectable.
+
+        The sources are polled on each tick, then drained one packet per
+        direction at a time while they have packets, yielding to the event
+        loop in between.
+        '''
+        do_packet = self._ado_batch if self.batch else self._ado_packet
+
+        while True:
+            await ready.wait()
+            ready.clear()
+
+            busy = True
+            while busy:
+                busy = False
+                for direction in directions:
+                    if self._pipelines[direction].has_packet():
+                        busy = await do_packet(self._pipelines[direction]) or busy
+                        self.refresh()
+                await asyncio.sleep(0)
+
+    async def _ticker(self, polled):
+        while True:
+            if hasattr(self._hook, 'usbq_tick'):
+                self._hook.usbq_tick()
+
+            # Plugins may have been (un)registered
+            self.refresh()
+
+            polled.set()
+
+            await asyncio.sleep(self.tick_interval)
+
+    async def serve(self):
+        'Run the engine until stop() is called.'
+
+        loop = asyncio.get_running_loop()
+        self._stop = loop.create_future()
+        self.refresh()
+
+        sources = {}
+        for srcs in pm.hook.usbq_event_sources():
+            sources.update(srcs)
+
+        tasks = []
+        polled = []
+        for direction in self.DIRECTIONS:
+            src = sources.get(direction, None)
+            if src is None:
+                polled.append(direction)
+                continue
+
+            ready = asyncio.Event()
+            log.debug(f'Registered {direction} event source {src}')
+            loop.add_reader(src, ready.set)
+            # Pick up anything queued before registration
+            ready.set()
+            tasks.append(asyncio.ensure_future(self._pump(direction, ready)))
+
+        # Sources without a selectable are polled on each tick
+        poll = asyncio.Event()
+        if len(polled) > 0:
+            tasks.append(asyncio.ensure_future(self._poll(polled, poll)))
+        tasks.append(asyncio.ensure_future(self._ticker(poll)))
+
+        # Other sources, such as file watchers, run a callback when readable
+        aux = [
+            src
+            for name, src in sources.items()
+            if name not in self.DIRECTIONS and src is not None
+        ]
+        for src, callback in aux:
+            log.debug(f'Registered {src} event source')
+            loop.add_reader(src, callback)
+
+        try:
+            await asyncio.wait(
+                tasks + [self._stop], return_when=asyncio.FIRST_COMPLETED
+            )
+            # Surface errors from pipeline tasks
+            for task in tasks:
+                if task.done():
+                    task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            for direction in self.DIRECTIONS:
+                src = sources.get(direction, None)
+                if src is not None:
+                    loop.remove_reader(src)
+            for src, callback in aux:
+                loop.remove_reader(src)
+
+    def stop(self):
+        'Request that serve() returns.'
+
+        if self._stop is not None and not self._stop.done():
+            self._stop.set_result(None)
+
+    def run(self):
+        if pm.get_plugin('ipython') is not None:
+            log.info('IPython UI drives the synchronous engine loop.')
+            return super().run()
+
+        log.info('Starting asyncio USB processing engine.')
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            log.critical('User requested exit.')
+        except USBQEndOfStream as e:
+            log.info(f'Packet source finished: {e}')
+
+        pm.hook.usbq_teardown()
+
+        # Take one more pass through the loop to send/recv packets
+        self.event()
+        return
+
+
+#: Engine implementations selectable from the command line
+ENGINES = {'sync': USBQEngine, 'asyncio': AsyncUSBQEngine}
@@ -1,4 +1,11 @@
-__all__ = ['USBQException', 'USBQInvocationError', 'USBQDeviceNotConnected']
+__all__ = [
+    'USBQException',
+    'USBQInvocationError',
+    'USBQDeviceNotConnected',
+    'USBQCaptureError',
+    'USBQEndOfStream',
+    'USBQFilterError',
+]
 
 
 class USBQException(Exception):
@@ -11,3 +18,15 @@ class USBQInvocationError(USBQException):
 
 class USBQDeviceNotConnected(USBQException):
     'USBQ device not connected.'
+
+
+class USBQCaptureError(USBQException):
+    'Invalid or unsupported capture file.'
+
+
+class USBQEndOfStream(USBQException):
+    'Packet source has no more packets.'
+
+
+class USBQFilterError(USBQException):
+    'Invalid packet filter expression.'
@@ -0,0 +1,271 @@
+'''
+Packet filter expressions.
+
+A filter is a Python-like boolean expression over fields of the raw
+usbq_core message, for example::
+
+    ep == 0x81 and len > 8 and dir == in and data[0:2] == b"\\x55\\xaa"
+
+Names:
+
+- ``type``: message type, ``usb``, ``ack`` or ``management``
+- ``src``: message source, ``host`` or ``device``
+- ``ep``: endpoint address, with bit 7 set for IN endpoints
+- ``epnum``: endpoint number
+- ``eptype``: transfer type, ``ctrl``, ``isoc``, ``bulk`` or ``int``
+- ``dir``: endpoint direction, ``in`` or ``out``
+- ``len``: length of ``data``
+- ``data``: message content following the endpoint header, or following
+  the management type of management messages
+
+Endpoint fields are None for management messages and compare unequal to
+any value. Comparisons, ``and``, ``or``, ``not``, ``in``, arithmetic and
+bitwise operators, subscripts and slices of ``data`` and int, bytes and
+string literals are supported.
+
+The expression is compiled once to a Python function that unpacks only
+the header fields it uses with struct, without scapy dissection.
+'''
+
+import ast
+import io
+import struct
+import tokenize
+
+from .exceptions import USBQFilterError
+from .usbmitm_proto import CONTENT_OFFSET
+from .usbmitm_proto import EP_HEADER
+from .usbmitm_proto import EP_PAYLOAD_OFFSET
+from .usbmitm_proto import LazyUSBMessage
+from .usbmitm_proto import MANAGEMENT_HEADER
+from .usbmitm_proto import MESSAGE_HEADER
+from .usbmitm_proto import USBMessageDevice
+from .usbmitm_proto import USBMessageHost
+
+__all__ = ['PacketFilter', 'compile_filter', 'NAMES', 'CONSTANTS']
+
+#: Names bound to fields of the message
+NAMES = ['type', 'src', 'ep', 'epnum', 'eptype', 'dir', 'len', 'data']
+
+#: Names of values
+CONSTANTS = {
+    'usb': 0,
+    'ack': 1,
+    'management': 2,
+    'host': USBMessageHost,
+    'device': USBMessageDevice,
+    'ctrl': 0,
+    'isoc': 1,
+    'bulk': 2,
+    'int': 3,
+    'in': USBMessageHost.URBEPDirection.URB_IN,
+    'out': USBMessageHost.URBEPDirection.URB_OUT,
+}
+
+# 'in' is a keyword: its uses as a value are renamed before parsing
+_IN = '_in_'
+
+EP_FIELDS = {'ep', 'epnum', 'eptype', 'dir'}
+DATA_FIELDS = {'len', 'data'}
+
+#: Offset of the data of management messages
+MANAGEMENT_PAYLOAD_OFFSET = CONTENT_OFFSET + MANAGEMENT_HEADER.size
+
+_NODES = (
+    ast.Expression,
+    ast.BoolOp,
+    ast.And,
+    ast.Or,
+    ast.UnaryOp,
+    ast.Not,
+    ast.USub,
+    ast.Invert,
+    ast.BinOp,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.FloorDiv,
+    ast.Mod,
+    ast.BitAnd,
+    ast.BitOr,
+    ast.BitXor,
+    ast.LShift,
+    ast.RShift,
+    ast.Compare,
+    ast.Eq,
+    ast.NotEq,
+    ast.Lt,
+    ast.LtE,
+    ast.Gt,
+    ast.GtE,
+    ast.In,
+    ast.NotIn,
+    ast.Name,
+    ast.Load,
+    ast.Constant,
+    ast.Subscript,
+    ast.Slice,
+    ast.Tuple,
+    ast.List,
+)
+
+
+def _rename_in(expr):
+    'Rename the keyword in where it is used as a value.'
+
+    res = []
+    # Whether the next token starts an operand. A unary not keeps the state
+    # and the not of a not in operator follows an operand, so it keeps it too.
+    operand = True
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(expr).readline):
+            if tok.type in [tokenize.NEWLINE, tokenize.NL, tokenize.ENDMARKER]:
+                pass
+            elif tok.type == tokenize.NAME and tok.string == 'in':
+                if operand:
+                    tok = tok._replace(string=_IN)
+                operand = not operand
+            elif tok.type == tokenize.NAME and tok.string in ['and', 'or', 'is']:
+                operand = True
+            elif tok.type == tokenize.NAME and tok.string == 'not':
+                pass
+            elif tok.type == tokenize.OP:
+                operand = tok.string not in ')]}'
+            else:
+                operand = False
+            res.append((tok.type, tok.string))
+    except (tokenize.TokenError, SyntaxError) as e:
+        raise USBQFilterError(f'Invalid filter {expr!r}: {e}')
+    return tokenize.untokenize(res)
+
+
+def _parse(expr):
+    try:
+        tree = ast.parse(_rename_in(expr).strip(), mode='eval')
+    except SyntaxError as e:
+        raise USBQFilterError(f'Invalid filter {expr!r}: {e.msg}')
+
+    used = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _NODES):
+            raise USBQFilterError(
+                f'Invalid filter {expr!r}: {type(node).__name__} is not supported'
+            )
+        if isinstance(node, ast.Constant) and not isinstance(
+            node.value, (int, bytes, str)
+        ):
+            raise USBQFilterError(f'Invalid filter {expr!r}: {node.value!r}')
+        if isinstance(node, ast.Name):
+            name = 'in' if node.id == _IN else node.id
+            if name not in NAMES and name not in CONSTANTS:
+                raise USBQFilterError(
+                    f'Invalid filter {expr!r}: unknown name {name}. '
+                    f'Use one of {", ".join(NAMES + list(CONSTANTS))}.'
+                )
+            used.add(node.id)
+    return tree, used
+
+
+def _prelude(used):
+    'Statements binding the names used from cls and wire.'
+
+    lines = ['_length, type = _MESSAGE_HEADER.unpack_from(wire)']
+    if used & (EP_FIELDS | DATA_FIELDS):
+        lines += [
+            f'if type != 2 and _size(wire) >= {EP_PAYLOAD_OFFSET}:',
+            f'    epnum, eptype, dir = _EP_HEADER.unpack_from(wire, {CONTENT_OFFSET})',
+            f'    _offset = {EP_PAYLOAD_OFFSET}',
+            'else:',
+            '    epnum = eptype = dir = None',
+            f'    _offset = {MANAGEMENT_PAYLOAD_OFFSET}',
+        ]
+    if 'ep' in used:
+        lines.append(
+            f'ep = None if epnum is None else '
+            f'epnum | (0x80 if dir == {USBMessageHost.URBEPDirection.URB_IN} else 0)'
+        )
+    if 'len' in used:
+        lines.append('len = max(0, _size(wire) - _offset)')
+    if 'data' in used:
+        lines.append('data = bytes(wire[_offset:])')
+    if 'src' in used:
+        lines.append('src = cls')
+    return lines
+
+
+def _compile(expr):
+    tree, used = _parse(expr)
+
+    source = '\n'.join(
+        ['def _match(cls, wire):']
+        + ['    ' + line for line in _prelude(used)]
+        + ['    return None']
+    )
+    module = ast.parse(source)
+    func = module.body[0]
+    func.body[-1].value = tree.body
+    ast.fix_missing_locations(module)
+
+    namespace = dict(CONSTANTS)
+    namespace.update(
+        {
+            _IN: CONSTANTS['in'],
+            '_size': len,
+            '_MESSAGE_HEADER': MESSAGE_HEADER,
+            '_EP_HEADER': EP_HEADER,
+        }
+    )
+    exec(compile(module, f'<filter {expr!r}>', 'exec'), namespace)
+    return namespace['_match']
+
+
+class PacketFilter:
+    '''
+    Compiled packet filter expression.
+
+    Raises USBQFilterError if the expression is invalid.
+    '''
+
+    def __init__(self, expr):
+        self.expr = expr
+        self._match = _compile(expr)
+
+    def match_wire(self, cls, wire):
+        '''
+        Return True if a raw message matches.
+
+        :param cls: USBMessageHost or USBMessageDevice
+        :param wire: Raw bytes of the usbq_core message
+        '''
+        try:
+            return bool(self._match(cls, wire))
+        except (TypeError, IndexError, ValueError, ZeroDivisionError, struct.error):
+            # Such as an order comparison with a missing endpoint field, or a
+            # message too short for its header
+            return False
+
+    def match(self, pkt):
+        'Return True if a decoded message matches.'
+
+        if isinstance(pkt, LazyUSBMessage):
+            cls = pkt.cls
+            wire = bytes(pkt) if pkt.is_dirty() else pkt.wire
+        else:
+            cls = type(pkt)
+            wire = bytes(pkt)
+        return self.match_wire(cls, wire)
+
+    __call__ = match
+
+    def __repr__(self):
+        return f'<PacketFilter {self.expr!r}>'
+
+
+def compile_filter(expr):
+    'Return a PacketFilter for expr, None for None or an empty expression.'
+
+    if expr is None or isinstance(expr, PacketFilter):
+        return expr
+    if expr.strip() == '':
+        return None
+    return PacketFilter(expr)
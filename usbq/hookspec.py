@@ -1,7 +1,9 @@
 import attr
 import pluggy
 
-__all__ = ['hookimpl', 'USBQPluginDef']
+from .defs import USBDefs
+
+__all__ = ['hookimpl', 'USBQPluginDef', 'Subscription', 'subscribe']
 
 USBQ_EP = 'usbq'
 
@@ -28,6 +30,103 @@ class USBQPluginDef:
     optional = attr.ib(converter=bool, default=False)
 
 
+#: Function attribute holding the Subscription of a hook implementation
+SUBSCRIPTION = 'usbq_subscription'
+
+#: Hooks with a pkt argument that implementations can subscribe to
+SUBSCRIBABLE_HOOKS = ['usbq_log_pkt', 'usbq_device_modify', 'usbq_host_modify']
+
+#: usbq_core message types
+MESSAGE_TYPES = {'usb': 0, 'ack': 1, 'management': 2}
+
+#: Wire epdir values, USBMitm.URBEPDirection without importing scapy
+EP_DIRECTIONS = {'in': 0, 'out': 1}
+
+
+def _value_set(names):
+    'Converter to a frozenset of values that also accepts names from names.'
+
+    def convert(values):
+        if values is None:
+            return None
+        if isinstance(values, (int, str)):
+            values = [values]
+        return frozenset(
+            names[v.lower()] if isinstance(v, str) else int(v) for v in values
+        )
+
+    return convert
+
+
+@attr.s(frozen=True)
+class Subscription:
+    '''
+    Packets a usbq_log_pkt, usbq_device_modify or usbq_host_modify
+    implementation is called for.
+
+    Each attribute is a set of accepted values, None accepts any value.
+    Endpoint fields do not match management messages, which have no
+    endpoint.
+    '''
+
+    #: Endpoint numbers
+    epnum = attr.ib(default=None, converter=_value_set({}))
+
+    #: Endpoint directions: in, out
+    epdir = attr.ib(default=None, converter=_value_set(EP_DIRECTIONS))
+
+    #: Transfer types: ctrl, isoc, bulk, int
+    eptype = attr.ib(
+        default=None,
+        converter=_value_set(
+            {
+                'ctrl': USBDefs.EP.TransferType.CTRL,
+                'isoc': USBDefs.EP.TransferType.ISOC,
+                'bulk': USBDefs.EP.TransferType.BULK,
+                'int': USBDefs.EP.TransferType.INT,
+            }
+        ),
+    )
+
+    #: Message types: usb, ack, management
+    msgtype = attr.ib(default=None, converter=_value_set(MESSAGE_TYPES))
+
+    def match(self, msgtype, epnum, epdir, eptype):
+        if self.msgtype is not None and msgtype not in self.msgtype:
+            return False
+        for accepted, value in [
+            (self.epnum, epnum),
+            (self.epdir, epdir),
+            (self.eptype, eptype),
+        ]:
+            if accepted is not None and value not in accepted:
+                return False
+        return True
+
+
+def subscribe(epnum=None, epdir=None, eptype=None, msgtype=None):
+    '''
+    Only call a packet hook implementation for some packets.
+
+    Apply below ``@hookimpl``::
+
+        @hookimpl
+        @subscribe(epnum=1, epdir='in', eptype='int')
+        def usbq_device_modify(self, pkt):
+            ...
+
+    Engines skip the implementation for other packets, so it does not have
+    to filter on ``pkt.content.ep`` itself.
+    '''
+    sub = Subscription(epnum=epnum, epdir=epdir, eptype=eptype, msgtype=msgtype)
+
+    def decorate(func):
+        setattr(func, SUBSCRIPTION, sub)
+        return func
+
+    return decorate
+
+
 class USBQHookSpec:
     @hookspec
     def usbq_declare_plugins(self):
@@ -49,6 +148,25 @@ class USBQHookSpec:
         Wait no longer than 1 second before returning.
         '''
 
+    @hookspec
+    def usbq_event_sources(self):
+        '''
+        Declare selectable packet and event sources.
+
+        Implementation must return a dict mapping ``'device'`` and/or
+        ``'host'`` to a selectable object (socket or file descriptor) that
+        becomes readable when ``usbq_get_device_packet`` or
+        ``usbq_get_host_packet`` respectively has data. When called from an
+        event-driven engine the get hooks must return None once no more data
+        is queued.
+
+        Any other key, such as ``'reload'``, maps to a
+        ``(selectable, callback)`` tuple for events other than packets. The
+        asyncio engine, or the usbq_wait_for_packet implementation the
+        synchronous engine waits in, calls ``callback()`` without arguments
+        when the selectable becomes readable. The callback must not block.
+        '''
+
     @hookspec
     def usbq_log_pkt(self, pkt):
         '''
@@ -56,6 +174,7 @@ class USBQHookSpec:
 
         :param pkt: Decoded protocol packet.
 
+        Implementations can be limited to some packets with subscribe().
         '''
 
     #
@@ -81,12 +200,27 @@ class USBQHookSpec:
         Implementation must return the packet as bytes.
         '''
 
+    @hookspec(firstresult=True)
+    def usbq_get_device_batch(self):
+        '''
+        Get all raw data queued from the USB device.
+
+        Optional batched variant of usbq_get_device_packet used by engines
+        running in batch mode.
+
+        Implementation must return a list of bytes-like objects, which may be
+        empty if no data is queued. They are decoded without a copy, so a
+        buffer reused by later calls must not be overwritten while views of
+        it are alive.
+        '''
+
     @hookspec(firstresult=True)
     def usbq_device_decode(self, data):
         '''
         Decode a raw USB packet from the device.
 
-        :param data: Raw bytes from USBQ driver.
+        :param data: Raw bytes from USBQ driver, or a memoryview of them in
+            batch mode.
 
         Return decoded raw data.
         '''
@@ -98,7 +232,8 @@ class USBQHookSpec:
 
         :param pkt: Decoded USBQ packet. pkt.content is the USB payload.
 
-        Modify pkt in place. Returned value is ignored.
+        Modify pkt in place. Returned value is ignored. Implementations can
+        be limited to some packets with subscribe().
         '''
 
     @hookspec(firstresult=True)
@@ -134,12 +269,27 @@ class USBQHookSpec:
         Implementation must return the packet as bytes.
         '''
 
+    @hookspec(firstresult=True)
+    def usbq_get_host_batch(self):
+        '''
+        Get all raw data queued from the USB host.
+
+        Optional batched variant of usbq_get_host_packet used by engines
+        running in batch mode.
+
+        Implementation must return a list of bytes-like objects, which may be
+        empty if no data is queued. They are decoded without a copy, so a
+        buffer reused by later calls must not be overwritten while views of
+        it are alive.
+        '''
+
     @hookspec(firstresult=True)
     def usbq_host_decode(self, data):
         '''
         Decode a raw USB packet from the host.
 
-        :param data: Raw bytes from USBQ driver.
+        :param data: Raw bytes from USBQ driver, or a memoryview of them in
+            batch mode.
 
         Return decoded raw data.
         '''
@@ -161,7 +311,8 @@ class USBQHookSpec:
 
         :param pkt: Decoded USBQ packet. pkt.content is the USB payload.
 
-        Modify pkt in place. Returned value is ignored.
+        Modify pkt in place. Returned value is ignored. Implementations can
+        be limited to some packets with subscribe().
         '''
 
     #
@@ -192,6 +343,26 @@ class USBQHookSpec:
         Return a non-None value if the data was sent.
         '''
 
+    @hookspec(firstresult=True)
+    def usbq_send_device_batch(self, batch):
+        '''
+        Sends a list of raw data packets to USB device.
+
+        Optional batched variant of usbq_send_device_packet.
+
+        Return a non-None value if the data was sent.
+        '''
+
+    @hookspec(firstresult=True)
+    def usbq_send_host_batch(self, batch):
+        '''
+        Sends a list of raw data packets to USB host.
+
+        Optional batched variant of usbq_send_host_packet.
+
+        Return a non-None value if the data was sent.
+        '''
+
     #
     # Device Emulation
     #
@@ -0,0 +1,99 @@
+'''
+Minimal Linux inotify binding.
+'''
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+
+__all__ = ['Inotify']
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+#: Events of a file of the watched directory being saved, including by
+#: editors that rename a new file over the old one. Writes to files kept
+#: open, such as a pcap being captured, only signal IN_MODIFY and do not
+#: wake the watcher.
+FILE_CHANGES = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+#: wd, mask, cookie, len
+EVENT = struct.Struct('iIII')
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            libc.inotify_init1
+            libc.inotify_add_watch
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        _libc = libc
+    return _libc
+
+
+class Inotify:
+    '''
+    Watch the files of a directory.
+
+    The object is selectable: it becomes readable when a file changes.
+
+    :param names: Only report changes of these file names, None for any
+    :raises OSError: inotify is not available
+    '''
+
+    def __init__(self, directory, mask=FILE_CHANGES, names=None):
+        self._names = None if names is None else frozenset(names)
+        libc = _load_libc()
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        wd = libc.inotify_add_watch(self._fd, os.fsencode(directory), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(err, os.strerror(err), directory)
+
+    def fileno(self):
+        return self._fd
+
+    def read(self):
+        'Names of the files changed since the last read. Does not block.'
+
+        res = set()
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return res
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b'\0'))
+                offset += length
+                if self._names is None or name in self._names:
+                    res.add(name)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
@@ -0,0 +1,267 @@
+'''
+Per-stage latency of the engine pipeline.
+
+Stage durations are recorded in nanoseconds into fixed-size log-linear
+histograms in the style of HdrHistogram: values below 64 ns are counted
+exactly and every power of two above is split into 32 buckets, which keeps
+the relative error of reported percentiles under about 3%.
+'''
+
+import time
+from array import array
+from collections import OrderedDict
+
+import attr
+
+from .defs import USBDefs
+from .usbmitm_proto import CONTENT_OFFSET
+from .usbmitm_proto import EP_HEADER
+from .usbmitm_proto import EP_PAYLOAD_OFFSET
+from .usbmitm_proto import MESSAGE_HEADER
+from .usbmitm_proto import USBMitm
+
+__all__ = ['Histogram', 'StageHistograms', 'PipelineLatency', 'STAGES']
+
+#: Values below 2**SUB_BUCKET_BITS ns are counted exactly
+SUB_BUCKET_BITS = 6
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_BUCKETS = SUB_BUCKETS >> 1
+
+#: Values of 2**MAX_BITS ns (about 18 minutes) and above share the last bucket
+MAX_BITS = 40
+MAX_VALUE = (1 << MAX_BITS) - 1
+
+BUCKETS = SUB_BUCKETS + (MAX_BITS - SUB_BUCKET_BITS) * HALF_BUCKETS
+
+#: Pipeline stages in order. total spans get to send.
+STAGES = ['get', 'decode', 'log', 'modify', 'encode', 'send', 'total']
+
+#: Percentiles reported by summary()
+PERCENTILES = [('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999)]
+
+EPTYPES = {
+    USBDefs.EP.TransferType.CTRL: 'ctrl',
+    USBDefs.EP.TransferType.ISOC: 'isoc',
+    USBDefs.EP.TransferType.BULK: 'bulk',
+    USBDefs.EP.TransferType.INT: 'int',
+}
+
+
+def _index(value):
+    bits = value.bit_length()
+    if bits <= SUB_BUCKET_BITS:
+        return value
+    if bits > MAX_BITS:
+        value, bits = MAX_VALUE, MAX_BITS
+    shift = bits - SUB_BUCKET_BITS
+    return SUB_BUCKETS + (shift - 1) * HALF_BUCKETS + (value >> shift) - HALF_BUCKETS
+
+
+def _highest(index):
+    'Highest value counted in bucket index.'
+
+    if index < SUB_BUCKETS:
+        return index
+    shift, sub = divmod(index - SUB_BUCKETS, HALF_BUCKETS)
+    shift += 1
+    return ((sub + HALF_BUCKETS + 1) << shift) - 1
+
+
+class Histogram:
+    'Fixed-size log-linear histogram of nanosecond durations.'
+
+    __slots__ = ('counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * BUCKETS))
+        self.reset()
+
+    def reset(self):
+        for i in range(BUCKETS):
+            self.counts[i] = 0
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        self.counts[_index(value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def record_since(self, start):
+        'Record the time elapsed since start and return the current perf_counter_ns().'
+
+        now = time.perf_counter_ns()
+        self.record(now - start)
+        return now
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.sum / self.count
+
+    def percentile(self, q):
+        'Upper bound in ns of the q (0..1) quantile.'
+
+        if self.count == 0:
+            return 0
+        target = max(1, round(q * self.count))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                if i == BUCKETS - 1:
+                    # Out of range values are only known by the maximum
+                    return self.max
+                return min(_highest(i), self.max)
+        return self.max
+
+    def summary(self):
+        'Count and durations in microseconds.'
+
+        res = OrderedDict(
+            [
+                ('count', self.count),
+                ('mean_us', self.mean / 1e3),
+                ('min_us', (self.min or 0) / 1e3),
+            ]
+        )
+        for name, q in PERCENTILES:
+            res[f'{name}_us'] = self.percentile(q) / 1e3
+        res['max_us'] = self.max / 1e3
+        return res
+
+    def __repr__(self):
+        return (
+            f'<Histogram count={self.count} p50={self.percentile(0.5)}ns '
+            f'p99={self.percentile(0.99)}ns max={self.max}ns>'
+        )
+
+
+@attr.s(cmp=False)
+class StageHistograms:
+    'One histogram per pipeline stage.'
+
+    get = attr.ib(factory=Histogram)
+    decode = attr.ib(factory=Histogram)
+    log = attr.ib(factory=Histogram)
+    modify = attr.ib(factory=Histogram)
+    encode = attr.ib(factory=Histogram)
+    send = attr.ib(factory=Histogram)
+    total = attr.ib(factory=Histogram)
+
+    def __iter__(self):
+        for stage in STAGES:
+            yield stage, getattr(self, stage)
+
+
+class PipelineLatency:
+    '''
+    Stage latency histograms per direction and endpoint type.
+
+    Directions are ``device`` (device to host) and ``host``. Endpoint types
+    are ``ctrl``, ``isoc``, ``bulk``, ``int`` and ``management`` for
+    messages without an endpoint.
+    '''
+
+    def __init__(self):
+        self._stages = {'device': OrderedDict(), 'host': OrderedDict()}
+
+    def select(self, direction, data):
+        'StageHistograms of a raw usbq_core message.'
+
+        eptype = 'management'
+        if len(data) >= EP_PAYLOAD_OFFSET:
+            if MESSAGE_HEADER.unpack_from(data)[1] != USBMitm.MitmType.MANAGEMENT:
+                eptype = EPTYPES.get(
+                    EP_HEADER.unpack_from(data, CONTENT_OFFSET)[1], 'management'
+                )
+        return self.stages(direction, eptype)
+
+    def stages(self, direction, eptype):
+        by_type = self._stages[direction]
+        res = by_type.get(eptype, None)
+        if res is None:
+            res = by_type[eptype] = StageHistograms()
+        return res
+
+    def histogram(self, direction, eptype, stage):
+        return getattr(self.stages(direction, eptype), stage)
+
+    def merged(self, stage, direction=None):
+        'Histogram of a stage over all endpoint types and, by default, directions.'
+
+        res = Histogram()
+        for d, by_type in self._stages.items():
+            if direction is not None and d != direction:
+                continue
+            for stages in by_type.values():
+                res.merge(getattr(stages, stage))
+        return res
+
+    @property
+    def count(self):
+        'Packets that went through the whole pipeline.'
+
+        return sum(
+            stages.total.count
+            for by_type in self._stages.values()
+            for stages in by_type.values()
+        )
+
+    def reset(self):
+        for by_type in self._stages.values():
+            for stages in by_type.values():
+                for stage, hist in stages:
+                    hist.reset()
+
+    def summary(self):
+        'Nested dict of direction, endpoint type and stage summaries.'
+
+        return {
+            direction: {
+                eptype: {
+                    stage: hist.summary() for stage, hist in stages if hist.count > 0
+                }
+                for eptype, stages in by_type.items()
+            }
+            for direction, by_type in self._stages.items()
+        }
+
+    def __str__(self):
+        lines = []
+        for direction, by_type in self._stages.items():
+            for eptype, stages in by_type.items():
+                if stages.total.count == 0:
+                    continue
+                stage_p99 = ' '.join(
+                    f'{stage}={hist.percentile(0.99) / 1e3:.1f}'
+                    for stage, hist in stages
+                    if hist.count > 0 and stage != 'total'
+                )
+                total = stages.total
+                lines.append(
+                    f'{direction:>6} {eptype:<10} {total.count:>8} packets '
+                    f'p50={total.percentile(0.5) / 1e3:.1f}us '
+                    f'p99={total.percentile(0.99) / 1e3:.1f}us '
+                    f'max={total.max / 1e3:.1f}us [p99 us: {stage_p99}]'
+                )
+        return '\n'.join(lines)
@@ -1,3 +1,4 @@
 from .endpoint import Endpoint  # NOQA
 from .identity import DeviceIdentity  # NOQA
 from .interface import Interface  # NOQA
+from .tree import DescriptorTree  # NOQA
@@ -2,7 +2,7 @@ import logging
 from collections import defaultdict
 
 import attr
-from scapy.all import raw
+from scapy.compat import raw
 
 from ..defs import USBDefs
 from ..dissect.usb import ConfigurationDescriptor
@@ -12,6 +12,7 @@ from ..dissect.usb import EndpointDescriptor
 from ..dissect.usb import InterfaceDescriptor
 from ..dissect.usb import StringDescriptor
 from ..usbmitm_proto import ManagementNewDevice
+from .tree import DescriptorTree
 
 __all__ = ['DeviceIdentity']
 
@@ -20,18 +21,52 @@ log = logging.getLogger(__name__)
 
 @attr.s
 class DescriptorList:
-    tab = attr.ib(converter=lambda v: v or [], default=[])
+    '''
+    View of the descriptors of a list selected by SELECT.
+
+    Positions of the selected descriptors in tab are indexed and the index
+    is rebuilt when tab changes length. Assignments replace the descriptor
+    in tab and call changed.
+    '''
+
+    tab = attr.ib(converter=lambda v: v if v is not None else [], default=None)
+
+    #: Called after an assignment, with no arguments
+    changed = attr.ib(default=None, repr=False, cmp=False)
+
+    _index = attr.ib(init=False, repr=False, cmp=False, default=None)
+    _length = attr.ib(init=False, repr=False, cmp=False, default=None)
+
+    def _positions(self):
+        if self._index is None or self._length != len(self.tab):
+            self._index = [i for i, d in enumerate(self.tab) if self.SELECT(d)]
+            self._length = len(self.tab)
+        return self._index
+
+    def _position(self, i):
+        pos = self._positions()[i]
+        if not self.SELECT(self.tab[pos]):
+            # Replaced in tab without changing its length
+            self._index = None
+            pos = self._positions()[i]
+        return pos
 
     def __getitem__(self, i):
-        t = list(filter(self.SELECT, self.tab))
-        return t[i]
+        return self.tab[self._position(i)]
 
     def __setitem__(self, i, v):
-        t = list(filter(self.SELECT, self.tab))
-        t[i] = v
+        if not self.SELECT(v):
+            raise ValueError(f'{type(self).__name__} cannot hold {v!r}')
+        self.tab[self._position(i)] = v
+        if self.changed is not None:
+            self.changed()
 
     def __len__(self):
-        return len(list(filter(self.SELECT, self.tab)))
+        return len(self._positions())
+
+    def __iter__(self):
+        tab = self.tab
+        return iter([tab[pos] for pos in self._positions()])
 
     def select(self):
         return
@@ -90,11 +125,25 @@ def to_descriptor_dict(v):
 
 @attr.s
 class DeviceIdentity:
-    ''' Set of usb descriptors that characterize a device '''
+    '''
+    Set of usb descriptors that characterize a device
+
+    Serialized descriptors are cached by (type, index, language) for
+    from_request. An entry is rebuilt when its descriptor is replaced or a
+    field of it is assigned. Call invalidate() after changing a descriptor
+    list in place, such as appending to configuration.descriptors.
+    '''
 
     descriptors = attr.ib(converter=to_descriptor_dict, default=DEFAULT_DESCRIPTORS)
     speed = attr.ib(default=USBDefs.Speed.HIGH_SPEED)
 
+    #: (type, index, language) -> (descriptor, mutations, bytes)
+    _cache = attr.ib(init=False, repr=False, cmp=False, factory=dict)
+
+    #: DescriptorList class -> view
+    _views = attr.ib(init=False, repr=False, cmp=False, factory=dict)
+    _tree = attr.ib(init=False, repr=False, cmp=False, default=None)
+
     @classmethod
     def from_interface(cls, interface, *args, **kargs):
         ''' Create an identity from an interface '''
@@ -113,27 +162,45 @@ class DeviceIdentity:
         if i in self.descriptors:
             return self.descriptors[i]
 
-    def from_request(self, request):
-        ''' Return the corresponding Descriptor asked in the request '''
+    def invalidate(self):
+        'Discard the serialized descriptors.'
+        self._cache.clear()
+
+    def _select(self, request):
+        if request.bDescriptorType == USBDefs.DescriptorType.STRING_DESCRIPTOR:
+            string_desc = self[USBDefs.DescriptorType.STRING_DESCRIPTOR]
+            if request.descriptor_index > len(string_desc):
+                return string_desc[0]
+            return string_desc[request.descriptor_index]
+        return self[request.bDescriptorType][0]
+
+    def descriptor_bytes(self, request):
+        ''' Return the serialized descriptor asked in the request, untrimmed '''
+        desc = self._select(request)
+        key = (request.bDescriptorType, request.descriptor_index, request.language_id)
+        cached = self._cache.get(key, None)
+        if cached is not None and cached[0] is desc and cached[1] == desc.mutations:
+            return cached[2]
+
+        # Link the sub-descriptors so that field assignments count as
+        # mutations of desc
+        data = raw(desc.track())
+        self._cache[key] = (desc, desc.mutations, data)
+        return data
+
+    def from_request(self, request, as_bytes=False):
+        '''
+        Return the corresponding Descriptor asked in the request
+
+        :param as_bytes: Return the descriptor bytes trimmed to the requested length
+        '''
         try:
+            if as_bytes:
+                return self.descriptor_bytes(request)[: request.wLength]
             if request.bDescriptorType == USBDefs.DescriptorType.STRING_DESCRIPTOR:
-                string_desc = self[USBDefs.DescriptorType.STRING_DESCRIPTOR]
-                if request.descriptor_index > len(string_desc):
-                    res = string_desc[0]
-                else:
-                    res = string_desc[request.descriptor_index]
-            else:
-                # Conversion to raw is used to trim descriptor if required by host
-                if (
-                    request.bDescriptorType
-                    == USBDefs.DescriptorType.CONFIGURATION_DESCRIPTOR
-                ):
-                    req_len = request.wLength
-                    res = Descriptor(raw(self[request.bDescriptorType][0])[:req_len])
-                else:
-                    req_len = request.wLength
-                    res = Descriptor(raw(self[request.bDescriptorType][0])[:req_len])
-            return res
+                return self._select(request)
+            # Dissect the trimmed bytes when the host asks for less
+            return Descriptor(self.descriptor_bytes(request)[: request.wLength])
         except Exception:
             return
 
@@ -145,6 +212,7 @@ class DeviceIdentity:
     @device.setter
     def device(self, desc):
         self.descriptors[USBDefs.DescriptorType.DEVICE_DESCRIPTOR] = [desc]
+        self.invalidate()
 
     # Configuration descriptor access
     @property
@@ -154,24 +222,60 @@ class DeviceIdentity:
     @configuration.setter
     def configuration(self, desc):
         self.descriptors[USBDefs.DescriptorType.CONFIGURATION_DESCRIPTOR] = [desc]
+        self.invalidate()
+
+    def _view(self, cls, tab, changed):
+        view = self._views.get(cls, None)
+        if view is None or view.tab is not tab:
+            view = self._views[cls] = cls(tab, changed)
+        return view
+
+    def _configuration_changed(self):
+        # Assigning the list discards the raw bytes of the configuration and
+        # counts as a mutation
+        conf = self.configuration
+        conf.descriptors = conf.descriptors
 
     @property
     def interfaces(self):
-        return InterfaceList(self.configuration.descriptors)
+        return self._view(
+            InterfaceList, self.configuration.descriptors, self._configuration_changed
+        )
 
     @property
     def endpoints(self):
-        return EndpointList(self.configuration.descriptors)
+        return self._view(
+            EndpointList, self.configuration.descriptors, self._configuration_changed
+        )
 
     @property
     def strings(self):
-        return StringList(self[USBDefs.DescriptorType.STRING_DESCRIPTOR])
+        return self._view(
+            StringList, self[USBDefs.DescriptorType.STRING_DESCRIPTOR], self.invalidate
+        )
+
+    @property
+    def tree(self):
+        ''' DescriptorTree of the configuration '''
+        conf = self.configuration
+        if self._tree is None or not self._tree.current(conf):
+            self._tree = DescriptorTree(conf)
+        return self._tree
+
+    def interface(self, number, alternate=0):
+        ''' Return the AlternateSetting of an interface number '''
+        return self.tree.interface(number, alternate)
+
+    def endpoint(self, address):
+        ''' Return the EndpointDescriptor of an endpoint address '''
+        return self.tree.endpoint(address)
 
     def set_strings(self, strings):
         for s in strings:
             self.descriptors[USBDefs.DescriptorType.STRING_DESCRIPTOR].append(
                 StringDescriptor(bString=s)
             )
+        self.invalidate()
 
     def to_new_identity(self):
         return ManagementNewDevice(
@@ -0,0 +1,100 @@
+import logging
+from collections import OrderedDict
+
+import attr
+
+from ..dissect.usb import EndpointDescriptor
+from ..dissect.usb import InterfaceDescriptor
+
+__all__ = ['DescriptorTree', 'AlternateSetting', 'endpoint_address']
+
+log = logging.getLogger(__name__)
+
+
+def endpoint_address(desc):
+    'Return the bEndpointAddress byte of an endpoint descriptor.'
+    addr = desc.bEndpointAddress
+    # Packet.direction is a scapy attribute that hides the field
+    return (addr.getfieldval('direction') << 7) | addr.endpoint_number
+
+
+@attr.s(cmp=False)
+class AlternateSetting:
+    'Interface descriptor of an alternate setting and the descriptors that follow it.'
+
+    descriptor = attr.ib()
+    endpoints = attr.ib(factory=list)
+
+    #: Class-specific descriptors, such as HID descriptors
+    extra = attr.ib(factory=list)
+
+    @property
+    def number(self):
+        return self.descriptor.bInterfaceNumber
+
+    @property
+    def alternate(self):
+        return self.descriptor.bAlternateSetting
+
+
+class DescriptorTree:
+    '''
+    Index of the descriptors of a configuration descriptor.
+
+    Interfaces are indexed by interface number then alternate setting, and
+    endpoints by address. An endpoint declared by several alternate settings
+    is indexed by the first one.
+
+    The tree is built from the configuration in one pass. current() tells if
+    the configuration was modified since.
+    '''
+
+    def __init__(self, configuration):
+        #: Link the sub-descriptors so that their changes are counted
+        self.configuration = configuration.track()
+        self.mutations = configuration.mutations
+        descriptors = configuration.descriptors or []
+        self.length = len(descriptors)
+
+        #: Interface number -> alternate setting -> AlternateSetting
+        self.interfaces = OrderedDict()
+
+        #: Endpoint address -> (AlternateSetting, EndpointDescriptor)
+        self.endpoints = OrderedDict()
+
+        node = None
+        for desc in descriptors:
+            if isinstance(desc, InterfaceDescriptor):
+                node = AlternateSetting(desc)
+                alts = self.interfaces.setdefault(node.number, OrderedDict())
+                alts.setdefault(node.alternate, node)
+            elif isinstance(desc, EndpointDescriptor):
+                if node is None:
+                    log.debug(f'Endpoint descriptor outside of an interface: {desc}')
+                    continue
+                node.endpoints.append(desc)
+                self.endpoints.setdefault(endpoint_address(desc), (node, desc))
+            elif node is not None:
+                node.extra.append(desc)
+
+    def current(self, configuration):
+        'Return True if the tree indexes the configuration as it is.'
+        return (
+            configuration is self.configuration
+            and configuration.mutations == self.mutations
+            and len(configuration.descriptors or []) == self.length
+        )
+
+    def interface(self, number, alternate=0):
+        'Return the AlternateSetting of an interface, None if it does not exist.'
+        alts = self.interfaces.get(number, None)
+        if alts is None:
+            return None
+        return alts.get(alternate, None)
+
+    def endpoint(self, address):
+        'Return the EndpointDescriptor with an address, None if it does not exist.'
+        res = self.endpoints.get(address, None)
+        if res is None:
+            return None
+        return res[1]
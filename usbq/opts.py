@@ -11,12 +11,35 @@ __all__ = [
     'identity_options',
     'add_options',
     'standard_plugin_options',
+    'pipeline_plugin_options',
     'load_ident',
     'usb_device_options',
+    'engine_options',
+    'replay_options',
+    'filter_options',
+    'BENCH_SCENARIOS',
 ]
 
 log = logging.getLogger(__name__)
 
+
+def _check_filter(ctx, param, value):
+    'Validate a packet filter expression, leaving it to the plugins to compile.'
+
+    if value is None:
+        return value
+
+    # Imported here as the filter compiler imports scapy
+    from .exceptions import USBQFilterError
+    from .filter import compile_filter
+
+    try:
+        compile_filter(value)
+    except USBQFilterError as e:
+        raise click.BadParameter(str(e))
+    return value
+
+
 network_options = [
     click.option(
         '--proxy-addr',
@@ -54,7 +77,62 @@ pcap_options = [
         default='usb.pcap',
         type=click.Path(dir_okay=False, writable=True, exists=False),
         help='PCAP file to record USB traffic.',
-    )
+    ),
+    click.option(
+        '--pcap-background',
+        is_flag=True,
+        default=False,
+        help='Write the PCAP file from a background thread.',
+    ),
+    click.option(
+        '--pcap-flush-interval',
+        default=1.0,
+        type=float,
+        help='Maximum seconds between background PCAP writes.',
+    ),
+    click.option(
+        '--pcap-high-water',
+        default=1024,
+        type=click.IntRange(min=1),
+        help='Pending PCAP records that trigger an immediate background write.',
+    ),
+    click.option(
+        '--pcap-queue-size',
+        default=65536,
+        type=click.IntRange(min=1),
+        help='Queued packets before background PCAP records are dropped.',
+    ),
+    click.option(
+        '--pcap-rotate-size',
+        default=0,
+        type=click.IntRange(min=0),
+        help='Start a new PCAP file after this many bytes. 0 disables.',
+    ),
+    click.option(
+        '--pcap-rotate-interval',
+        default=0,
+        type=click.FloatRange(min=0),
+        help='Start a new PCAP file after this many seconds. 0 disables.',
+    ),
+    click.option(
+        '--pcap-retention',
+        default=0,
+        type=click.IntRange(min=0),
+        help='Number of closed PCAP files to keep. 0 keeps all.',
+    ),
+    click.option(
+        '--pcap-compress',
+        default='none',
+        type=click.Choice(['none', 'gzip', 'zstd']),
+        help='Compress closed PCAP files. zstd requires the zstandard package.',
+    ),
+    click.option(
+        '--pcap-filter',
+        default=None,
+        type=str,
+        callback=_check_filter,
+        help='Only record packets matching this filter expression. Defaults to --filter.',
+    ),
 ]
 
 identity_options = [
@@ -75,6 +153,65 @@ usb_device_options = [
     )
 ]
 
+replay_options = [
+    click.option(
+        '--pacing',
+        default='fast',
+        type=click.Choice(['original', 'rate', 'fast']),
+        help='Replay with the capture timing, at --rate packets/s, or as fast as possible.',
+    ),
+    click.option(
+        '--rate',
+        default=1000.0,
+        type=float,
+        help='Packets per second for --pacing rate.',
+    ),
+    click.option(
+        '--loops',
+        default=1,
+        type=click.IntRange(min=0),
+        help='Number of passes over the capture. 0 repeats forever.',
+    ),
+]
+
+filter_options = [
+    click.option(
+        '--filter',
+        default=None,
+        type=str,
+        callback=_check_filter,
+        help='Only log packets matching this filter expression, such as "ep == 0x81 and len > 8".',
+    ),
+    click.option(
+        '--dump-filter',
+        default=None,
+        type=str,
+        callback=_check_filter,
+        help='Only dump packets matching this filter expression. Defaults to --filter.',
+    ),
+]
+
+engine_options = [
+    click.option(
+        '--engine',
+        default='sync',
+        type=click.Choice(['sync', 'asyncio']),
+        help='Packet forwarding engine implementation.',
+        envvar='USBQ_ENGINE',
+    ),
+    click.option(
+        '--batch-size',
+        default=1,
+        type=click.IntRange(min=1),
+        help='Maximum number of packets drained from the proxy per batch. 1 disables batching.',
+        envvar='USBQ_BATCH_SIZE',
+    ),
+]
+
+#: Scenarios of usbq.bench. The names live here so that the CLI does not
+#: have to import the benchmark and its packet definitions at startup.
+BENCH_SCENARIOS = ['enumeration', 'hid', 'bulk', 'mixed']
+
 
 def load_ident(fn):
     if fn is not None:
@@ -94,10 +231,45 @@ def add_options(options):
     return _add_options
 
 
+def pipeline_plugin_options(pcap, dump=False, filter=None, dump_filter=None, **kwargs):
+    'Plugins that decode, log and encode packets from any packet source.'
+
+    # --pcap-* options are passed to the pcap plugin
+    pcap_opts = {
+        key[len('pcap_') :]: value
+        for key, value in kwargs.items()
+        if key.startswith('pcap_')
+    }
+
+    # --filter applies to the logging plugins without their own filter
+    if pcap_opts.get('filter', None) is None:
+        pcap_opts['filter'] = filter
+    if dump_filter is None:
+        dump_filter = filter
+
+    res = [
+        ('pcap', dict(pcap=pcap, **pcap_opts)),
+        ('decode', {}),
+        ('encode', {}),
+    ]
+
+    if dump:
+        res.append(('hexdump', {'filter': dump_filter}))
+
+    return res
+
+
 def standard_plugin_options(
-    proxy_addr, proxy_port, listen_addr, listen_port, pcap, dump=False, **kwargs
+    proxy_addr,
+    proxy_port,
+    listen_addr,
+    listen_port,
+    pcap,
+    dump=False,
+    batch_size=1,
+    **kwargs,
 ):
-    res = [
+    return [
         (
             'proxy',
             {
@@ -105,14 +277,7 @@ def standard_plugin_options(
                 'device_port': listen_port,
                 'host_addr': proxy_addr,
                 'host_port': proxy_port,
+                'batch_size': batch_size,
             },
-        ),
-        ('pcap', {'pcap': pcap}),
-        ('decode', {}),
-        ('encode', {}),
-    ]
-
-    if dump:
-        res.append(('hexdump', {}))
-
-    return res
+        )
+    ] + pipeline_plugin_options(pcap, dump=dump, **kwargs)
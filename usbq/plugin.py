@@ -1,4 +1,5 @@
 'Default plugin implementations'
+
 from .hookspec import hookimpl
 from .hookspec import USBQPluginDef
 
@@ -13,6 +14,12 @@ def usbq_declare_plugins():
             mod='usbq.plugins.proxy',
             clsname='ProxyPlugin',
         ),
+        'replay': USBQPluginDef(
+            name='replay',
+            desc='Replay USB host and device packets from a usbmon PCAP file.',
+            mod='usbq.plugins.replay',
+            clsname='ReplayPlugin',
+        ),
         'pcap': USBQPluginDef(
             name='pcap',
             desc='Write a PCAP file containing USB communications.',
@@ -49,6 +56,18 @@ def usbq_declare_plugins():
             mod='usbq.plugins.ipython',
             clsname='IPythonUI',
         ),
+        'latency': USBQPluginDef(
+            name='latency',
+            desc='Record per-stage packet pipeline latency histograms.',
+            mod='usbq.plugins.latency',
+            clsname='LatencyMonitor',
+        ),
+        'endpoints': USBQPluginDef(
+            name='endpoints',
+            desc='Map endpoints to the interfaces of the active configuration.',
+            mod='usbq.plugins.endpoints',
+            clsname='EndpointTable',
+        ),
         'lookfor': USBQPluginDef(
             name='lookfor',
             desc='look for a specific USB device to appear',
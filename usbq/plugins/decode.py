@@ -3,6 +3,7 @@ import logging
 import attr
 
 from ..hookspec import hookimpl
+from ..usbmitm_proto import LazyUSBMessage
 from ..usbmitm_proto import USBMessageDevice
 from ..usbmitm_proto import USBMessageHost
 
@@ -13,10 +14,18 @@ log = logging.getLogger(__name__)
 class USBDecode:
     'Decode raw USB packets into USBQ packets.'
 
+    #: Defer scapy dissection until a packet field is accessed
+    lazy = attr.ib(converter=bool, default=True)
+
+    def _decode(self, cls, data):
+        if self.lazy:
+            return LazyUSBMessage(cls, data)
+        return cls(bytes(data))
+
     @hookimpl
     def usbq_host_decode(self, data):
-        return USBMessageHost(data)
+        return self._decode(USBMessageHost, data)
 
     @hookimpl
     def usbq_device_decode(self, data):
-        return USBMessageDevice(data)
+        return self._decode(USBMessageDevice, data)
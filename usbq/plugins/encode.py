@@ -1,7 +1,7 @@
 import logging
 
 import attr
-from scapy.all import raw
+from scapy.compat import raw
 
 from ..hookspec import hookimpl
 
@@ -12,10 +12,29 @@ log = logging.getLogger(__name__)
 class USBEncode:
     'Encode host and device packets to USBQ packets.'
 
+    def __attrs_post_init__(self):
+        #: Count of encodes that rebuilt the packet vs returned the original bytes
+        self.stats = {'rebuild': 0, 'passthrough': 0}
+
+    def _encode(self, pkt):
+        # Unmodified decoded packets are sent as received
+        wire = getattr(pkt, 'wire', None)
+        if wire is not None and not pkt.is_dirty():
+            self.stats['passthrough'] += 1
+            return wire
+
+        # Only the modified branch is rebuilt, see TrackedPacket
+        self.stats['rebuild'] += 1
+        return raw(pkt)
+
     @hookimpl
     def usbq_host_encode(self, pkt):
-        return raw(pkt)
+        return self._encode(pkt)
 
     @hookimpl
     def usbq_device_encode(self, pkt):
-        return raw(pkt)
+        return self._encode(pkt)
+
+    @hookimpl
+    def usbq_ipython_ns(self):
+        return {'encode_stats': self.stats}
@@ -0,0 +1,194 @@
+import logging
+import struct
+
+import attr
+
+from ..defs import URBDefs
+from ..defs import USBDefs
+from ..dissect.usb import ConfigurationDescriptor
+from ..hookspec import hookimpl
+from ..model.tree import DescriptorTree
+from ..model.tree import endpoint_address
+from ..usbmitm_proto import decode_header
+from ..usbmitm_proto import EP_PAYLOAD_OFFSET
+from ..usbmitm_proto import LazyUSBMessage
+from ..usbmitm_proto import USBMessageDevice
+from ..usbmitm_proto import USBMitm
+
+__all__ = ['EndpointInfo', 'EndpointTable', 'ep_address']
+
+log = logging.getLogger(__name__)
+
+#: bmRequestType, bRequest, wValue, wIndex, wLength
+SETUP = struct.Struct('<BBHHH')
+
+#: Offset of the descriptor returned by a GET_DESCRIPTOR response
+RESPONSE_OFFSET = EP_PAYLOAD_OFFSET + SETUP.size
+
+
+def ep_address(ep):
+    'Return the endpoint address of a USBEp or USBEpHeader.'
+    if ep.epdir == USBMitm.URBEPDirection.URB_IN:
+        return 0x80 | ep.epnum
+    return ep.epnum
+
+
+@attr.s(frozen=True, slots=True)
+class EndpointInfo:
+    'Endpoint of the active configuration and the interface that owns it.'
+
+    address = attr.ib()
+    interface = attr.ib()
+    alternate = attr.ib()
+    cls = attr.ib()
+    subcls = attr.ib()
+    proto = attr.ib()
+    eptype = attr.ib()
+    maxpacket = attr.ib()
+    interval = attr.ib()
+
+
+@attr.s(cmp=False)
+class EndpointTable:
+    '''
+    Map endpoint addresses to the interfaces of the active configuration.
+
+    The configuration is learned from NEW_DEVICE management messages and
+    GET_DESCRIPTOR(CONFIGURATION) responses, and the active one from
+    SET_CONFIGURATION and SET_INTERFACE requests. Only control messages on
+    endpoint 0 and management messages are dissected.
+
+    Other plugins look endpoints up with ``pm.get_plugin('endpoints')``::
+
+        info = pm.get_plugin('endpoints').lookup(pkt.content.ep)
+    '''
+
+    def __attrs_post_init__(self):
+        #: Endpoint address -> EndpointInfo
+        self.table = {}
+
+        #: bConfigurationValue -> DescriptorTree
+        self.configurations = {}
+
+        #: Active bConfigurationValue, 0 when unconfigured
+        self.active = 0
+
+        #: Interface number -> active alternate setting
+        self.alternates = {}
+
+    def lookup(self, ep):
+        'Return the EndpointInfo of a USBEp, None if unknown.'
+        return self.table.get(ep_address(ep), None)
+
+    def __getitem__(self, address):
+        return self.table[address]
+
+    def __contains__(self, address):
+        return address in self.table
+
+    def __len__(self):
+        return len(self.table)
+
+    def _rebuild(self):
+        self.table = {}
+        tree = self.configurations.get(self.active, None)
+        if tree is None:
+            return
+
+        for number, alts in tree.interfaces.items():
+            node = alts.get(self.alternates.get(number, 0), None)
+            if node is None:
+                continue
+            intf = node.descriptor
+            for desc in node.endpoints:
+                address = endpoint_address(desc)
+                self.table[address] = EndpointInfo(
+                    address=address,
+                    interface=number,
+                    alternate=node.alternate,
+                    cls=intf.bInterfaceClass,
+                    subcls=intf.bInterfaceSubClass,
+                    proto=intf.bInterfaceProtocol,
+                    eptype=desc.bmAttributes.transfert,
+                    maxpacket=desc.wMaxPacketSize,
+                    interval=desc.bInterval,
+                )
+        log.debug(f'Endpoint table: {sorted(self.table.values())}')
+
+    def add_configuration(self, configuration, activate=False):
+        'Learn a configuration descriptor.'
+
+        tree = DescriptorTree(configuration)
+        value = configuration.bConfigurationValue
+        self.configurations[value] = tree
+        if activate:
+            self.active = value
+            self.alternates = {}
+        if self.active == value:
+            self._rebuild()
+
+    def set_configuration(self, value):
+        self.active = value
+        self.alternates = {}
+        self._rebuild()
+
+    def set_interface(self, number, alternate):
+        self.alternates[number] = alternate
+        self._rebuild()
+
+    def _management(self, pkt):
+        content = pkt.content
+        if content.management_type == USBMitm.ManagementType.NEW_DEVICE:
+            self.configurations = {}
+            self.add_configuration(
+                content.management_content.configuration, activate=True
+            )
+
+    def _request(self, setup):
+        reqtype, req, value, index, length = setup
+        if reqtype == 0x00 and req == URBDefs.Request.SET_CONFIGURATION:
+            self.set_configuration(value & 0xFF)
+        elif reqtype == 0x01 and req == URBDefs.Request.SET_INTERFACE:
+            self.set_interface(index & 0xFF, value & 0xFF)
+
+    def _response(self, setup, wire):
+        reqtype, req, value, index, length = setup
+        if (
+            req != URBDefs.Request.GET_DESCRIPTOR
+            or value >> 8 != USBDefs.DescriptorType.CONFIGURATION_DESCRIPTOR
+        ):
+            return
+
+        data = bytes(wire[RESPONSE_OFFSET:])
+        if len(data) < 4 or len(data) < struct.unpack_from('<H', data, 2)[0]:
+            # Only the header of the configuration
+            return
+        self.add_configuration(ConfigurationDescriptor(data))
+
+    @hookimpl
+    def usbq_log_pkt(self, pkt):
+        if isinstance(pkt, LazyUSBMessage):
+            header = pkt.header
+        else:
+            header = decode_header(type(pkt), bytes(pkt))
+
+        if header.is_management():
+            if header.management_type == USBMitm.ManagementType.NEW_DEVICE:
+                self._management(pkt)
+            return
+
+        if not header.is_usb_data() or header.ep is None or not header.ep.is_ctrl_0():
+            return
+
+        wire = header.wire
+        if len(wire) < RESPONSE_OFFSET:
+            return
+        setup = SETUP.unpack_from(wire, EP_PAYLOAD_OFFSET)
+        if header.cls is USBMessageDevice:
+            self._response(setup, wire)
+        else:
+            self._request(setup)
+
+    @hookimpl
+    def usbq_ipython_ns(self):
+        return {'endpoints': self}
@@ -1,8 +1,9 @@
 import logging
 
 import attr
-from scapy.all import hexdump
+from scapy.utils import hexdump
 
+from ..filter import compile_filter
 from ..hookspec import hookimpl
 
 log = logging.getLogger(__name__)
@@ -12,8 +13,14 @@ log = logging.getLogger(__name__)
 class Hexdump:
     'Print packets as a hexdump to the console.'
 
+    #: Only dump packets matching this filter expression (None dumps all)
+    filter = attr.ib(converter=compile_filter, default=None)
+
     @hookimpl
     def usbq_log_pkt(self, pkt):
+        if self.filter is not None and not self.filter.match(pkt):
+            return
+
         # Dump to console
         log.info(repr(pkt))
 
@@ -0,0 +1,52 @@
+import logging
+import time
+
+import attr
+
+from ..hookspec import hookimpl
+from ..latency import PipelineLatency
+
+log = logging.getLogger(__name__)
+
+
+@attr.s(cmp=False)
+class LatencyMonitor:
+    '''
+    Record per-stage pipeline latency.
+
+    The engine times each stage of the packet pipeline while this plugin is
+    registered. Histograms are available as ``latency`` in the IPython UI.
+    '''
+
+    #: Seconds between latency log summaries, 0 disables the periodic log
+    interval = attr.ib(converter=float, default=10.0)
+
+    def __attrs_post_init__(self):
+        self.stats = PipelineLatency()
+        self._last_log = time.monotonic()
+        self._last_count = 0
+
+    def _log_summary(self, title):
+        count = self.stats.count
+        if count == self._last_count:
+            return
+        self._last_count = count
+        log.info(f'{title}:\n{self.stats}')
+
+    @hookimpl
+    def usbq_tick(self):
+        if self.interval <= 0:
+            return
+
+        now = time.monotonic()
+        if now - self._last_log >= self.interval:
+            self._last_log = now
+            self._log_summary('Pipeline latency')
+
+    @hookimpl
+    def usbq_ipython_ns(self):
+        return {'latency': self.stats}
+
+    @hookimpl
+    def usbq_teardown(self):
+        self._log_summary('Final pipeline latency')
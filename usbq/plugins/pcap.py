@@ -1,21 +1,132 @@
+import gzip
 import logging
+import os
+import queue
+import shutil
+import threading
+import time
 from typing import Union
 
 import attr
-from scapy.all import raw
-from scapy.utils import RawPcapWriter
 
 from ..defs import USBDefs
+from ..filter import compile_filter
 from ..hookspec import hookimpl
 from ..usbmitm_proto import USBMessageDevice
 from ..usbmitm_proto import USBMessageHost
-from ..usbpcap import ack_from_msg
-from ..usbpcap import req_from_msg
-from ..usbpcap import usbdev_to_usbpcap
-from ..usbpcap import usbhost_to_usbpcap
+from ..usbpcap import LINKTYPE_USB_LINUX
+from ..usbpcap import pack_ack
+from ..usbpcap import pack_req
+from ..usbpcap import pack_usbdev
+from ..usbpcap import pack_usbhost
+from ..usbpcap import PCAP_HEADER
+from ..usbpcap import PCAP_MAGIC
+from ..usbpcap import PCAP_SNAPLEN
+from ..usbpcap import RECORD_HEADER
 
 log = logging.getLogger(__name__)
 
+# Sentinel asking the writer thread to exit
+_STOP = object()
+
+#: Supported compression for closed segments and their file extension
+COMPRESSORS = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def _compression(value):
+    if value in [None, 'none']:
+        return None
+    if value not in COMPRESSORS:
+        raise ValueError(f'Unsupported PCAP compression: {value}')
+    if value == 'zstd':
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise ValueError('zstd compression requires the zstandard package')
+    return value
+
+
+def _compress(filename, method):
+    'Compress a closed PCAP segment, removing the original.'
+
+    dest = filename + COMPRESSORS[method]
+    with open(filename, 'rb') as src, open(dest, 'wb') as fh:
+        if method == 'gzip':
+            with gzip.GzipFile(fileobj=fh, mode='wb') as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            import zstandard
+
+            zstandard.ZstdCompressor().copy_stream(src, fh)
+    os.unlink(filename)
+    return dest
+
+
+@attr.s(cmp=False)
+class PcapSink:
+    'Buffered PCAP file.'
+
+    #: Filename for the PCAP file.
+    filename = attr.ib(converter=str)
+
+    #: Size of the file write buffer
+    bufsize = attr.ib(converter=int, default=1024 * 1024)
+
+    def __attrs_post_init__(self):
+        self._f = open(self.filename, 'wb', self.bufsize)
+        self._f.write(
+            PCAP_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0, PCAP_SNAPLEN, LINKTYPE_USB_LINUX)
+        )
+
+        #: Bytes written to the file, including the file header
+        self.size = PCAP_HEADER.size
+
+        #: Time the file was opened
+        self.opened = time.monotonic()
+
+    @property
+    def empty(self):
+        return self.size == PCAP_HEADER.size
+
+    def write(self, data):
+        self._f.write(data)
+        self.size += len(data)
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+@attr.s(cmp=False)
+class PcapStats:
+    'Background PCAP writer counters.'
+
+    #: Records accepted into the queue
+    queued = attr.ib(default=0)
+
+    #: Records written to the file
+    written = attr.ib(default=0)
+
+    #: Records dropped because the queue was full
+    dropped = attr.ib(default=0)
+
+    #: Number of writes to the file
+    writes = attr.ib(default=0)
+
+    #: Deepest observed queue depth, in log_pkt record groups
+    max_depth = attr.ib(default=0)
+
+    #: PCAP files opened, including the first
+    segments = attr.ib(default=0)
+
+
+def _record(data, ts):
+    sec = int(ts)
+    usec = int((ts - sec) * 1000000)
+    return RECORD_HEADER.pack(sec, usec, len(data), len(data)) + data
+
 
 @attr.s(cmp=False)
 class PcapFileWriter:
@@ -24,39 +135,250 @@ class PcapFileWriter:
     #: Filename for the PCAP file.
     pcap = attr.ib(converter=str)
 
+    #: Write records from a background thread instead of the forwarding path
+    background = attr.ib(converter=bool, default=False)
+
+    #: Maximum number of seconds between background writes
+    flush_interval = attr.ib(converter=float, default=1.0)
+
+    #: Number of pending records that triggers an immediate background write
+    high_water = attr.ib(converter=int, default=1024)
+
+    #: Maximum number of queued record groups before records are dropped
+    queue_size = attr.ib(converter=int, default=65536)
+
+    #: Start a new PCAP segment once the current one reaches this many bytes (0 disables)
+    rotate_size = attr.ib(converter=int, default=0)
+
+    #: Start a new PCAP segment once the current one is this many seconds old (0 disables)
+    rotate_interval = attr.ib(converter=float, default=0)
+
+    #: Number of closed segments to keep (0 keeps all)
+    retention = attr.ib(converter=int, default=0)
+
+    #: Compression for closed segments (gzip, zstd or None)
+    compress = attr.ib(converter=_compression, default=None)
+
+    #: Only record packets matching this filter expression (None records all)
+    filter = attr.ib(converter=compile_filter, default=None)
+
     def __attrs_post_init__(self):
-        log.info(f'Logging packets to PCAP file {self.pcap}')
-        self._pcap = RawPcapWriter(self.pcap, linktype=220, sync=True)
+        self.stats = PcapStats()
+        self._queue = None
+        self._thread = None
+        self._closed = False
+        self._segment = 0
+        self._segments = []
+        self._archive = None
+        self._archiver = None
+
+        if self.rotating:
+            log.info(f'Logging packets to rotating PCAP files based on {self.pcap}')
+        else:
+            log.info(f'Logging packets to PCAP file {self.pcap}')
+        self._sink = self._open()
+
+        # Closed segments are compressed and pruned off the forwarding path
+        if self.rotating or self.compress is not None:
+            self._archive = queue.Queue()
+            self._archiver = threading.Thread(
+                target=self._archiver_loop, name='pcap-archiver', daemon=True
+            )
+            self._archiver.start()
+
+        if self.background:
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(
+                target=self._writer, name='pcap-writer', daemon=True
+            )
+            self._thread.start()
+
+    @property
+    def depth(self):
+        'Number of record groups waiting for the background writer.'
+
+        if self._queue is None:
+            return 0
+        return self._queue.qsize()
+
+    @property
+    def rotating(self):
+        return self.rotate_size > 0 or self.rotate_interval > 0
+
+    @property
+    def segments(self):
+        'Closed and archived PCAP segments, oldest first.'
+
+        return list(self._segments)
+
+    def _segment_name(self):
+        base, ext = os.path.splitext(self.pcap)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        name = f'{base}-{stamp}-{self._segment}{ext or ".pcap"}'
+        self._segment += 1
+        return name
+
+    def _open(self):
+        filename = self._segment_name() if self.rotating else self.pcap
+        self.stats.segments += 1
+        return PcapSink(filename)
+
+    def _should_rotate(self):
+        if not self.rotating or self._sink.empty:
+            return False
+        if self.rotate_size > 0 and self._sink.size >= self.rotate_size:
+            return True
+        if self.rotate_interval > 0:
+            return time.monotonic() - self._sink.opened >= self.rotate_interval
+        return False
+
+    def _close_segment(self):
+        self._sink.close()
+        if self._archive is not None:
+            self._archive.put(self._sink.filename)
+
+    def _rotate(self):
+        self._close_segment()
+        self._sink = self._open()
+        log.debug(f'Rotated PCAP file to {self._sink.filename}')
 
-    def _do_host(self, msg):
+    def _archiver_loop(self):
+        while True:
+            filename = self._archive.get()
+            if filename is _STOP:
+                break
+
+            if self.compress is not None:
+                try:
+                    filename = _compress(filename, self.compress)
+                except OSError:
+                    log.exception(f'Could not compress PCAP file {filename}')
+            self._segments.append(filename)
+
+            while self.retention > 0 and len(self._segments) > self.retention:
+                old = self._segments.pop(0)
+                log.debug(f'Removing old PCAP file {old}')
+                try:
+                    os.unlink(old)
+                except OSError:
+                    log.exception(f'Could not remove PCAP file {old}')
+
+    def _write(self, groups):
+        # Records are written in whole log_pkt groups so a segment boundary
+        # never separates a request from its synthesized ack.
+        for records in groups:
+            if self._should_rotate():
+                self._rotate()
+            self._sink.write(b''.join(records))
+            self.stats.written += len(records)
+        self.stats.writes += 1
+
+    def _writer(self):
+        pending = []
+        count = 0
+        deadline = time.monotonic() + self.flush_interval
+        stop = False
+
+        while not stop:
+            try:
+                group = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                group = None
+
+            # Batch everything else that is already queued
+            while group is not None:
+                if group is _STOP:
+                    stop = True
+                    break
+                pending.append(group)
+                count += len(group)
+                try:
+                    group = self._queue.get_nowait()
+                except queue.Empty:
+                    group = None
+
+            now = time.monotonic()
+            if stop or count >= self.high_water or now >= deadline:
+                if count > 0:
+                    self._write(pending)
+                    pending = []
+                    count = 0
+                self._sink.flush()
+                deadline = now + self.flush_interval
+
+    def _emit(self, records):
+        if self._queue is None:
+            self._write([records])
+            self._sink.flush()
+            return
+
+        try:
+            self._queue.put_nowait(records)
+        except queue.Full:
+            self.stats.dropped += len(records)
+            return
+
+        self.stats.queued += len(records)
+        self.stats.max_depth = max(self.stats.max_depth, self._queue.qsize())
+
+    def _do_host(self, msg, ts):
         # Convert and write
-        pcap_pkt = usbhost_to_usbpcap(msg)
-        self._pcap.write(raw(pcap_pkt))
+        records = [_record(pack_usbhost(msg), ts)]
 
         # We do not receive ACK from device for OUT data
         if msg.ep.epdir == msg.URBEPDirection.URB_OUT:
-            ack = ack_from_msg(msg)
-            self._pcap.write(raw(ack))
+            records.append(_record(pack_ack(msg), ts))
+        return records
+
+    def _do_device(self, msg, ts):
+        records = []
 
-    def _do_device(self, msg):
         # We do not receive REQUEST from host if type is not CTRL
         if msg.ep.eptype != USBDefs.EP.TransferType.CTRL:
-            req = req_from_msg(msg)
-            self._pcap.write(raw(req))
+            records.append(_record(pack_req(msg), ts))
 
         # Convert and write
-        pcap_pkt = usbdev_to_usbpcap(msg)
-        self._pcap.write(raw(pcap_pkt))
+        records.append(_record(pack_usbdev(msg), ts))
+        return records
 
     @hookimpl
     def usbq_log_pkt(self, pkt: Union[USBMessageDevice, USBMessageHost]):
+        if self._closed:
+            return
+
         # Only log USB Host or Device type packets to the pcap file
-        if type(pkt) in [USBMessageDevice, USBMessageHost]:
-            if pkt.type != pkt.MitmType.USB:
+        if getattr(pkt, 'cls', None) in [USBMessageDevice, USBMessageHost]:
+            if pkt.type != USBMessageDevice.MitmType.USB:
+                return
+            if self.filter is not None and not self.filter.match(pkt):
                 return
 
+            ts = time.time()
             msg = pkt.content
-            if type(pkt) == USBMessageDevice:
-                self._do_device(msg)
+            if pkt.cls is USBMessageDevice:
+                self._emit(self._do_device(msg, ts))
             else:
-                self._do_host(msg)
+                self._emit(self._do_host(msg, ts))
+
+    @hookimpl
+    def usbq_ipython_ns(self):
+        return {'pcap_stats': self.stats}
+
+    @hookimpl
+    def usbq_teardown(self):
+        if self._thread is not None:
+            log.info(f'Draining {self.depth} queued PCAP record groups.')
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+            log.info(
+                f'PCAP writer: {self.stats.written} records written in '
+                f'{self.stats.writes} writes, {self.stats.dropped} dropped, '
+                f'max queue depth {self.stats.max_depth}.'
+            )
+        self._close_segment()
+        if self._archiver is not None:
+            self._archive.put(_STOP)
+            self._archiver.join()
+            self._archiver = None
+        self._closed = True
@@ -0,0 +1,184 @@
+import inspect
+import logging
+import time
+from collections import OrderedDict
+
+import attr
+
+from ..hookspec import hookimpl
+from ..pm import pm
+
+log = logging.getLogger(__name__)
+
+
+class HookImplStats:
+    'Timing of one hook implementation.'
+
+    __slots__ = ('calls', 'sampled', 'wall_ns', 'cpu_ns', 'max_wall_ns')
+
+    def __init__(self):
+        self.calls = 0
+        self.sampled = 0
+        self.wall_ns = 0
+        self.cpu_ns = 0
+        self.max_wall_ns = 0
+
+    def add(self, wall_ns, cpu_ns):
+        self.sampled += 1
+        self.wall_ns += wall_ns
+        self.cpu_ns += cpu_ns
+        if wall_ns > self.max_wall_ns:
+            self.max_wall_ns = wall_ns
+
+    @property
+    def mean_wall_ns(self):
+        return self.wall_ns / self.sampled if self.sampled > 0 else 0.0
+
+    @property
+    def mean_cpu_ns(self):
+        return self.cpu_ns / self.sampled if self.sampled > 0 else 0.0
+
+    @property
+    def est_wall_ns(self):
+        'Wall time of all calls extrapolated from the sampled ones.'
+
+        return self.mean_wall_ns * self.calls
+
+
+@attr.s(cmp=False)
+class HookProfiler:
+    '''
+    Measure wall and CPU time of each hook implementation.
+
+    Implementation functions of registered plugins are replaced by timing
+    wrappers. Plugins registered later, such as a reloaded usbq_hooks.py,
+    are picked up on the next usbq_tick. Wrapper hookimpls and ``async``
+    implementations are not profiled.
+    '''
+
+    #: Time 1 in sample calls of each implementation
+    sample = attr.ib(converter=int, default=1)
+
+    #: Number of rows logged at teardown, 0 logs all
+    top = attr.ib(converter=int, default=20)
+
+    @sample.validator
+    def _check_sample(self, attribute, value):
+        if value < 1:
+            raise ValueError('Profile sample interval must be at least 1.')
+
+    def __attrs_post_init__(self):
+        #: (hook name, plugin name) -> HookImplStats
+        self.stats = OrderedDict()
+        self._wrapped = {}
+
+        #: pm.generation of the last wrap()
+        self._generation = None
+        self.wrap()
+
+    def _profiled(self, hook_name, impl):
+        func = impl.function
+        key = (hook_name, impl.plugin_name)
+        stats = self.stats.get(key, None)
+        if stats is None:
+            stats = self.stats[key] = HookImplStats()
+        sample = self.sample
+        perf_counter_ns = time.perf_counter_ns
+        thread_time_ns = time.thread_time_ns
+
+        def profiled(*args, **kwargs):
+            stats.calls += 1
+            if stats.calls % sample != 0:
+                return func(*args, **kwargs)
+
+            wall = perf_counter_ns()
+            cpu = thread_time_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.add(perf_counter_ns() - wall, thread_time_ns() - cpu)
+
+        return profiled
+
+    def wrap(self):
+        'Wrap hook implementations that are not profiled yet.'
+
+        # Implementations only change when plugins are (un)registered
+        if self._generation == pm.generation:
+            return
+
+        wrapped = False
+        for hook_name, hook in vars(pm.hook).items():
+            for impl in hook.get_hookimpls():
+                if id(impl) in self._wrapped or impl.plugin is self:
+                    continue
+                if (
+                    impl.hookwrapper
+                    or getattr(impl, 'wrapper', False)
+                    or inspect.iscoroutinefunction(impl.function)
+                ):
+                    continue
+                self._wrapped[id(impl)] = (impl, impl.function)
+                impl.function = self._profiled(hook_name, impl)
+                wrapped = True
+
+        if wrapped:
+            # Dispatch plans hold the replaced functions
+            pm.invalidate()
+        self._generation = pm.generation
+
+    def unwrap(self):
+        'Restore the original hook implementations.'
+
+        for impl, func in self._wrapped.values():
+            impl.function = func
+        self._wrapped.clear()
+        self._generation = None
+        pm.invalidate()
+
+    def reset(self):
+        for stats in self.stats.values():
+            stats.__init__()
+
+    def rows(self):
+        'Stats sorted by estimated total wall time, highest first.'
+
+        return sorted(
+            self.stats.items(), key=lambda kv: kv[1].est_wall_ns, reverse=True
+        )
+
+    def report(self, top=0):
+        'Table of the top (0 for all) hook implementations.'
+
+        rows = [(key, stats) for key, stats in self.rows() if stats.calls > 0]
+        if top > 0:
+            rows = rows[:top]
+
+        lines = [
+            f'{"hook":<28} {"plugin":<16} {"calls":>10} {"total ms":>10} '
+            f'{"mean us":>9} {"cpu us":>9} {"max us":>9}'
+        ]
+        for (hook_name, plugin_name), stats in rows:
+            lines.append(
+                f'{hook_name:<28} {plugin_name:<16} {stats.calls:>10} '
+                f'{stats.est_wall_ns / 1e6:>10.2f} {stats.mean_wall_ns / 1e3:>9.2f} '
+                f'{stats.mean_cpu_ns / 1e3:>9.2f} {stats.max_wall_ns / 1e3:>9.2f}'
+            )
+        if self.sample > 1:
+            lines.append(f'Timing sampled 1 in {self.sample} calls.')
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.report()
+
+    @hookimpl
+    def usbq_tick(self):
+        self.wrap()
+
+    @hookimpl
+    def usbq_ipython_ns(self):
+        return {'hook_profile': self}
+
+    @hookimpl
+    def usbq_teardown(self):
+        log.info(f'Hook implementation profile:\n{self.report(self.top)}')
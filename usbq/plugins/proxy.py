@@ -17,6 +17,65 @@ from ..usbmitm_proto import USBMessageHost
 
 log = logging.getLogger(__name__)
 TIMEOUT = ([], [], [])
+MAX_PACKET = 4096
+
+
+def _fileno(sel):
+    return sel if isinstance(sel, int) else sel.fileno()
+
+
+def _exported(buf):
+    'Whether views of the bytearray buf are alive.'
+
+    # A bytearray cannot be resized while exported
+    try:
+        buf.append(0)
+    except BufferError:
+        return True
+    del buf[-1]
+    return False
+
+
+@attr.s
+class BatchStats:
+    'Batched receive statistics for a packet source.'
+
+    #: Configured maximum batch size
+    batch_size = attr.ib(converter=int)
+
+    #: Number of non-empty batches received
+    batches = attr.ib(default=0)
+
+    #: Number of packets received
+    packets = attr.ib(default=0)
+
+    #: Largest batch received
+    largest = attr.ib(default=0)
+
+    #: Number of batches that filled the buffer pool
+    full = attr.ib(default=0)
+
+    @property
+    def mean(self):
+        if self.batches == 0:
+            return 0.0
+        return self.packets / self.batches
+
+    def update(self, count):
+        if count == 0:
+            return
+        self.batches += 1
+        self.packets += count
+        self.largest = max(self.largest, count)
+        if count == self.batch_size:
+            self.full += 1
+
+    def __str__(self):
+        return (
+            f'{self.packets} packets in {self.batches} batches '
+            f'(mean {self.mean:.1f}, max {self.largest}/{self.batch_size}, '
+            f'{self.full} full)'
+        )
 
 
 @attr.s(cmp=False)
@@ -38,6 +97,9 @@ class ProxyPlugin(StateMachine):
     #: Timeout for select statement that waits for incoming USBQ packets
     timeout = attr.ib(converter=int, default=1)
 
+    #: Maximum number of packets drained from a socket per batch
+    batch_size = attr.ib(converter=int, default=1)
+
     # States
     idle = State('idle', initial=True)
     running = State('running')
@@ -60,8 +122,16 @@ class ProxyPlugin(StateMachine):
         self._proxy_host = True
         self._proxy_device = True
         self._device_dst = None
+        self._events = []
+        self._events_generation = None
         self._detected_host = False
         self._detected_device = False
+        self.stats = {
+            'device': BatchStats(batch_size=self.batch_size),
+            'host': BatchStats(batch_size=self.batch_size),
+        }
+        self._device_pool = self._make_pool()
+        self._host_pool = self._make_pool()
 
         if self._device_addr is None or self._device_port is None:
             self._proxy_device = False
@@ -84,8 +154,40 @@ class ProxyPlugin(StateMachine):
             self._host_dst = (self._host_addr, self._host_port)
             self._socks.append(self._host_sock)
 
+    @property
+    def listen_address(self):
+        'Address the device socket is bound to.'
+
+        if not self._proxy_device:
+            return None
+        return self._device_sock.getsockname()
+
+    def _make_pool(self):
+        return [bytearray(MAX_PACKET) for i in range(self.batch_size)]
+
+    def _recv_batch(self, sock, pool):
+        '''
+        Drain queued datagrams from sock into the preallocated buffer pool.
+
+        The batch holds views of the pool buffers, which decoded packets keep
+        as their wire data. A buffer still referenced by a packet that
+        outlived its batch is handed over to it and replaced in the pool
+        instead of being overwritten, so packets are never copied.
+        '''
+        batch = []
+        addr = None
+        for i, buf in enumerate(pool):
+            if _exported(buf):
+                buf = pool[i] = bytearray(MAX_PACKET)
+            try:
+                nbytes, _, _, addr = sock.recvmsg_into([buf])
+            except BlockingIOError:
+                break
+            batch.append(memoryview(buf)[:nbytes])
+        return batch, addr
+
     def _has_data(self, socks, timeout=0):
-        (read, write, error) = select.select(socks, self.EMPTY, socks, timeout)
+        read, write, error = select.select(socks, self.EMPTY, socks, timeout)
         if len(read) != 0:
             return True
         return False
@@ -102,6 +204,23 @@ class ProxyPlugin(StateMachine):
             if self._has_data([self._device_sock]):
                 return True
 
+    def _event_sources(self):
+        '(selectable, callback) event sources, such as file watchers, to wait on.'
+
+        if self._events_generation != pm.generation:
+            self._events_generation = pm.generation
+            sources = {}
+            for srcs in pm.hook.usbq_event_sources():
+                sources.update(srcs)
+            self._events = [
+                src
+                for name, src in sources.items()
+                if name not in ['device', 'host'] and src is not None
+            ]
+
+        # Skip sources closed at teardown
+        return [(sel, callback) for sel, callback in self._events if _fileno(sel) >= 0]
+
     @hookimpl
     def usbq_wait_for_packet(self):
         # Poll for data from non-proxy source
@@ -110,17 +229,41 @@ class ProxyPlugin(StateMachine):
             queued_data += pm.hook.usbq_host_has_packet()
         if not self._proxy_device:
             queued_data += pm.hook.usbq_device_has_packet()
+        queued = any(queued_data)
 
-        if any(queued_data):
+        events = self._event_sources()
+        if queued and len(events) == 0:
+            return True
+
+        # Wait for packets and other events together
+        read, write, error = select.select(
+            self._socks + [sel for sel, callback in events],
+            self.EMPTY,
+            self._socks,
+            0 if queued else self.timeout,
+        )
+        for sel, callback in events:
+            if sel in read:
+                callback()
+
+        if queued or any(sock in read for sock in self._socks):
             return True
-        else:
-            # Wait
-            if self._has_data(self._socks, timeout=self.timeout):
-                return True
+
+    @hookimpl
+    def usbq_event_sources(self):
+        res = {}
+        if self._proxy_device:
+            res['device'] = self._device_sock
+        if self._proxy_host:
+            res['host'] = self._host_sock
+        return res
 
     @hookimpl
     def usbq_get_host_packet(self):
-        data, self._host_dst = self._host_sock.recvfrom(4096)
+        try:
+            data, self._host_dst = self._host_sock.recvfrom(4096)
+        except BlockingIOError:
+            return
 
         if not self._detected_host:
             log.info('First USBQ host packet detected from proxy')
@@ -130,7 +273,10 @@ class ProxyPlugin(StateMachine):
 
     @hookimpl
     def usbq_get_device_packet(self):
-        data, self._device_dst = self._device_sock.recvfrom(4096)
+        try:
+            data, self._device_dst = self._device_sock.recvfrom(4096)
+        except BlockingIOError:
+            return
 
         if not self._detected_device:
             log.info('First USBQ device packet detected from proxy')
@@ -138,6 +284,38 @@ class ProxyPlugin(StateMachine):
 
         return data
 
+    @hookimpl
+    def usbq_get_host_batch(self):
+        if not self._proxy_host:
+            return
+
+        batch, addr = self._recv_batch(self._host_sock, self._host_pool)
+        if addr is not None:
+            self._host_dst = addr
+
+            if not self._detected_host:
+                log.info('First USBQ host packet detected from proxy')
+                self._detected_host = True
+
+        self.stats['host'].update(len(batch))
+        return batch
+
+    @hookimpl
+    def usbq_get_device_batch(self):
+        if not self._proxy_device:
+            return
+
+        batch, addr = self._recv_batch(self._device_sock, self._device_pool)
+        if addr is not None:
+            self._device_dst = addr
+
+            if not self._detected_device:
+                log.info('First USBQ device packet detected from proxy')
+                self._detected_device = True
+
+        self.stats['device'].update(len(batch))
+        return batch
+
     @hookimpl
     def usbq_send_host_packet(self, data):
         return self._host_sock.sendto(data, self._host_dst) > 0
@@ -147,6 +325,29 @@ class ProxyPlugin(StateMachine):
         if self._device_dst is not None:
             return self._device_sock.sendto(data, self._device_dst) > 0
 
+    @hookimpl
+    def usbq_send_host_batch(self, batch):
+        for data in batch:
+            self._host_sock.sendto(data, self._host_dst)
+        return True
+
+    @hookimpl
+    def usbq_send_device_batch(self, batch):
+        if self._device_dst is not None:
+            for data in batch:
+                self._device_sock.sendto(data, self._device_dst)
+            return True
+
+    @hookimpl
+    def usbq_ipython_ns(self):
+        return {'proxy_stats': self.stats}
+
+    @hookimpl
+    def usbq_teardown(self):
+        if self.batch_size > 1:
+            for name, stats in self.stats.items():
+                log.info(f'Proxy {name} batches: {stats}')
+
     @hookimpl
     def usbq_log_pkt(self, pkt):
         if ManagementMessage in pkt:
@@ -1,28 +1,63 @@
 import importlib
 import inspect
 import logging
+import time
 import traceback
 from pathlib import Path
 
 import attr
 
 from ..hookspec import hookimpl
+from ..inotify import Inotify
 from ..pm import HOOK_CLSNAME
 from ..pm import HOOK_MOD
 from ..pm import pm
 
 log = logging.getLogger(__name__)
 
+#: Name of the plugin holding the usbq_hooks error handlers
+GUARD_NAME = 'usbq_hooks_guard'
+
+#: Hooks that ReloadUSBQHooks always wraps itself
+RELOAD_HOOKS = ['usbq_tick', 'usbq_event_sources', 'usbq_teardown']
+
 
 @attr.s(cmp=False)
 class ReloadUSBQHooks:
-    'Reload usbq_hooks.py when it changes'
+    '''
+    Reload usbq_hooks.py when it changes
+
+    On Linux the hook file directory is watched with inotify. The inotify
+    descriptor is declared as a usbq_event_sources source: the asyncio
+    engine, and the proxy while the synchronous engine waits for packets,
+    select on it together with the packet sources. Without a proxy, the
+    synchronous engine reads it once per tick. Elsewhere the file
+    modification time is polled.
+    '''
 
     _hookfile = attr.ib(default='usbq_hooks.py')
 
+    #: Watch the hook file with inotify when available
+    inotify = attr.ib(converter=bool, default=True)
+
+    #: Minimum seconds between modification time checks when polling
+    poll_interval = attr.ib(converter=float, default=1.0)
+
     def __attrs_post_init__(self):
         self._mtime = None
         self._path = Path(self._hookfile)
+        self._watcher = None
+        self._pending = False
+        self._evented = False
+        self._last_poll = time.monotonic()
+        self._guarded = None
+
+        if self.inotify:
+            try:
+                self._watcher = Inotify(self._path.parent, names=[self._path.name])
+            except OSError as e:
+                log.debug(f'Polling {self._path} for changes: {e}')
+
         if self._path.is_file():
             log.info(f'Monitoring {self._path} for changes.')
             self._mtime = self.mtime
@@ -32,14 +67,34 @@ class ReloadUSBQHooks:
         if self._path.is_file():
             return self._path.stat().st_mtime
 
+    def _on_change(self):
+        if self._watcher.read():
+            self._pending = True
+
+    def _poll(self):
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return False
+        self._last_poll = now
+
+        mtime = self.mtime
+        if self._mtime != mtime:
+            self._mtime = mtime
+            return True
+        return False
+
     @property
     def changed(self):
-        if self._mtime != self.mtime:
-            self._mtime = self.mtime
-            log.debug(f'Monitored hook file {self._path} was modified.')
-            return True
+        if self._watcher is None:
+            res = self._poll()
         else:
-            return False
+            if not self._evented:
+                self._on_change()
+            res, self._pending = self._pending, False
+
+        if res:
+            log.debug(f'Monitored hook file {self._path} was modified.')
+        return res
 
     def _catch(self, outcome):
         try:
@@ -53,8 +108,33 @@ class ReloadUSBQHooks:
                 pm.unregister(name=HOOK_MOD)
                 outcome.force_result(None)
 
+    def _sync_guard(self):
+        '''
+        Wrap the hooks implemented by usbq_hooks, and only those, with error
+        handlers so other hook calls do not pay for a wrapper.
+        '''
+        plugin = pm.get_plugin(HOOK_MOD)
+        if plugin is self._guarded:
+            return
+
+        if pm.get_plugin(GUARD_NAME) is not None:
+            pm.unregister(name=GUARD_NAME)
+        self._guarded = plugin
+        if plugin is None:
+            return
+
+        hooknames = [
+            caller.name
+            for caller in pm.get_hookcallers(plugin)
+            if caller.name not in RELOAD_HOOKS
+        ]
+        log.debug(f'Guarding {HOOK_MOD} hooks: {", ".join(hooknames)}')
+        pm.register(_make_guard(self._catch, hooknames), name=GUARD_NAME)
+
     @hookimpl(hookwrapper=True)
     def usbq_tick(self):
+        self._sync_guard()
+
         if self.changed:
             # Reload
             try:
@@ -71,39 +151,49 @@ class ReloadUSBQHooks:
             # Register
             cls = getattr(mod, HOOK_CLSNAME)
             pm.register(cls(), name=HOOK_MOD)
+            self._sync_guard()
             log.info('Reloaded usbq_hooks.py.')
 
         outcome = yield
         self._catch(outcome)
 
-    def _wrapper(self, *args, **kwargs):
+    @hookimpl(hookwrapper=True)
+    def usbq_event_sources(self):
         outcome = yield
         self._catch(outcome)
 
+        if self._watcher is not None:
+            # The engine reads the watcher when the kernel signals a change
+            self._evented = True
+            res = outcome.get_result() or []
+            outcome.force_result(res + [{'reload': (self._watcher, self._on_change)}])
+
+    @hookimpl(hookwrapper=True)
+    def usbq_teardown(self):
+        outcome = yield
+        self._catch(outcome)
+
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+
+
+def _guard_wrapper(self, *args, **kwargs):
+    outcome = yield
+    self._catch(outcome)
+
+
+def _make_guard(catch, hooknames):
+    'Plugin wrapping hooknames with the catch(outcome) error handler.'
 
-# Create usbq_hook error handlers for all defined hooks
-for hookname in [
-    'usbq_wait_for_packet',
-    'usbq_log_pkt',
-    'usbq_device_has_packet',
-    'usbq_get_device_packet',
-    'usbq_device_decode',
-    'usbq_device_modify',
-    'usbq_device_encode',
-    'usbq_host_has_packet',
-    'usbq_get_host_packet',
-    'usbq_host_decode',
-    'usbq_host_encode',
-    'usbq_host_modify',
-    'usbq_send_device_packet',
-    'usbq_send_host_packet',
-    'usbq_device_identity',
-    'usbq_handle_device_request',
-    'usbq_ipython_ns',
-    'usbq_connected',
-    'usbq_disconnected',
-    'usbq_teardown',
-]:
-    setattr(
-        ReloadUSBQHooks, hookname, hookimpl(ReloadUSBQHooks._wrapper, hookwrapper=True)
+    cls = type(
+        'USBQHooksGuard',
+        (),
+        {
+            hookname: hookimpl(_guard_wrapper, hookwrapper=True)
+            for hookname in hooknames
+        },
     )
+    guard = cls()
+    guard._catch = catch
+    return guard
@@ -0,0 +1,293 @@
+import logging
+import os
+import time
+
+import attr
+
+from ..capture import Capture
+from ..capture import usbq_messages
+from ..exceptions import USBQEndOfStream
+from ..hookspec import hookimpl
+from ..usbmitm_proto import USBMessageHost
+
+log = logging.getLogger(__name__)
+
+#: Replay pacing modes
+PACING = ['original', 'rate', 'fast']
+
+#: Longest single sleep in usbq_wait_for_packet so ticks keep running
+MAX_WAIT = 0.1
+
+
+@attr.s(cmp=False)
+class ReplayStats:
+    'Replay throughput counters.'
+
+    #: Packets read from the capture for the host
+    host = attr.ib(default=0)
+
+    #: Packets read from the capture for the device
+    device = attr.ib(default=0)
+
+    #: Packets that reached the end of the pipeline
+    sent = attr.ib(default=0)
+
+    #: Time the first packet was read
+    started = attr.ib(default=None)
+
+    #: Time the last packet was read
+    finished = attr.ib(default=None)
+
+    @property
+    def packets(self):
+        return self.host + self.device
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        end = self.finished if self.finished is not None else time.monotonic()
+        return end - self.started
+
+    @property
+    def rate(self):
+        'Achieved packets per second.'
+
+        if self.elapsed == 0:
+            return 0.0
+        return self.packets / self.elapsed
+
+    def __str__(self):
+        return (
+            f'{self.packets} packets ({self.host} host, {self.device} device, '
+            f'{self.sent} sent) in {self.elapsed:.3f}s: {self.rate:.0f} packets/s'
+        )
+
+
+@attr.s(cmp=False)
+class ReplayPlugin:
+    '''
+    Replay USB host and device packets from a usbmon PCAP capture.
+
+    With fast pacing, the event sources of the asyncio engine are pipes
+    that are readable while the next packet is for their direction.
+    '''
+
+    #: usbmon PCAP file to replay
+    pcap = attr.ib(converter=str)
+
+    #: original: capture timing, rate: fixed packets/s, fast: as fast as possible
+    pacing = attr.ib(default='fast', validator=attr.validators.in_(PACING))
+
+    #: Packets per second for rate pacing
+    rate = attr.ib(converter=float, default=1000.0)
+
+    #: Number of passes over the capture, 0 repeats forever
+    loops = attr.ib(converter=int, default=1)
+
+    #: Maximum number of packets returned by the batch hooks
+    batch_size = attr.ib(converter=int, default=64)
+
+    @rate.validator
+    def _check_rate(self, attribute, value):
+        if value <= 0:
+            raise ValueError('Replay rate must be greater than 0.')
+
+    def __attrs_post_init__(self):
+        log.info(f'Replaying {self.pcap} with {self.pacing} pacing.')
+        self._capture = Capture(self.pcap)
+        self._stream = self._messages()
+        self._start = None
+        self._done = False
+        self.stats = ReplayStats()
+
+        #: is_host -> (read fd, write fd) of the readiness pipes
+        self._pipes = None
+
+        #: is_host -> True if its readiness pipe is readable
+        self._signaled = {False: False, True: False}
+        self._advance()
+
+    def _messages(self):
+        'Yield (offset, is_host, data), offset in seconds from the replay start.'
+
+        n = 0
+        base = 0.0
+        loop = 0
+        while self.loops == 0 or loop < self.loops:
+            ts0 = None
+            offset = base
+            for rec, cls, data in usbq_messages(self._capture):
+                if self.pacing == 'original':
+                    if ts0 is None:
+                        ts0 = rec.ts
+                    offset = base + rec.ts - ts0
+                elif self.pacing == 'rate':
+                    offset = n / self.rate
+                else:
+                    offset = 0.0
+                n += 1
+                yield offset, cls is USBMessageHost, data
+
+            if n == 0:
+                log.warning(f'{self.pcap} contains no usbq_core USB messages.')
+                return
+            base = offset
+            loop += 1
+
+    def _advance(self):
+        self._next = next(self._stream, None)
+        self._signal()
+
+    def _signal(self):
+        'Make the readiness pipe of the direction of the next packet readable.'
+
+        if self._pipes is None:
+            return
+
+        for is_host, (rfd, wfd) in self._pipes.items():
+            ready = self._next is not None and self._next[1] == is_host
+            if ready == self._signaled[is_host]:
+                continue
+            if ready:
+                os.write(wfd, b'\0')
+            else:
+                os.read(rfd, 1)
+            self._signaled[is_host] = ready
+
+    def _close_pipes(self):
+        if self._pipes is None:
+            return
+        for fds in self._pipes.values():
+            for fd in fds:
+                os.close(fd)
+        self._pipes = None
+
+    def _due(self):
+        if self._start is None:
+            self._start = time.monotonic()
+        return self._start + self._next[0]
+
+    def _ready(self, is_host):
+        if self._next is None or self._next[1] != is_host:
+            return False
+        return self.pacing == 'fast' or self._due() <= time.monotonic()
+
+    def _get(self, is_host):
+        if not self._ready(is_host):
+            return
+
+        data = self._next[2]
+        now = time.monotonic()
+        if self.stats.started is None:
+            self.stats.started = now
+        if is_host:
+            self.stats.host += 1
+        else:
+            self.stats.device += 1
+
+        self._advance()
+        if self._next is None:
+            self.stats.finished = time.monotonic()
+        return data
+
+    def _get_batch(self, is_host):
+        batch = []
+        while len(batch) < self.batch_size:
+            data = self._get(is_host)
+            if data is None:
+                break
+            batch.append(data)
+        return batch
+
+    @hookimpl
+    def usbq_tick(self):
+        if self._next is None and not self._done:
+            self._done = True
+            log.info(f'Replay finished: {self.stats}')
+            raise USBQEndOfStream(f'End of {self.pcap}')
+
+    @hookimpl
+    def usbq_event_sources(self):
+        # Paced packets become due without an event: they are polled
+        if self.pacing != 'fast':
+            return {}
+
+        if self._pipes is None:
+            self._pipes = {}
+            for is_host in [False, True]:
+                rfd, wfd = os.pipe()
+                os.set_blocking(rfd, False)
+                self._pipes[is_host] = (rfd, wfd)
+            self._signal()
+        return {'device': self._pipes[False][0], 'host': self._pipes[True][0]}
+
+    @hookimpl
+    def usbq_wait_for_packet(self):
+        if self._next is not None and self.pacing != 'fast':
+            delay = self._due() - time.monotonic()
+            if delay > 0:
+                time.sleep(min(delay, MAX_WAIT))
+        return True
+
+    @hookimpl
+    def usbq_device_has_packet(self):
+        if self._ready(False):
+            return True
+
+    @hookimpl
+    def usbq_get_device_packet(self):
+        return self._get(False)
+
+    @hookimpl
+    def usbq_get_device_batch(self):
+        return self._get_batch(False)
+
+    @hookimpl
+    def usbq_host_has_packet(self):
+        # Not a firstresult hook: only answer when data is available
+        if self._ready(True):
+            return True
+
+    @hookimpl
+    def usbq_get_host_packet(self):
+        return self._get(True)
+
+    @hookimpl
+    def usbq_get_host_batch(self):
+        return self._get_batch(True)
+
+    @hookimpl
+    def usbq_send_device_packet(self, data):
+        # Packets are consumed at the end of the pipeline
+        self.stats.sent += 1
+        return True
+
+    @hookimpl
+    def usbq_send_host_packet(self, data):
+        self.stats.sent += 1
+        return True
+
+    @hookimpl
+    def usbq_send_device_batch(self, batch):
+        self.stats.sent += len(batch)
+        return True
+
+    @hookimpl
+    def usbq_send_host_batch(self, batch):
+        self.stats.sent += len(batch)
+        return True
+
+    @hookimpl
+    def usbq_ipython_ns(self):
+        return {'replay_stats': self.stats}
+
+    @hookimpl
+    def usbq_teardown(self):
+        if not self._done:
+            log.info(f'Replay stopped: {self.stats}')
+        self._done = True
+        self._next = None
+        self._stream.close()
+        self._capture.close()
+        self._close_pipes()
@@ -1,5 +1,8 @@
 import importlib
+import importlib.metadata
+import json
 import logging
+import os
 import os.path
 import sys
 from collections import ChainMap
@@ -12,17 +15,139 @@ from .hookspec import USBQ_EP
 from .hookspec import USBQHookSpec
 from .hookspec import USBQPluginDef
 
-__all__ = ['AVAILABLE_PLUGINS', 'enable_plugins', 'enable_tracing']
+__all__ = [
+    'USBQPluginManager',
+    'load_entrypoints',
+    'AVAILABLE_PLUGINS',
+    'enable_plugins',
+    'enable_tracing',
+    'enable_profiling',
+    'enable_binary_tracing',
+]
 
 log = logging.getLogger(__name__)
 
 # Search current directory. Needed for usbq_hooks.py
 sys.path.insert(0, os.path.abspath('.'))
 
+#: Entry point cache directory. An empty USBQ_CACHE_DIR disables the cache.
+CACHE_DIR = os.environ.get(
+    'USBQ_CACHE_DIR',
+    os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'usbq'
+    ),
+)
+ENTRYPOINT_CACHE = 'entrypoints.json'
+
+
+def _entrypoint_cache_key():
+    'Modification times of the import path directories.'
+
+    # The current directory changes with every capture and log file
+    cwd = os.path.abspath('.')
+    key = []
+    for path in sys.path:
+        path = os.path.abspath(path or '.')
+        if path == cwd:
+            continue
+        try:
+            key.append([path, os.stat(path).st_mtime_ns])
+        except OSError:
+            pass
+    return key
+
+
+def load_entrypoints(pm, group, cache_dir=CACHE_DIR):
+    '''
+    Register the plugins of the setuptools entry points of group.
+
+    Scanning the installed distributions takes a large part of the startup
+    time. The entry points found are cached in cache_dir until a directory
+    of the import path changes, as it does when a distribution is installed
+    or removed.
+    '''
+
+    key = _entrypoint_cache_key()
+    fn = os.path.join(cache_dir, ENTRYPOINT_CACHE) if cache_dir else None
+
+    if fn is not None:
+        try:
+            with open(fn) as f:
+                cached = json.load(f)
+            if cached['key'] == key and group in cached['groups']:
+                for name, value in cached['groups'][group]:
+                    if pm.get_plugin(name) or pm.is_blocked(name):
+                        continue
+                    ep = importlib.metadata.EntryPoint(name, value, group)
+                    pm.register(ep.load(), name=name)
+                return
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        except ImportError as e:
+            log.debug(f'Stale entry point cache {fn}: {e}')
+
+    pm.load_setuptools_entrypoints(group)
+
+    if fn is not None:
+        eps = importlib.metadata.entry_points(group=group)
+        cached = {'key': key, 'groups': {group: [[ep.name, ep.value] for ep in eps]}}
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(fn, 'w') as f:
+                json.dump(cached, f)
+        except OSError as e:
+            log.debug(f'Could not write entry point cache {fn}: {e}')
+
+
+class USBQPluginManager(pluggy.PluginManager):
+    '''
+    Plugin manager that counts changes to the registered hook implementations.
+
+    ``generation`` increases whenever plugins are registered or unregistered
+    or hook call monitoring is added or removed so that state derived from
+    the hook implementations, such as the engine dispatch plan, can be
+    rebuilt.
+    '''
+
+    def __init__(self, project_name):
+        super().__init__(project_name)
+        self.generation = 0
+
+        #: Number of active hook call monitors
+        self.monitors = 0
+
+    def invalidate(self):
+        'Signal a change to hook implementations made outside register().'
+
+        self.generation += 1
+
+    def register(self, plugin, name=None):
+        res = super().register(plugin, name=name)
+        self.invalidate()
+        return res
+
+    def unregister(self, plugin=None, name=None):
+        res = super().unregister(plugin=plugin, name=name)
+        self.invalidate()
+        return res
+
+    def add_hookcall_monitoring(self, before, after):
+        undo = super().add_hookcall_monitoring(before, after)
+        self.monitors += 1
+        self.invalidate()
+
+        def remove():
+            undo()
+            self.monitors -= 1
+            self.invalidate()
+
+        return remove
+
+
 # Load the plugin manager and list available plugins
-pm = pluggy.PluginManager(USBQ_EP)
+pm = USBQPluginManager(USBQ_EP)
 pm.add_hookspecs(USBQHookSpec)
-pm.load_setuptools_entrypoints(USBQ_EP)
+load_entrypoints(pm, USBQ_EP)
 
 AVAILABLE_PLUGINS = OrderedDict(ChainMap({}, *pm.hook.usbq_declare_plugins()))
 
@@ -94,6 +219,36 @@ def enable_plugins(pm, pmlist=[], disabled=[], enabled=[]):
                 raise
 
 
+def enable_profiling(sample=1, top=20):
+    '''
+    Time each hook implementation and log a table of the slowest at teardown.
+
+    :param sample: Time 1 in sample calls of each implementation
+    '''
+    from .plugins.profile import HookProfiler
+
+    profiler = HookProfiler(sample=sample, top=top)
+    pm.register(profiler, name='profile')
+    log.info(f'Profiling hook implementations, sampling 1 in {sample} calls.')
+    return profiler
+
+
+def enable_binary_tracing(path=None, capacity=65536):
+    '''
+    Record hook calls into a ring buffer of binary records.
+
+    :param path: mmap the buffer to this file, None keeps it in memory
+    :param capacity: Number of records kept
+    '''
+    from .trace import TraceRecorder
+
+    recorder = TraceRecorder(capacity=capacity, path=path)
+    recorder.attach(pm)
+    pm.register(recorder, name='trace')
+    log.info(f'Recording the last {capacity} hook events to {path or "memory"}.')
+    return recorder
+
+
 def enable_tracing():
     # Trace pluggy
     tracer = logging.getLogger('trace')
@@ -0,0 +1,515 @@
+'''
+Software stand-in for the USBQ proxy hardware.
+
+The simulator plays both the host and the device side of the usbq_core UDP
+protocol so usbq can be load tested and profiled without the MITM board.
+The device side sends to usbq's listen port (64240 by default) and the host
+side listens on the proxy port (64241 by default), exactly as the board
+does.
+
+Every message the simulator sends is matched by its bytes when usbq
+forwards it back, which gives the round trip latency through usbq.
+'''
+
+import heapq
+import logging
+import select
+import socket
+import struct
+import time
+from collections import deque
+from collections import OrderedDict
+
+import attr
+from scapy.compat import raw
+
+from .defs import URBDefs
+from .defs import USBDefs
+from .dissect.usb import ConfigurationDescriptor
+from .dissect.usb import DeviceDescriptor
+from .dissect.usb import EndpointDescriptor
+from .dissect.usb import GetDescriptor
+from .dissect.usb import InterfaceDescriptor
+from .dissect.usb import StringDescriptor
+from .usbmitm_proto import EP_HEADER
+from .usbmitm_proto import EP_PAYLOAD_OFFSET
+from .usbmitm_proto import ManagementMessage
+from .usbmitm_proto import ManagementNewDevice
+from .usbmitm_proto import MESSAGE_HEADER
+from .usbmitm_proto import USBMessageDevice
+from .usbmitm_proto import USBMessageHost
+
+__all__ = [
+    'Simulator',
+    'SimulatorStats',
+    'Stream',
+    'usb_message',
+    'ack_message',
+    'new_device',
+    'default_descriptors',
+]
+
+log = logging.getLogger(__name__)
+
+LOOPBACK = '127.0.0.1'
+USB = USBMessageHost.MitmType.USB
+ACK = USBMessageHost.MitmType.ACK
+URB_IN = USBMessageHost.URBEPDirection.URB_IN
+URB_OUT = USBMessageHost.URBEPDirection.URB_OUT
+CTRL = USBDefs.EP.TransferType.CTRL
+
+#: Length of a control setup packet
+SETUP_LEN = 8
+
+#: Stream payloads start with a sequence number so every message is unique
+SEQ = struct.Struct('<I')
+
+#: Status of acks for unsupported control requests
+STALL = -32
+
+
+#
+# Messages
+#
+
+
+def usb_message(ep, payload=b'', type=USB):
+    '''
+    Raw usbq_core USB or ACK message.
+
+    :param ep: (epnum, eptype, epdir) as in USBEp
+    :param payload: Content following the endpoint
+    '''
+    return (
+        MESSAGE_HEADER.pack(EP_PAYLOAD_OFFSET + len(payload), type)
+        + EP_HEADER.pack(*ep)
+        + payload
+    )
+
+
+def ack_message(ep, status=0):
+    'Raw usbq_core ACK message for ep.'
+
+    return usb_message(ep, struct.pack('<i', status), type=ACK)
+
+
+def new_device():
+    'Raw management message announcing a new device, sent by the device side.'
+
+    return raw(
+        USBMessageDevice(
+            type=USBMessageDevice.MitmType.MANAGEMENT,
+            content=ManagementMessage(
+                management_type=ManagementMessage.ManagementType.NEW_DEVICE,
+                management_content=ManagementNewDevice(),
+            ),
+        )
+    )
+
+
+def default_descriptors():
+    'Descriptors of the simulated device keyed by (descriptor type, index).'
+
+    types = USBDefs.DescriptorType
+    return {
+        (types.DEVICE_DESCRIPTOR, 0): raw(DeviceDescriptor()),
+        (types.CONFIGURATION_DESCRIPTOR, 0): raw(
+            ConfigurationDescriptor(
+                descriptors=[InterfaceDescriptor(), EndpointDescriptor()]
+            )
+        ),
+        (types.STRING_DESCRIPTOR, 0): raw(StringDescriptor()),
+        (types.STRING_DESCRIPTOR, 1): raw(
+            StringDescriptor(bString='usbq'.encode('utf-16-le'))
+        ),
+        (types.STRING_DESCRIPTOR, 2): raw(
+            StringDescriptor(bString='usbq simulator'.encode('utf-16-le'))
+        ),
+    }
+
+
+def _get_descriptor(desc_type, index, length):
+    return raw(
+        GetDescriptor(bDescriptorType=desc_type, descriptor_index=index, wLength=length)
+    )
+
+
+def enumeration_requests(descriptors):
+    'Setup packets a host sends to enumerate a device with descriptors.'
+
+    types = USBDefs.DescriptorType
+    res = [_get_descriptor(types.DEVICE_DESCRIPTOR, 0, 64)]
+    for (desc_type, index), desc in descriptors.items():
+        if desc_type == types.CONFIGURATION_DESCRIPTOR:
+            # Header first, then the full configuration
+            res.append(_get_descriptor(desc_type, index, 9))
+        res.append(_get_descriptor(desc_type, index, len(desc)))
+    return res
+
+
+#
+# Traffic
+#
+
+TRANSFER_TYPES = {
+    'isoc': USBDefs.EP.TransferType.ISOC,
+    'bulk': USBDefs.EP.TransferType.BULK,
+    'int': USBDefs.EP.TransferType.INT,
+}
+
+
+@attr.s
+class Stream:
+    '''
+    Interrupt or bulk traffic on one endpoint.
+
+    IN streams are sent by the simulated device, OUT streams by the host.
+    '''
+
+    name = attr.ib(converter=str)
+    epnum = attr.ib(converter=int)
+
+    #: USBDefs.EP.TransferType
+    eptype = attr.ib(default=USBDefs.EP.TransferType.INT)
+
+    #: USBDefs.EP.Direction
+    direction = attr.ib(default=USBDefs.EP.Direction.IN)
+
+    #: Payload bytes per message
+    size = attr.ib(converter=int, default=8)
+
+    #: Messages per second, 0 sends as fast as the window allows
+    rate = attr.ib(converter=float, default=0)
+
+    #: Number of messages
+    count = attr.ib(converter=int, default=1000)
+
+    @classmethod
+    def parse(cls, spec):
+        '''
+        Parse NAME:EPNUM:TYPE:DIR[:SIZE[:RATE[:COUNT]]].
+
+        TYPE is int, bulk or isoc and DIR is in or out, e.g. hid:1:int:in:8:1000
+        '''
+        parts = spec.split(':')
+        if len(parts) < 4 or len(parts) > 7:
+            raise ValueError(f'Invalid stream {spec}')
+        name, epnum, eptype, direction = parts[:4]
+        if eptype not in TRANSFER_TYPES or direction not in ['in', 'out']:
+            raise ValueError(f'Invalid stream {spec}')
+        kwargs = dict(zip(['size', 'rate', 'count'], parts[4:]))
+        return cls(
+            name=name,
+            epnum=epnum,
+            eptype=TRANSFER_TYPES[eptype],
+            direction=(
+                USBDefs.EP.Direction.IN
+                if direction == 'in'
+                else USBDefs.EP.Direction.OUT
+            ),
+            **kwargs,
+        )
+
+    @property
+    def is_host(self):
+        return self.direction == USBDefs.EP.Direction.OUT
+
+    def messages(self):
+        'Yield (offset, name, is_host, data), offset in seconds from the start.'
+
+        epdir = URB_OUT if self.is_host else URB_IN
+        ep = (self.epnum, self.eptype, epdir)
+        fill = bytes(self.size)
+        for seq in range(self.count):
+            offset = seq / self.rate if self.rate > 0 else 0.0
+            payload = (SEQ.pack(seq) + fill)[: self.size]
+            yield offset, self.name, self.is_host, usb_message(ep, payload)
+
+
+def _percentile(values, q):
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+@attr.s
+class StreamStats:
+    'Round trip statistics for one kind of message.'
+
+    sent = attr.ib(default=0)
+    received = attr.ib(default=0)
+
+    #: Round trip times in seconds
+    latencies = attr.ib(factory=list, repr=False)
+
+    @property
+    def lost(self):
+        return self.sent - self.received
+
+    def summary(self):
+        lat = sorted(self.latencies)
+        return {
+            'sent': self.sent,
+            'received': self.received,
+            'lost': self.lost,
+            'latency_us': {
+                name: _percentile(lat, q) * 1e6
+                for name, q in [('p50', 0.5), ('p99', 0.99), ('p999', 0.999)]
+            },
+        }
+
+
+@attr.s
+class SimulatorStats:
+    'Simulator counters, per stream and in total.'
+
+    streams = attr.ib(factory=OrderedDict)
+
+    #: Forwarded messages that did not match a message in flight
+    unmatched = attr.ib(default=0)
+
+    #: perf_counter() at the first and last message
+    started = attr.ib(default=None)
+    finished = attr.ib(default=None)
+
+    def __getitem__(self, name):
+        if name not in self.streams:
+            self.streams[name] = StreamStats()
+        return self.streams[name]
+
+    @property
+    def total(self):
+        res = StreamStats()
+        for stats in self.streams.values():
+            res.sent += stats.sent
+            res.received += stats.received
+            res.latencies.extend(stats.latencies)
+        return res
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def summary(self):
+        total = self.total
+        elapsed = self.elapsed
+        return {
+            'elapsed': elapsed,
+            'throughput': total.received / elapsed if elapsed > 0 else 0.0,
+            'unmatched': self.unmatched,
+            'total': total.summary(),
+            'streams': {name: s.summary() for name, s in self.streams.items()},
+        }
+
+
+#
+# Simulator
+#
+
+
+@attr.s(cmp=False)
+class Simulator:
+    '''
+    Simulated USBQ proxy hardware.
+
+    Script messages are sent first, in order. Enumeration requests and
+    streams follow, interleaved by their rate.
+    '''
+
+    #: Address usbq listens on for the proxy device side
+    usbq_addr = attr.ib(default=(LOOPBACK, 64240), converter=tuple)
+
+    #: Address the host side binds to. usbq sends host bound packets here.
+    proxy_addr = attr.ib(default=(LOOPBACK, 64241), converter=tuple)
+
+    #: Fixed sequence of (is_host, data) messages
+    script = attr.ib(factory=list)
+
+    #: Interrupt and bulk streams
+    streams = attr.ib(factory=list)
+
+    #: Number of times the host enumerates the device
+    enumerations = attr.ib(converter=int, default=0)
+
+    #: Answer GET_DESCRIPTOR requests as the simulated device
+    respond = attr.ib(converter=bool, default=True)
+
+    #: Acknowledge forwarded USB data with ACK messages
+    ack = attr.ib(converter=bool, default=True)
+
+    #: Maximum number of messages in flight
+    window = attr.ib(converter=int, default=32)
+
+    #: Seconds without forwarded messages before giving up on those in flight
+    timeout = attr.ib(converter=float, default=1.0)
+
+    #: Seconds to wait for usbq to forward the new device announcement
+    connect_timeout = attr.ib(converter=float, default=5.0)
+
+    #: Descriptors keyed by (type, index), default_descriptors() if None
+    descriptors = attr.ib(default=None)
+
+    def __attrs_post_init__(self):
+        if self.descriptors is None:
+            self.descriptors = default_descriptors()
+
+        self.device_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.device_sock.bind((self.proxy_addr[0], 0))
+        self.host_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.host_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.host_sock.bind(self.proxy_addr)
+
+        #: Port usbq sends host bound packets to
+        self.proxy_port = self.host_sock.getsockname()[1]
+
+        self.stats = SimulatorStats()
+        self._usbq_host_addr = None
+        self._pending = {}
+        self._inflight = 0
+        self._responses = {}
+
+    def _schedule(self):
+        script = ((0.0, 'script', is_host, data) for is_host, data in self.script)
+
+        ep0 = (0, CTRL, URB_IN)
+        requests = enumeration_requests(self.descriptors)
+        control = (
+            (0.0, 'control', True, usb_message(ep0, setup))
+            for i in range(self.enumerations)
+            for setup in requests
+        )
+
+        streams = heapq.merge(
+            *[stream.messages() for stream in self.streams], key=lambda m: m[0]
+        )
+        yield from script
+        yield from heapq.merge(control, streams, key=lambda m: m[0])
+
+    def _track(self, name, data):
+        self.stats[name].sent += 1
+        self._pending.setdefault(data, deque()).append((time.perf_counter(), name))
+        self._inflight += 1
+
+    def _send(self, name, is_host, data):
+        if is_host:
+            self.host_sock.sendto(data, self._usbq_host_addr)
+        else:
+            self.device_sock.sendto(data, self.usbq_addr)
+        self._track(name, data)
+
+    def _match(self, data, now):
+        pending = self._pending.get(data, None)
+        if pending is None:
+            self.stats.unmatched += 1
+            return
+
+        sent, name = pending.popleft()
+        if len(pending) == 0:
+            del self._pending[data]
+        self._inflight -= 1
+
+        stats = self.stats[name]
+        stats.received += 1
+        stats.latencies.append(now - sent)
+
+    def _expire(self):
+        'Give up on the messages in flight. They count as lost.'
+
+        log.warning(f'{self._inflight} messages in flight timed out')
+        self._pending.clear()
+        self._inflight = 0
+
+    def _response(self, data):
+        'Reply of the simulated device to a host message, or None.'
+
+        length, mtype = MESSAGE_HEADER.unpack_from(data)
+        if mtype != USB or len(data) < EP_PAYLOAD_OFFSET:
+            return None, None
+        ep = EP_HEADER.unpack_from(data, MESSAGE_HEADER.size)
+
+        if ep[0] == 0 and ep[1] == CTRL and len(data) >= EP_PAYLOAD_OFFSET + SETUP_LEN:
+            setup = data[EP_PAYLOAD_OFFSET : EP_PAYLOAD_OFFSET + SETUP_LEN]
+            if setup[1] == URBDefs.Request.GET_DESCRIPTOR:
+                if not self.respond:
+                    return None, None
+                if setup not in self._responses:
+                    desc = self.descriptors.get((setup[3], setup[2]), None)
+                    if desc is None:
+                        self._responses[setup] = ack_message(ep, STALL)
+                    else:
+                        wlength = struct.unpack_from('<H', setup, 6)[0]
+                        self._responses[setup] = usb_message(ep, setup + desc[:wlength])
+                return 'response', self._responses[setup]
+
+        if self.ack:
+            return 'ack', ack_message(ep)
+        return None, None
+
+    def _recv(self, timeout):
+        read, _, _ = select.select(
+            [self.device_sock, self.host_sock], [], [], max(0, timeout)
+        )
+        for sock in read:
+            data, addr = sock.recvfrom(65536)
+            now = time.perf_counter()
+            if sock is self.host_sock:
+                self._usbq_host_addr = addr
+            self._match(data, now)
+
+            if sock is self.device_sock:
+                # Host message forwarded to the device
+                name, reply = self._response(data)
+                if reply is not None:
+                    self._send(name, False, reply)
+            elif self.ack and len(data) >= EP_PAYLOAD_OFFSET:
+                # Device message forwarded to the host
+                length, mtype = MESSAGE_HEADER.unpack_from(data)
+                if mtype == USB:
+                    ep = EP_HEADER.unpack_from(data, MESSAGE_HEADER.size)
+                    self._send('ack', True, ack_message(ep))
+        return len(read) > 0
+
+    def connect(self):
+        'Announce a device until usbq forwards it so both addresses are known.'
+
+        deadline = time.monotonic() + self.connect_timeout
+        while self._usbq_host_addr is None:
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    f'usbq at {self.usbq_addr} did not forward the new device message'
+                )
+            self._send('management', False, new_device())
+            end = time.monotonic() + min(self.timeout, 0.5)
+            while self._usbq_host_addr is None and time.monotonic() < end:
+                self._recv(end - time.monotonic())
+        log.info(f'Connected to usbq at {self.usbq_addr}')
+
+    def run(self):
+        'Send all traffic and wait for it to be forwarded.'
+
+        self.connect()
+        start = self.stats.started = time.perf_counter()
+
+        for offset, name, is_host, data in self._schedule():
+            due = start + offset
+            while True:
+                now = time.perf_counter()
+                if self._inflight < self.window:
+                    if now >= due:
+                        break
+                    self._recv(due - now)
+                elif not self._recv(self.timeout):
+                    self._expire()
+                    break
+            self._send(name, is_host, data)
+
+        while self._inflight > 0:
+            if not self._recv(self.timeout):
+                break
+        self.stats.finished = time.perf_counter()
+
+    def close(self):
+        self.device_sock.close()
+        self.host_sock.close()
@@ -0,0 +1,323 @@
+'''
+Binary hook call trace.
+
+Hook calls and returns are written as fixed-size records into a
+preallocated ring buffer, optionally backed by an mmap'ed file, instead of
+being formatted into log messages. ``usbq trace-dump`` decodes a trace file
+offline.
+
+A trace file holds a header, a table of hook and plugin names and the ring
+of records. The in-memory buffer has the same layout so it can be saved
+as is.
+'''
+
+import logging
+import mmap
+import struct
+import time
+
+import attr
+
+from .hookspec import hookimpl
+
+__all__ = ['TraceRecorder', 'TraceFile', 'TraceRecord']
+
+log = logging.getLogger(__name__)
+
+TRACE_MAGIC = b'USBQTRC\x00'
+TRACE_VERSION = 1
+
+#: magic, version, record size, capacity, records written, bytes of names
+TRACE_HEADER = struct.Struct('<8sHHIQI4x')
+COUNT = struct.Struct('<Q')
+COUNT_OFFSET = 16
+NAMES_LEN = struct.Struct('<I')
+NAMES_LEN_OFFSET = 24
+
+#: Space for the hook and plugin name table
+NAMES_SIZE = 64 * 1024
+NAMES_OFFSET = TRACE_HEADER.size
+RING_OFFSET = NAMES_OFFSET + NAMES_SIZE
+
+#: timestamp ns, call sequence, hook id, plugins id, event, value type, size
+RECORD = struct.Struct('<QIHHBBI2x')
+
+MAX_SIZE = 0xFFFFFFFF
+
+# Events
+CALL = 0
+RETURN = 1
+ERROR = 2
+EVENTS = ['call', 'return', 'error']
+
+# Types of the packet argument of calls and of results
+NONE = 0
+BOOL = 1
+INT = 2
+BYTES = 3
+LIST = 4
+OTHER = 5
+TYPES = ['none', 'bool', 'int', 'bytes', 'list', 'other']
+
+#: Hook arguments holding the packet of a call
+PAYLOAD_ARGS = ['data', 'pkt', 'batch']
+
+
+def _classify(value):
+    'Return the (type, size) of a value. size is the value of ints.'
+
+    if value is None:
+        return NONE, 0
+    if isinstance(value, bool):
+        return BOOL, int(value)
+    if isinstance(value, int):
+        return INT, min(max(value, 0), MAX_SIZE)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return BYTES, len(value)
+    if isinstance(value, list):
+        return LIST, len(value)
+    return OTHER, 0
+
+
+class TraceRecorder:
+    '''
+    Record hook calls into a ring buffer of fixed-size records.
+
+    attach() installs the recorder as hook call monitor of a plugin manager.
+
+    :param capacity: Number of records kept
+    :param path: Trace file to mmap, None keeps the trace in memory
+    '''
+
+    def __init__(self, capacity=65536, path=None):
+        self.capacity = int(capacity)
+        self.path = path
+        size = RING_OFFSET + self.capacity * RECORD.size
+
+        if path is None:
+            self._file = None
+            self._buf = bytearray(size)
+        else:
+            self._file = open(path, 'w+b')
+            self._file.truncate(size)
+            self._buf = mmap.mmap(self._file.fileno(), size)
+
+        TRACE_HEADER.pack_into(
+            self._buf,
+            0,
+            TRACE_MAGIC,
+            TRACE_VERSION,
+            RECORD.size,
+            self.capacity,
+            0,
+            0,
+        )
+
+        #: Records written, including the ones overwritten since
+        self.count = 0
+        self._seq = 0
+        self._stack = []
+        self._names_len = 0
+        self._hooks = {}
+        self._plugins = {}
+        self._plugins_cache = {}
+        self._detach = None
+
+    def attach(self, pm):
+        self._detach = pm.add_hookcall_monitoring(self.before, self.after)
+
+    def detach(self):
+        if self._detach is not None:
+            self._detach()
+            self._detach = None
+
+    def _intern(self, table, kind, name):
+        res = table.get(name, None)
+        if res is not None:
+            return res
+
+        res = table[name] = len(table)
+        entry = f'{kind} {res} {name}\n'.encode()
+        end = self._names_len + len(entry)
+        if end <= NAMES_SIZE:
+            self._buf[NAMES_OFFSET + self._names_len : NAMES_OFFSET + end] = entry
+            self._names_len = end
+            NAMES_LEN.pack_into(self._buf, NAMES_LEN_OFFSET, end)
+        else:
+            log.warning(f'Trace name table full. {name} is recorded as {kind}{res}.')
+        return res
+
+    def _plugins_id(self, hook_name, hook_impls):
+        # Hook implementations rarely change: compare with the previous call
+        cached = self._plugins_cache.get(hook_name, None)
+        if cached is not None and cached[0] == hook_impls:
+            return cached[1]
+
+        names = ','.join(impl.plugin_name for impl in reversed(hook_impls))
+        res = self._intern(self._plugins, 'p', names)
+        self._plugins_cache[hook_name] = (list(hook_impls), res)
+        return res
+
+    def _write(self, seq, hook, plugins, event, vtype, size):
+        n = self.count
+        RECORD.pack_into(
+            self._buf,
+            RING_OFFSET + (n % self.capacity) * RECORD.size,
+            time.perf_counter_ns(),
+            seq,
+            hook,
+            plugins,
+            event,
+            vtype,
+            size,
+        )
+        self.count = n + 1
+        COUNT.pack_into(self._buf, COUNT_OFFSET, self.count)
+
+    def before(self, hook_name, hook_impls, kwargs):
+        seq = self._seq = (self._seq + 1) & MAX_SIZE
+        self._stack.append(seq)
+
+        vtype, size = NONE, 0
+        for arg in PAYLOAD_ARGS:
+            if arg in kwargs:
+                vtype, size = _classify(kwargs[arg])
+                break
+
+        self._write(
+            seq,
+            self._intern(self._hooks, 'h', hook_name),
+            self._plugins_id(hook_name, hook_impls),
+            CALL,
+            vtype,
+            size,
+        )
+
+    def after(self, outcome, hook_name, hook_impls, kwargs):
+        seq = self._stack.pop() if len(self._stack) > 0 else 0
+        if outcome.exception is not None:
+            event, vtype, size = ERROR, OTHER, 0
+        else:
+            event = RETURN
+            vtype, size = _classify(outcome.get_result())
+
+        self._write(
+            seq,
+            self._intern(self._hooks, 'h', hook_name),
+            self._plugins_id(hook_name, hook_impls),
+            event,
+            vtype,
+            size,
+        )
+
+    @hookimpl
+    def usbq_ipython_ns(self):
+        return {'trace': self}
+
+    @hookimpl
+    def usbq_teardown(self):
+        self.flush()
+
+    def records(self):
+        'Decode the records in the buffer, oldest first.'
+
+        return TraceFile(self._buf).records()
+
+    def save(self, path):
+        'Write the trace to a file readable by TraceFile.'
+
+        with open(path, 'wb') as f:
+            f.write(self._buf)
+
+    def flush(self):
+        if self._file is not None:
+            self._buf.flush()
+
+    def close(self):
+        self.detach()
+        if self._file is not None:
+            self._buf.flush()
+            self._buf.close()
+            self._file.close()
+            self._file = None
+
+
+@attr.s(frozen=True)
+class TraceRecord:
+    'Decoded trace record.'
+
+    #: perf_counter_ns() of the event
+    ts = attr.ib()
+    seq = attr.ib()
+    hook = attr.ib()
+
+    #: Plugins called, in call order
+    plugins = attr.ib()
+    event = attr.ib()
+
+    #: Type of the packet argument of calls or of the result
+    type = attr.ib()
+
+    #: Length of bytes and lists, value of bools and ints
+    size = attr.ib()
+
+    def format(self, t0=0):
+        return (
+            f'{(self.ts - t0) / 1e6:12.3f}ms {self.seq:>8} {self.event:<6} '
+            f'{self.hook} [{self.plugins}] {self.type} {self.size}'
+        )
+
+
+class TraceFile:
+    'Trace saved by TraceRecorder.'
+
+    def __init__(self, buf):
+        if len(buf) < TRACE_HEADER.size:
+            raise ValueError('Not a usbq trace file.')
+        (
+            magic,
+            version,
+            record_size,
+            self.capacity,
+            self.count,
+            names_len,
+        ) = TRACE_HEADER.unpack_from(buf)
+        if magic != TRACE_MAGIC:
+            raise ValueError('Not a usbq trace file.')
+        if version != TRACE_VERSION or record_size != RECORD.size:
+            raise ValueError(f'Unsupported usbq trace file version {version}.')
+
+        self._buf = buf
+        self.hooks = {}
+        self.plugins = {}
+        names = bytes(buf[NAMES_OFFSET : NAMES_OFFSET + names_len]).decode()
+        for line in names.splitlines():
+            kind, num, name = line.split(' ', 2)
+            table = self.hooks if kind == 'h' else self.plugins
+            table[int(num)] = name
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            return cls(f.read())
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def records(self):
+        'Yield TraceRecords, oldest first.'
+
+        first = max(0, self.count - self.capacity)
+        for n in range(first, self.count):
+            ts, seq, hook, plugins, event, vtype, size = RECORD.unpack_from(
+                self._buf, RING_OFFSET + (n % self.capacity) * RECORD.size
+            )
+            yield TraceRecord(
+                ts=ts,
+                seq=seq,
+                hook=self.hooks.get(hook, f'h{hook}'),
+                plugins=self.plugins.get(plugins, f'p{plugins}'),
+                event=EVENTS[event] if event < len(EVENTS) else str(event),
+                type=TYPES[vtype] if vtype < len(TYPES) else str(vtype),
+                size=size,
+            )
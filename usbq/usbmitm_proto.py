@@ -8,7 +8,6 @@ from scapy.fields import LESignedIntField
 from scapy.fields import PacketField
 from scapy.fields import StrField
 from scapy.fields import struct
-from scapy.packet import Packet
 
 from .defs import AutoDescEnum
 from .defs import USBDefs
@@ -17,6 +16,7 @@ from .dissect.usb import ConfigurationDescriptor
 from .dissect.usb import Descriptor
 from .dissect.usb import DeviceDescriptor
 from .dissect.usb import GetDescriptor
+from .dissect.usb import TrackedPacket
 from .dissect.usb import URB
 
 __all__ = [
@@ -29,10 +29,14 @@ __all__ = [
     'USBMessageRequest',
     'USBMessageResponse',
     'USBAck',
+    'USBEpHeader',
+    'USBMessageHeader',
+    'decode_header',
+    'LazyUSBMessage',
 ]
 
 
-class USBMitm(Packet):
+class USBMitm(TrackedPacket):
     def desc(self):
         return '%r' % (self,)
 
@@ -218,6 +222,18 @@ class ManagementMessage(USBMitm):
 
 
 class USBMessage(USBMitm):
+    #: Original bytes the message was dissected from
+    wire = None
+
+    def pre_dissect(self, s):
+        self.wire = s
+        return s
+
+    @property
+    def cls(self):
+        'Message class. Also available without dissection on LazyUSBMessage.'
+        return type(self)
+
     def is_management(self):
         return self.type == 2
 
@@ -274,3 +290,218 @@ class USBMessageHost(USBMessage):
 
     def desc(self):
         return self.content.desc()
+
+
+#
+# Fast header decoding
+#
+
+#: len, type
+MESSAGE_HEADER = struct.Struct('<II')
+
+#: epnum, eptype, epdir
+EP_HEADER = struct.Struct('<HII')
+
+#: management_type
+MANAGEMENT_HEADER = struct.Struct('<I')
+
+#: Offset of the message content
+CONTENT_OFFSET = MESSAGE_HEADER.size
+
+#: Offset of the content following USBEp in USB and ACK messages
+EP_PAYLOAD_OFFSET = CONTENT_OFFSET + EP_HEADER.size
+
+
+class USBEpHeader:
+    'Endpoint fields of a usbq_core message. Mirrors USBEp.'
+
+    __slots__ = ('epnum', 'eptype', 'epdir')
+
+    def __init__(self, epnum, eptype, epdir):
+        self.epnum = epnum
+        self.eptype = eptype
+        self.epdir = epdir
+
+    def is_ctrl_0(self):
+        return self.epnum == 0 and self.eptype == USBDefs.EP.TransferType.CTRL
+
+    def is_interrupt(self):
+        return self.eptype == USBDefs.EP.TransferType.INT
+
+    def __eq__(self, other):
+        return (self.epnum, self.eptype, self.epdir) == (
+            other.epnum,
+            other.eptype,
+            other.epdir,
+        )
+
+    def __repr__(self):
+        return (
+            f'<USBEpHeader epnum={self.epnum} eptype={self.eptype} epdir={self.epdir}>'
+        )
+
+
+class USBMessageHeader:
+    '''
+    Fixed header of a usbq_core message decoded with struct.
+
+    The scapy class (USBMessageHost or USBMessageDevice) remains the source
+    of truth. Its full dissection is built on first access of ``packet``.
+    '''
+
+    __slots__ = ('cls', 'wire', 'len', 'type', 'ep', 'management_type', '_packet')
+
+    def __init__(self, cls, wire):
+        self.cls = cls
+        self.wire = wire
+        self.len, self.type = MESSAGE_HEADER.unpack_from(wire)
+        self.ep = None
+        self.management_type = None
+        self._packet = None
+
+        if self.type == USBMitm.MitmType.MANAGEMENT:
+            (self.management_type,) = MANAGEMENT_HEADER.unpack_from(
+                wire, CONTENT_OFFSET
+            )
+        elif len(wire) >= EP_PAYLOAD_OFFSET:
+            self.ep = USBEpHeader(*EP_HEADER.unpack_from(wire, CONTENT_OFFSET))
+
+    @property
+    def packet(self):
+        'Full scapy dissection of the message.'
+
+        if self._packet is None:
+            # scapy needs bytes, wire may be a view of a receive buffer
+            self._packet = self.cls(bytes(self.wire))
+        return self._packet
+
+    @property
+    def ep_payload(self):
+        'Content following the endpoint header of USB and ACK messages.'
+
+        if self.ep is None:
+            return memoryview(b'')
+        return memoryview(self.wire)[EP_PAYLOAD_OFFSET:]
+
+    def is_management(self):
+        return self.type == USBMitm.MitmType.MANAGEMENT
+
+    def is_ack(self):
+        return self.type == USBMitm.MitmType.ACK
+
+    def is_usb_data(self):
+        return self.type == USBMitm.MitmType.USB
+
+    def __repr__(self):
+        return f'<USBMessageHeader {self.cls.name} len={self.len} type={self.type} ep={self.ep}>'
+
+
+def decode_header(cls, data):
+    '''
+    Decode the fixed header of a usbq_core message.
+
+    :param cls: USBMessageHost or USBMessageDevice
+    :param data: Raw bytes from the usbq_core driver
+
+    Raises struct.error if data is too short to hold a message header.
+    '''
+    return USBMessageHeader(cls, data)
+
+
+class LazyUSBMessage:
+    '''
+    USBMessageHost or USBMessageDevice that defers scapy dissection.
+
+    ``type``, ``len`` and ``ep`` are served from the struct decoded header
+    until the message is dissected.
+    Any other attribute access dissects the message on first use, caches
+    the result and delegates to it.
+    '''
+
+    __slots__ = ('_header',)
+
+    def __init__(self, cls, wire):
+        object.__setattr__(self, '_header', USBMessageHeader(cls, wire))
+
+    @property
+    def cls(self):
+        return self._header.cls
+
+    @property
+    def wire(self):
+        return self._header.wire
+
+    @property
+    def header(self):
+        return self._header
+
+    @property
+    def packet(self):
+        return self._header.packet
+
+    def is_dissected(self):
+        return self._header._packet is not None
+
+    @property
+    def len(self):
+        if self.is_dissected():
+            return self.packet.len
+        return self._header.len
+
+    @property
+    def type(self):
+        if self.is_dissected():
+            return self.packet.type
+        return self._header.type
+
+    @property
+    def ep(self):
+        '''
+        USBEpHeader of the message, None for management messages.
+
+        Always a read-only copy: modify ``pkt.content.ep`` to change the
+        endpoint of the message.
+        '''
+        if self.is_dissected():
+            ep = getattr(self.packet.content, 'ep', None)
+            if ep is None:
+                return None
+            return USBEpHeader(ep.epnum, ep.eptype, ep.epdir)
+        return self._header.ep
+
+    def is_management(self):
+        return self.type == USBMitm.MitmType.MANAGEMENT
+
+    def is_ack(self):
+        return self.type == USBMitm.MitmType.ACK
+
+    def is_usb_data(self):
+        return self.type == USBMitm.MitmType.USB
+
+    def is_dirty(self):
+        return self.is_dissected() and self.packet.is_dirty()
+
+    def __getattr__(self, name):
+        return getattr(self._header.packet, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._header.packet, name, value)
+
+    def __contains__(self, cls):
+        # Management content is determined by the header alone
+        if cls is ManagementMessage:
+            return self.is_management()
+        return cls in self.packet
+
+    def __bytes__(self):
+        if self.is_dirty():
+            return bytes(self.packet)
+        return bytes(self.wire)
+
+    def __len__(self):
+        if self.is_dirty():
+            return len(bytes(self.packet))
+        return len(self.wire)
+
+    def __repr__(self):
+        return repr(self.packet)
@@ -7,8 +7,14 @@ __all__ = [
     'usbhost_to_usbpcap',
     'req_from_msg',
     'ack_from_msg',
+    'pack_usbdev',
+    'pack_usbhost',
+    'pack_req',
+    'pack_ack',
 ]
 
+import struct
+
 from scapy.fields import (
     BitEnumField,
     BitField,
@@ -22,6 +28,7 @@ from scapy.fields import (
     PacketField,
     StrField,
 )
+from scapy.compat import raw
 from scapy.packet import Packet
 
 from .defs import USBDefs
@@ -56,6 +63,30 @@ eptype_to_pcap_type = {
 }
 pcaptype_to_eptype = {v: k for k, v in list(eptype_to_pcap_type.items())}
 
+#: urb_id, urb_type, urb_transfert, endpoint, device, bus_id,
+#: device_setup_request, data_present, urb_sec, urb_usec, urb_status,
+#: urb_length, data_length
+USBMON_HEADER = struct.Struct('<QcBBBHBBQIiII')
+
+#: Size of the usbmon header including setup packet and padding
+USBMON_HEADER_LEN = 64
+USBMON_SETUP_LEN = USBMON_HEADER_LEN - USBMON_HEADER.size
+
+#: PCAP file header: magic, version major, version minor, thiszone,
+#: sigfigs, snaplen, linktype
+PCAP_HEADER = struct.Struct('<IHHiIII')
+PCAP_MAGIC = 0xA1B2C3D4
+PCAP_SNAPLEN = 65535
+LINKTYPE_USB_LINUX = 220
+
+#: PCAP record header: ts_sec, ts_usec, incl_len, orig_len
+RECORD_HEADER = struct.Struct('<IIII')
+
+SETUP_RELEVANT = 0
+SETUP_NOT_RELEVANT = 0x2D
+DATA_PRESENT = 0
+DATA_NOT_PRESENT = 0x3E
+
 pcap_garbage = '\x00\x00\x00\x00\x00\x00\x00\x00\x08\x00\x00\x00\x00\x00\x00\x00\x04\x02\x00\x00\x00\x00\x00\x00'
 
 
@@ -144,6 +175,126 @@ def ack_from_msg(msg):
     return ack
 
 
+#
+# Fast serialization
+#
+# These produce the same bytes as raw() of the USBPcap objects built above
+# without constructing them. The USBPcap path remains the reference.
+#
+
+_no_setup = bytes(USBMON_SETUP_LEN)
+
+
+def _pack(msg, urb_type, setup_flag, data_flag, urb_length, data_length, setup, data):
+    'Pack a usbmon record.'
+
+    ep = msg.ep
+    epaddr = ep.epnum & 0x7F
+    if ep.epdir != msg.URBEPDirection.URB_OUT:
+        epaddr |= 0x80
+
+    header = USBMON_HEADER.pack(
+        0,
+        urb_type,
+        eptype_to_pcap_type[ep.eptype],
+        epaddr,
+        1,
+        1,
+        setup_flag,
+        data_flag,
+        0,
+        0,
+        0,
+        urb_length,
+        data_length,
+    )
+    if setup is None:
+        setup = _no_setup
+    else:
+        setup = (setup + _no_setup)[:USBMON_SETUP_LEN]
+    return b''.join((header, setup, data))
+
+
+def _setup(msg, eptype):
+    'Setup packet bytes, only recorded for CTRL submissions.'
+
+    if eptype != USBDefs.EP.TransferType.CTRL or msg.request is None:
+        return None
+    return raw(msg.request)
+
+
+def pack_usbdev(msg: USBMessageDevice):
+    ''' Serialize a USBMessageDevice message as a usbmon record '''
+    eptype = msg.ep.eptype
+    data_flag = DATA_PRESENT if eptype == 1 else DATA_NOT_PRESENT
+    data = msg.data
+
+    if (
+        msg.ep.is_ctrl_0()
+        and msg.ep.epdir == msg.URBEPDirection.URB_IN
+        and msg.response is not None
+    ):
+        descriptor = raw(msg.response)
+        length = len(descriptor) + len(data)
+        if length > 0:
+            data = descriptor + data
+    else:
+        length = len(data)
+    return _pack(
+        msg,
+        COMPLETE.encode(),
+        SETUP_NOT_RELEVANT,
+        data_flag,
+        length,
+        length,
+        None,
+        data,
+    )
+
+
+def pack_usbhost(msg: USBMessageHost):
+    ''' Serialize a USBMessageHost message as a usbmon record '''
+    eptype = msg.ep.eptype
+    data_flag = DATA_NOT_PRESENT if eptype == 1 else DATA_PRESENT
+    if msg.ep.is_ctrl_0() and msg.ep.epdir == USBDefs.EP.Direction.OUT:
+        urb_length = msg.request.wLength
+        data_length = 0
+    else:
+        urb_length = len(msg.data)
+        data_length = len(msg.data)
+    return _pack(
+        msg,
+        SUBMIT.encode(),
+        SETUP_RELEVANT,
+        data_flag,
+        urb_length,
+        data_length,
+        _setup(msg, eptype),
+        msg.data,
+    )
+
+
+def pack_req(msg):
+    ''' Serialize the request that has generated msg '''
+    return _pack(
+        msg, SUBMIT.encode(), SETUP_RELEVANT, DATA_PRESENT, len(msg.data), 0, None, b''
+    )
+
+
+def pack_ack(msg):
+    ''' Serialize the ack for the msg '''
+    if (
+        msg.ep.eptype == USBDefs.EP.TransferType.CTRL
+        and msg.ep.epdir == USBDefs.EP.Direction.OUT
+    ):
+        urb_length = msg.request.wLength
+    else:
+        urb_length = len(msg.data)
+    return _pack(
+        msg, COMPLETE.encode(), SETUP_RELEVANT, DATA_PRESENT, urb_length, 0, None, b''
+    )
+
+
 class USBPcap(Packet):
     ''' Packet used in pcap files '''
 